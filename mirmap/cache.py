@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+
+#
+# Copyright (C) 2011-2013 Charles E. Vejnar
+#
+# This is free software, licensed under the GNU General Public License v3.
+# See /LICENSE for more information.
+#
+
+"""
+Persistent caches of results costly to compute (i.e. with an external
+program): an in-memory LRU in front of an optional SQLite store.
+"""
+
+import collections
+import hashlib
+import json
+import sqlite3
+
+from mirmap import prob, utils, vienna
+
+
+def make_key(*parts):
+  """
+  Canonical key of JSON-serializable parts (tuples are lists), stable across
+  runs and processes.
+  """
+  return hashlib.sha1(json.dumps(
+    parts, sort_keys=True, separators=(',', ':')
+  ).encode('utf-8')).hexdigest()
+
+
+def background_key(alphabet, markov_order, transitions):
+  """
+  Canonical key of a Markov background model, independent of the order of
+  the alphabet (i.e. from a set).
+  """
+  probs = zip(prob.permutations(alphabet, markov_order + 1),
+              utils.flatten(transitions))
+  return make_key(sorted(alphabet), markov_order,
+                  sorted([word, float(p)] for word, p in probs))
+
+
+class ResultCache(object):
+  """
+  Two-level cache of JSON-serializable values by string key.
+
+  Args:
+    path (str): SQLite database filename (None: in-memory LRU only).
+    maxsize (int): Number of values kept in memory.
+    table (str): Name of the SQLite table, to share a database.
+  """
+
+  def __init__(self, path=None, maxsize=100000, table='results'):
+    self.memory = utils.LRUCache(maxsize)
+    self.table = table
+    self.disk_hits = 0
+    self.misses = 0
+    if path is None:
+      self.db = None
+    else:
+      self.db = sqlite3.connect(path)
+      self.db.execute(
+        'CREATE TABLE IF NOT EXISTS %s (key TEXT PRIMARY KEY, value TEXT)' %
+        table)
+      self.db.commit()
+
+  def get(self, key, default=None):
+    try:
+      return self.memory[key]
+    except KeyError:
+      pass
+    if self.db is not None:
+      row = self.db.execute(
+        'SELECT value FROM %s WHERE key = ?' % self.table, (key,)).fetchone()
+      if row is not None:
+        self.disk_hits += 1
+        value = json.loads(row[0])
+        self.memory[key] = value
+        return value
+    self.misses += 1
+    return default
+
+  def __getitem__(self, key):
+    value = self.get(key, KeyError)
+    if value is KeyError:
+      raise KeyError(key)
+    return value
+
+  def set_many(self, items):
+    """Stores (key, value) pairs, in one transaction."""
+    items = list(items)
+    for key, value in items:
+      self.memory[key] = value
+    if self.db is not None:
+      self.db.executemany(
+        'INSERT OR REPLACE INTO %s (key, value) VALUES (?, ?)' % self.table,
+        [(key, json.dumps(value)) for key, value in items])
+      self.db.commit()
+
+  def __setitem__(self, key, value):
+    self.set_many([(key, value)])
+
+  def close(self):
+    if self.db is not None:
+      self.db.close()
+      self.db = None
+
+  @property
+  def stats(self):
+    """Memory and disk hits (computations avoided) and misses."""
+    return {
+      'memory_hits': self.memory.hits,
+      'disk_hits': self.disk_hits,
+      'hits': self.memory.hits + self.disk_hits,
+      'misses': self.misses,
+      'size': len(self.memory),
+    }
+
+
+class CachedExactProb(object):
+  """
+  Exact probabilities (spatt.Spatt or exact.ExactProb) with a ResultCache,
+  keyed by engine name and version, motif, observed count, sequence length
+  and background model.
+
+  Args:
+    backend: spatt.Spatt or exact.ExactProb instance.
+    cache (ResultCache): Defaults to an in-memory cache.
+  """
+
+  def __init__(self, backend, cache=None):
+    self.backend = backend
+    self.cache = ResultCache() if cache is None else cache
+    if hasattr(backend, 'version'):
+      version = backend.version()
+    else:
+      version = ''
+    self.engine = (type(backend).__name__, version)
+    self._background = None
+
+  def _background_key(self, alphabet, markov_order, transitions):
+    """
+    Returns background_key, computed once for the same transitions (object,
+    kept referenced: not to be modified in place).
+    """
+    args = (tuple(alphabet), markov_order, transitions)
+    if (self._background is None or self._background[0][2] is not transitions
+        or self._background[0][:2] != args[:2]):
+      self._background = (args, background_key(*args))
+    return self._background[1]
+
+  def _key(self, motif, nobs, length_seq, background):
+    return make_key('exact_prob', self.engine, motif, nobs, length_seq,
+                    background)
+
+  def get_exact_prob(self, **kwargs):
+    return self.get_exact_probs(
+      [kwargs['motif']], [kwargs['nobs']], kwargs['length_seq'],
+      kwargs['alphabet'], kwargs['transitions'], kwargs['markov_order'],
+      seq=kwargs.get('seq'), direction=kwargs.get('direction', 'o')
+    )[0]
+
+  def get_exact_probs(self, motifs, nobs, length_seq, alphabet, transitions,
+                      markov_order, seq=None, direction='o'):
+    """
+    Returns P(N >= nobs) for many motifs, computing only the ones missing in
+    the cache.
+    """
+    background = self._background_key(alphabet, markov_order, transitions)
+    keys = [self._key(motif, n, length_seq, background)
+            for motif, n in zip(motifs, nobs)]
+    probs = [self.cache.get(key) for key in keys]
+    missing = sorted(set(
+      (motifs[i], nobs[i], keys[i]) for i, p in enumerate(probs) if p is None
+    ))
+    if len(missing) > 0:
+      if hasattr(self.backend, 'get_exact_probs'):
+        computed = self.backend.get_exact_probs(
+          [m[0] for m in missing], [m[1] for m in missing], length_seq,
+          alphabet, transitions, markov_order)
+      else:
+        computed = [self.backend.get_exact_prob(
+          seq=seq, motif=motif, nobs=n, length_seq=length_seq,
+          alphabet=alphabet, transitions=transitions,
+          markov_order=markov_order, direction=direction
+        ) for motif, n, _ in missing]
+      self.cache.set_many(
+        (key, p) for (_, _, key), p in zip(missing, computed))
+      computed = dict((key, p) for (_, _, key), p in zip(missing, computed))
+      probs = [computed[key] if p is None else p
+               for key, p in zip(keys, probs)]
+    return probs
+
+
+class CachedRNAvienna(vienna.RNAvienna):
+  """
+  RNAvienna with a ResultCache of the folding results, keyed by program,
+  sequence(s), constraints, partition function flag, temperature and
+  program version. Only the missing results are folded.
+
+  Args:
+    cache (ResultCache): Defaults to an in-memory cache.
+    The other arguments are the RNAvienna ones.
+  """
+
+  def __init__(self, cache=None, **kwargs):
+    vienna.RNAvienna.__init__(self, **kwargs)
+    self.cache = ResultCache() if cache is None else cache
+
+  def _fold_many(self, records, prog, constraints=None, **kwargs):
+    version = self.version(prog)
+    partfunc = kwargs.get('partfunc', False)
+    temperature = kwargs.get('temperature')
+    keys = [
+      make_key('vienna', prog, version, seqs,
+               None if constraints is None else constraints[i],
+               partfunc, temperature)
+      for i, seqs in enumerate(records)
+    ]
+    results = [self.cache.get(key) for key in keys]
+    missing = collections.OrderedDict(
+      (key, i) for i, (key, result) in enumerate(zip(keys, results))
+      if result is None
+    )
+    if len(missing) > 0:
+      indexes = list(missing.values())
+      computed = vienna.RNAvienna._fold_many(
+        self,
+        [records[i] for i in indexes],
+        prog,
+        None if constraints is None else [constraints[i] for i in indexes],
+        **kwargs
+      )
+      self.cache.set_many(zip(missing.keys(), computed))
+      computed = dict(zip(missing.keys(), computed))
+      results = [computed[key] if result is None else result
+                 for key, result in zip(keys, results)]
+    return results
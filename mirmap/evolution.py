@@ -11,9 +11,11 @@
 
 import collections
 import copy
+import itertools
 
 import dendropy
 
+from mirmap import seed, sites, utils
 from mirmap.phast import Phast
 
 
@@ -76,6 +78,10 @@ class mmEvolution(object):
     motif_downstream_extension (int): Downstream extension length.
   """
 
+  #: Per-site features, columns of site_table (sites.module_table)
+  cons_blss = sites.ColumnList('cons_bls')
+  selec_phylops = sites.ColumnList('selec_phylop')
+
   def __init__(self, seed, **kwargs):
     self.seed = seed
     defaults = {
@@ -91,7 +97,11 @@ class mmEvolution(object):
     self.__dict__.update(defaults)
     self._routine_done = False
 
-  def _eval_routine(self, setup, worker, **kwargs):
+  def _iter_routine(self, setup, worker, sites=None, **kwargs):
+    """
+    Loads the alignment and returns an iterator computing the feature of
+    each site (seed.Site, defaults to the sites found by the seed search).
+    """
     # Parameters
     if 'aln_fname' not in kwargs and 'aln' not in kwargs:
       raise IOError('An alignment is required')
@@ -123,38 +133,41 @@ class mmEvolution(object):
       'aln_format': aln_format
     })
 
-    # Reset
-    out = []
-
-    # Compute
-    for its in range(len(self.seed.end_sites)):
-      end_site = self.seed.end_sites[its]
-      # Motif
-      # start_motif and end_motif are sequence coordinates => 1-based
-      start_motif, end_motif = seed.get_motif_coordinates(
-        end_site, self.motif_def, self.seed.pairings[its],
-        self.motif_upstream_extension, self.motif_downstream_extension,
-        self.seed.min_target_length
-      )
-      motif = self.seed.target_seq[start_motif - 1:end_motif].replace('U', 'T')
-
-      # Species with seed(s)
-      species_with_seed = []
-      for seq_name, seq in seqs_cleaned.items():
-        if seq.find(motif) != -1:
-          species_with_seed.append(seq_name)
-
-      args.update({
-        'species_with_seed': species_with_seed,
-        'start_motif': start_motif,
-        'end_motif': end_motif,
-        'seqs_coords': seqs_coords
-      })
-      out.append(worker(**args))
-
-    return out
+    if sites is None:
+      sites = self.seed.found_sites()
+
+    def compute():
+      for site in sites:
+        # Motif
+        # start_motif and end_motif are sequence coordinates => 1-based
+        start_motif, end_motif = seed.get_motif_coordinates(
+          site.end_site, self.motif_def, site.pairing,
+          self.motif_upstream_extension, self.motif_downstream_extension,
+          self.seed.min_target_length
+        )
+        motif = self.seed.target_seq[start_motif - 1:end_motif]
+        motif = motif.replace('U', 'T')
 
-  def _eval_cons_bls(self, **kwargs):
+        # Species with seed(s)
+        species_with_seed = []
+        for seq_name, seq in seqs_cleaned.items():
+          if seq.find(motif) != -1:
+            species_with_seed.append(seq_name)
+
+        args.update({
+          'species_with_seed': species_with_seed,
+          'start_motif': start_motif,
+          'end_motif': end_motif,
+          'seqs_coords': seqs_coords
+        })
+        yield worker(**args)
+
+    return compute()
+
+  def _eval_routine(self, setup, worker, **kwargs):
+    return list(self._iter_routine(setup, worker, **kwargs))
+
+  def _cons_bls_routine(self, **kwargs):
     def setup(**kwargs):
       return {
         'subst_model': kwargs.get('subst_model', self.subst_model),
@@ -200,10 +213,15 @@ class mmEvolution(object):
       else:
         return 0.0
 
-    self.cons_blss = self._eval_routine(setup, worker, **kwargs)
-    return self.cons_blss
+    return setup, worker
 
-  def _eval_selec_phylop(self, **kwargs):
+  def _eval_cons_bls(self, **kwargs):
+    setup, worker = self._cons_bls_routine(**kwargs)
+    cons_blss = self._eval_routine(setup, worker, **kwargs)
+    self.cons_blss = cons_blss
+    return cons_blss
+
+  def _selec_phylop_routine(self, **kwargs):
     def setup(**kwargs):
       return {
         'method': kwargs.get('method', self.method),
@@ -242,16 +260,48 @@ class mmEvolution(object):
         )
       return pval
 
-    self.selec_phylops = self._eval_routine(setup, worker, **kwargs)
-    return self.selec_phylops
+    return setup, worker
+
+  def _eval_selec_phylop(self, **kwargs):
+    setup, worker = self._selec_phylop_routine(**kwargs)
+    selec_phylops = self._eval_routine(setup, worker, **kwargs)
+    self.selec_phylops = selec_phylops
+    return selec_phylops
+
+  def iter_features(self, sites=None, **kwargs):
+    """
+    Computes the evolutionary features site by site. Takes the same
+    arguments as routine.
+
+    Args:
+      sites (iterable): Sites (seed.Site) to evaluate. Defaults to the
+        sites streamed by the seed search.
+
+    Returns:
+      iterator: The sites and a dict of their features.
+    """
+    if sites is None:
+      sites = self.seed.iter_sites()
+    sites, sites_bls, sites_phylop = itertools.tee(sites, 3)
+    cons_blss = self._iter_routine(
+      *self._cons_bls_routine(**kwargs), sites=sites_bls, **kwargs
+    )
+    selec_phylops = self._iter_routine(
+      *self._selec_phylop_routine(**kwargs), sites=sites_phylop, **kwargs
+    )
+    return (
+      (site, {'cons_bls': cons_bls, 'selec_phylop': selec_phylop})
+      for site, cons_bls, selec_phylop in utils.izip(
+        sites, cons_blss, selec_phylops)
+    )
 
   def routine(self, **kwargs):
     try:
       self._eval_cons_bls(**kwargs)
       self._eval_selec_phylop(**kwargs)
     except IOError:
-      self.cons_blss = [0 for _ in range(len(self.seed.end_sites))]
-      self.selec_phylops = [0 for _ in range(len(self.seed.end_sites))]
+      self.cons_blss = [0 for _ in range(len(self.seed.site_table))]
+      self.selec_phylops = [0 for _ in range(len(self.seed.site_table))]
     self._routine_done = True
 
   @property
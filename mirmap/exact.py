@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+
+#
+# Copyright (C) 2011-2013 Charles E. Vejnar
+#
+# This is free software, licensed under the GNU General Public License v3.
+# See /LICENSE for more information.
+#
+
+"""
+Exact probability of the number of occurrences of a motif in a random
+sequence under a Markov model, computed in-process instead of with SPATT.
+
+The sequence is generated letter by letter by a pattern automaton: its
+states are the longest suffixes of the sequence which are either a motif
+prefix at least markov_order long, or a word of length markov_order (the
+Markov context). The count of (overlapping) occurrences is embedded in the
+chain, saturated at the observed count.
+
+As sspatt run by spatt.Spatt (whose sequence file holds the motif), the
+sequence starts with the first markov_order letters of the motif.
+"""
+
+import numpy as np
+
+from mirmap import prob, utils
+
+#: Above this number of (automaton state, count) pairs, the distribution is
+#: computed step by step instead of with matrix powers
+MAX_POWER_STATES = 256
+
+#: Version of the algorithm, part of the cached results keys (to increase
+#: when the results change)
+VERSION = '2'
+
+
+def pattern_automaton(motif, alphabet, markov_order):
+  """
+  Builds the pattern automaton of a motif.
+
+  Returns:
+    tuple: The states (str), and for every state and letter the next state
+      index, the Markov transition index (in get_transitions order) and
+      whether an occurrence ends there.
+  """
+  alphabet = list(alphabet)
+  nb_symbols = len(alphabet)
+  states = list(prob.permutations(alphabet, markov_order))
+  states += [motif[:l] for l in range(max(markov_order, 1), len(motif) + 1)
+             if motif[:l] not in states]
+  indexes = dict((state, i) for i, state in enumerate(states))
+  next_states = np.zeros((len(states), nb_symbols), dtype=np.int64)
+  words = np.zeros((len(states), nb_symbols), dtype=np.int64)
+  hits = np.zeros((len(states), nb_symbols), dtype=bool)
+  for i, state in enumerate(states):
+    context = 0
+    for nt in state[len(state) - markov_order:]:
+      context = context * nb_symbols + alphabet.index(nt)
+    for j, nt in enumerate(alphabet):
+      text = state + nt
+      for start in range(len(text) + 1):
+        if text[start:] in indexes:
+          next_states[i, j] = indexes[text[start:]]
+          break
+      words[i, j] = context * nb_symbols + j
+      hits[i, j] = len(motif) > 0 and text.endswith(motif)
+  return states, next_states, words, hits
+
+
+def stationary_distribution(alphabet, markov_order, transitions):
+  """
+  Stationary distribution of the words of length markov_order (in
+  permutations order). Words without transition probabilities are left
+  uniformly.
+  """
+  nb_symbols = len(alphabet)
+  nb_words = nb_symbols ** markov_order
+  probs = np.array(utils.flatten(transitions), dtype=np.float64)
+  probs = probs.reshape(nb_words, nb_symbols)
+  sums = probs.sum(axis=1)
+  probs[sums == 0] = 1. / nb_symbols
+  probs /= probs.sum(axis=1)[:, None]
+  chain = np.zeros((nb_words, nb_words))
+  for w in range(nb_words):
+    for a in range(nb_symbols):
+      chain[w, (w * nb_symbols + a) % nb_words] += probs[w, a]
+  values, vectors = np.linalg.eig(chain.T)
+  vector = np.real(vectors[:, np.argmin(np.abs(values - 1.))])
+  vector = np.abs(vector)
+  return vector / vector.sum()
+
+
+def count_distribution(motif, length_seq, max_count, alphabet, transitions,
+                       markov_order, start_word=None):
+  """
+  Distribution of the number of (overlapping) occurrences of a motif in a
+  sequence of length length_seq, starting with start_word (markov_order
+  letters), or with the first markov_order letters following the
+  stationary distribution if start_word is None.
+
+  Returns:
+    numpy.ndarray: P(N = c) for c < max_count, and P(N >= max_count) last.
+  """
+  dist = np.zeros(max_count + 1)
+  if max_count == 0 or length_seq < max(markov_order, 1):
+    dist[0] = 1.
+    return dist
+  if any(nt not in alphabet for nt in motif):
+    dist[0] = 1.
+    return dist
+  states, next_states, words, hits = pattern_automaton(
+    motif, alphabet, markov_order)
+  probs = np.array(utils.flatten(transitions), dtype=np.float64)
+  nb_states = len(states)
+  nb_counts = max_count + 1
+
+  # Initial distribution of the (state, count) pairs
+  if start_word is None:
+    start_probs = stationary_distribution(alphabet, markov_order, transitions)
+  else:
+    start_probs = np.zeros(len(alphabet) ** markov_order)
+    start_probs[states.index(start_word)] = 1.
+  start = np.zeros((nb_states, nb_counts))
+  for i, p in enumerate(start_probs):
+    word = states[i]
+    count = sum(1 for j in range(len(word) - len(motif) + 1)
+                if len(motif) > 0 and word[j:j + len(motif)] == motif)
+    start[i, min(count, max_count)] += p
+  nb_steps = length_seq - markov_order
+
+  if nb_states * nb_counts <= MAX_POWER_STATES:
+    chain = np.zeros((nb_states * nb_counts, nb_states * nb_counts))
+    for c in range(nb_counts):
+      for i in range(nb_states):
+        for j in range(len(alphabet)):
+          c_next = min(c + hits[i, j], max_count)
+          chain[i * nb_counts + c, next_states[i, j] * nb_counts + c_next] += \
+            probs[words[i, j]]
+    end = start.reshape(-1).dot(np.linalg.matrix_power(chain, nb_steps))
+    return end.reshape(nb_states, nb_counts).sum(axis=0)
+
+  # Step by step: one matrix without occurrence, one with
+  no_hit = np.zeros((nb_states, nb_states))
+  hit = np.zeros((nb_states, nb_states))
+  for i in range(nb_states):
+    for j in range(len(alphabet)):
+      (hit if hits[i, j] else no_hit)[i, next_states[i, j]] += \
+        probs[words[i, j]]
+  no_hit_t, hit_t = no_hit.T, hit.T
+  dist = start
+  for _ in range(nb_steps):
+    shifted = hit_t.dot(dist)
+    dist = no_hit_t.dot(dist)
+    dist[:, 1:] += shifted[:, :-1]
+    dist[:, -1] += shifted[:, -1]
+  return dist.sum(axis=0)
+
+
+def start_word(motif, markov_order):
+  """
+  First markov_order letters of the sequence, as read by sspatt from the
+  sequence file of spatt.Spatt (the motif). None if the motif is shorter.
+  """
+  if len(motif) < markov_order:
+    return None
+  return motif[:markov_order]
+
+
+class ExactProb(object):
+  """
+  In-process replacement of spatt.Spatt.
+  """
+
+  def version(self):
+    return VERSION
+
+  def get_exact_prob(self, **kwargs):
+    """
+    Returns P(N >= nobs), with the arguments of spatt.Spatt.get_exact_prob.
+    """
+    return self.get_exact_probs(
+      [kwargs['motif']], [kwargs['nobs']], kwargs['length_seq'],
+      kwargs['alphabet'], kwargs['transitions'], kwargs['markov_order']
+    )[0]
+
+  def get_exact_probs(self, motifs, nobs, length_seq, alphabet, transitions,
+                      markov_order):
+    """
+    Returns P(N >= nobs) for many motifs of the same sequence. The count
+    distribution of a motif is computed once.
+    """
+    max_counts = {}
+    for motif, n in zip(motifs, nobs):
+      max_counts[motif] = max(max_counts.get(motif, 0), n)
+    dists = dict(
+      (motif, count_distribution(
+        motif, length_seq, n, alphabet, transitions, markov_order,
+        start_word(motif, markov_order)))
+      for motif, n in max_counts.items()
+    )
+    return [float(min(1., dists[motif][max(n, 0):].sum()))
+            for motif, n in zip(motifs, nobs)]
@@ -1,11 +1,13 @@
 # -*- coding: utf-8 -*-
 
+import itertools
 import warnings
 
+import numpy as np
+
 from mirmap import (seed, targetscan, prob_binomial, thermodynamics,
                     evolution, spatt)
-from mirmap.utils import (rgetattr, gen_dot_pipe_notation,
-                          rgetattrna, rgetattrze)
+from mirmap.utils import rgetattr, gen_dot_pipe_notation, izip
 
 class miRmap(object):
   """
@@ -192,22 +194,96 @@ class miRmap(object):
     self._eval_score()
     self._routine_done = True
 
-  def _eval_score(self):
-    """
-    Computes the *miRmap* score(s)
+  def iter_features(self, **kwargs):
     """
-    # Reset
-    self.scores = []
-    # Compute
-    for i in range(len(self._seed.end_sites)):
-      model = self.model_select(self._seed.seed_lengths[i])
-      score = model['intercept']
+    Streams the sites found by the seed search with the features of every
+    available module, computed as soon as each site is found. Keyword
+    arguments are passed to the evolutionary features.
 
+    Yields:
+      tuple: The site (seed.Site) and a dict of its features.
+    """
+    evolution = getattr(self, '_evolutionary', None)
+
+    def open_streams(modules):
+      sites = itertools.tee(self._seed.iter_sites(), len(modules) + 1)
+      streams = [sites[0]]
+      for module, module_sites in zip(modules, sites[1:]):
+        if module is evolution:
+          streams.append(module.iter_features(module_sites, **kwargs))
+        else:
+          streams.append(module.iter_features(module_sites))
+      return streams
+
+    modules = [self._target_scan, self._prob_binomial]
+    if hasattr(self, '_thermodynamic'):
+      modules.append(self._thermodynamic)
+    streams = None
+    if evolution is not None:
+      try:
+        streams = open_streams(modules + [evolution])
+      except IOError:
+        # Evolutionary features need an alignment and a tree
+        pass
+    if streams is None:
+      streams = open_streams(modules)
+    for results in izip(*streams):
+      features = {}
+      for site, site_features in results[1:]:
+        features.update(site_features)
+      yield results[0], features
+
+  def _build_site_table(self):
+    """
+    Gathers the sites and the features computed by the modules in a
+    sites.SiteTable, sharing their columns (no copy).
+    """
+    table = self._seed.site_table.copy()
+    for module, features in [
+      ('_target_scan', ['tgs_au', 'tgs_position', 'tgs_pairing3p',
+                        'tgs_score']),
+      ('_prob_binomial', ['prob_exact', 'prob_binomial']),
+      ('_thermodynamic', ['dg_duplex', 'dg_binding', 'dg_duplex_seed',
+                          'dg_binding_seed', 'dg_open', 'dg_total']),
+      ('_evolutionary', ['cons_bls', 'selec_phylop']),
+    ]:
+      try:
+        module_table = rgetattr(self, module + '.site_table')
+      except AttributeError:
+        continue
+      for feature in features:
+        if feature in module_table:
+          table.add_column(feature, module_table[feature])
+    return table
+
+  def _score_table(self, table):
+    """
+    Computes the *miRmap* scores of the sites of a sites.SiteTable. A
+    feature of the model missing from the table counts as 0.
+    """
+    seed_lengths = table['seed_lengths']
+    scores = np.zeros(len(table))
+    for count in set(seed_lengths.tolist()):
+      model = self.model_select(count)
+      idx = np.nonzero(seed_lengths == count)[0]
+      score = np.full(len(idx), model['intercept'])
       for k, v in model.items():
-        if k != 'intercept':
-          score += rgetattrze(self, k + 's')[i] * model[k]
+        if k == 'intercept':
+          continue
+        feature = k.split('.')[-1]
+        if feature in table:
+          score += table[feature][idx] * v
+      scores[idx] = score
+    return scores
 
-      self.scores.append(score)
+  def _eval_score(self):
+    """
+    Computes the *miRmap* score(s)
+    """
+    self.site_table = self._build_site_table()
+    scores = self._score_table(self.site_table)
+    self.site_table.add_column('score', scores)
+    self.scores = scores.tolist()
     return self.scores
 
   @property
@@ -222,9 +298,10 @@ class miRmap(object):
     if not getattr(self, 'score', False):
       self.routine()
 
+    table = self.site_table
     report_lines = []
-    for i in range(len(self._seed.end_sites)):
-      end_site = self._seed.end_sites[i]
+    for i, site in enumerate(table):
+      end_site = site.end_site
       start = max(0, end_site - self._seed.len_mirna_seq - 10)
       end = end_site + 10
       report_lines.append((
@@ -234,7 +311,7 @@ class miRmap(object):
       ))
       report_lines.append('|' + ' ' * (end_site - start - 2) + '|')
       report_lines.append(self._seed.target_seq[start:end])
-      seed_pairing_string = gen_dot_pipe_notation(self._seed.pairings[i])
+      seed_pairing_string = gen_dot_pipe_notation(site.pairing)
       report_lines.append((
         ' ' * (end_site - len(seed_pairing_string) - start) +
         seed_pairing_string
@@ -244,13 +321,12 @@ class miRmap(object):
         self._seed.mirna_seq[::-1]
       ))
 
-      model = self.model_select(self._seed.seed_lengths[i])
+      model = self.model_select(site.seed_length)
 
       for k in self.display_order:
         if k in model:
-          report_lines.append(
-            '  %-30s% .5f' % (self.model_maps[k], rgetattrna(self, k + 's')[i])
-          )
+          report_lines.append('  %-30s% .5f' % (
+            self.model_maps[k], table[k.split('.')[-1]][i]))
 
       #FIXME: miRmap Score is NOT representative, yet.
       # report_lines.append(
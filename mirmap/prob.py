@@ -14,6 +14,10 @@ Basic functions for probability features:
 
 from __future__ import division
 
+import json
+
+import numpy as np
+
 from mirmap import utils
 
 
@@ -26,16 +30,74 @@ def permutations(items, n):
                 yield str(items[i]) + str(base)
 
 
-def get_transitions(seq, alphabet, markov_order):
-    """Computes transitions matrix"""
-    transitions = []
-    motifs = list(permutations(alphabet, markov_order+1))
-    counts = dict(zip(motifs, [0]*len(motifs)))
-    for i in range(len(seq)-markov_order):
-        s = seq[i:i+markov_order+1]
-        if all([i in alphabet for i in s]):
+#: Transitions matrices by (sequence hash, alphabet, Markov order)
+transitions_cache = utils.LRUCache(256)
+
+
+def encode_seq(seq, alphabet):
+    """
+    Encodes a sequence as an array of alphabet indexes (-1 for the other
+    characters). Returns None if the alphabet or the sequence aren't made
+    of single 8-bit characters.
+    """
+    table = np.full(256, -1, dtype=np.int64)
+    for i, nt in enumerate(alphabet):
+        if len(nt) != 1 or ord(nt) > 255:
+            return None
+        table[ord(nt)] = i
+    if not isinstance(seq, bytes):
+        try:
+            seq = seq.encode('latin-1')
+        except UnicodeEncodeError:
+            return None
+    return table[np.frombuffer(seq, dtype=np.uint8)]
+
+
+def _count_words_python(seq, alphabet, markov_order):
+    counts = dict.fromkeys(permutations(alphabet, markov_order + 1), 0)
+    for i in range(len(seq) - markov_order):
+        s = seq[i:i + markov_order + 1]
+        if s in counts:
             counts[s] += 1
-    for motif in motifs:
+    return counts
+
+
+def count_words_array(seq, alphabet, markov_order):
+    """
+    Counts the words of length markov_order + 1 made of the alphabet, as an
+    array in the order of permutations(alphabet, markov_order + 1).
+    """
+    nb_symbols = len(alphabet)
+    word_length = markov_order + 1
+    codes = encode_seq(seq, alphabet)
+    if codes is None:
+        counts = _count_words_python(seq, alphabet, markov_order)
+        return np.array(
+            [counts[w] for w in permutations(alphabet, word_length)],
+            dtype=np.int64)
+    nb_windows = len(codes) - markov_order
+    if nb_windows <= 0:
+        return np.zeros(nb_symbols ** word_length, dtype=np.int64)
+    # Word index with the first nucleotide as the most significant digit
+    indexes = np.zeros(nb_windows, dtype=np.int64)
+    valid = np.ones(nb_windows, dtype=bool)
+    for j in range(word_length):
+        window = codes[j:j + nb_windows]
+        indexes = indexes * nb_symbols + window
+        valid &= window >= 0
+    return np.bincount(indexes[valid], minlength=nb_symbols ** word_length)
+
+
+def count_words(seq, alphabet, markov_order):
+    """Counts the words of length markov_order + 1 made of the alphabet"""
+    return dict(zip(permutations(alphabet, markov_order + 1),
+                    count_words_array(seq, alphabet, markov_order).tolist()))
+
+
+def transitions_from_counts(counts, alphabet, markov_order):
+    """Computes transitions matrix from the counts of count_words"""
+    transitions = []
+    for motif in permutations(alphabet, markov_order + 1):
         transitions.append(counts[motif])
     transitions = list(utils.grouper(len(alphabet), transitions))
     sums = list(map(sum, transitions))
@@ -47,6 +109,33 @@ def get_transitions(seq, alphabet, markov_order):
     return transitions
 
 
+def transitions_from_array(counts, alphabet):
+    """Computes transitions matrix from the counts of count_words_array"""
+    counts = counts.reshape(-1, len(alphabet)).astype(np.float64)
+    sums = counts.sum(axis=1)
+    transitions = np.zeros_like(counts)
+    nonzero = sums != 0
+    transitions[nonzero] = counts[nonzero] / sums[nonzero, None]
+    return transitions.tolist()
+
+
+def get_transitions(seq, alphabet, markov_order, cache=True):
+    """
+    Computes transitions matrix. With cache, the matrix is computed once per
+    sequence, alphabet and order (stored as tuples), and a copy is returned.
+    """
+    if cache:
+        key = (utils.seq_hash(seq), tuple(alphabet), markov_order)
+        transitions = transitions_cache.get(key)
+        if transitions is None:
+            transitions = tuple(tuple(row) for row in get_transitions(
+                seq, alphabet, markov_order, False))
+            transitions_cache[key] = transitions
+        return [list(row) for row in transitions]
+    return transitions_from_array(
+        count_words_array(seq, alphabet, markov_order), alphabet)
+
+
 def prob_motif(motif, alphabet, markov_order, transitions):
     """Computes the probability of a motif based on a transitions matrix"""
     transitions = utils.flatten(transitions)
@@ -56,3 +145,120 @@ def prob_motif(motif, alphabet, markov_order, transitions):
     for i in range(len(motif) - markov_order):
         prob *= transitions[motifs_index[motif[i:i+markov_order+1]]]
     return prob
+
+
+class MarkovModel(object):
+    """
+    Markov chain model compiled from a transitions matrix, to compute the
+    probabilities of motifs without per-call setup. Models are hashable
+    (by value) and picklable.
+
+    Args:
+        alphabet (list): Nucleotides, as given to get_transitions.
+        markov_order (int): Markov chain order.
+        transitions (list): Transitions matrix (get_transitions).
+    """
+
+    def __init__(self, alphabet, markov_order, transitions):
+        self.alphabet = tuple(alphabet)
+        self.markov_order = markov_order
+        self.probs = np.array(utils.flatten(transitions), dtype=np.float64)
+        self._init_tables()
+
+    def _init_tables(self):
+        # Word indexes are the ones of permutations(alphabet, order + 1)
+        self.codes = dict((nt, i) for i, nt in enumerate(self.alphabet))
+        self.nb_words = len(self.alphabet) ** (self.markov_order + 1)
+        self._probs = self.probs.tolist()
+        with np.errstate(divide='ignore'):
+            self.log_probs = np.log(self.probs)
+
+    @classmethod
+    def from_seq(cls, seq, alphabet, markov_order):
+        return cls(alphabet, markov_order,
+                   get_transitions(seq, alphabet, markov_order))
+
+    @classmethod
+    def fit(cls, seqs, alphabet, markov_order):
+        """
+        Fits a background model on many sequences (i.e. all the transcripts),
+        with the words counted over every sequence.
+        """
+        counts = np.zeros(len(alphabet) ** (markov_order + 1), dtype=np.int64)
+        for seq in seqs:
+            counts += count_words_array(seq, alphabet, markov_order)
+        return cls(alphabet, markov_order,
+                   transitions_from_array(counts, alphabet))
+
+    @property
+    def transitions(self):
+        """Transitions matrix, as returned by get_transitions."""
+        return self.probs.reshape(-1, len(self.alphabet)).tolist()
+
+    def save(self, filename):
+        """Saves the model in a JSON file."""
+        with open(filename, 'w') as f:
+            json.dump({'alphabet': list(self.alphabet),
+                       'markov_order': self.markov_order,
+                       'transitions': self.transitions}, f)
+
+    @classmethod
+    def load(cls, filename):
+        """Loads a model saved with save."""
+        with open(filename) as f:
+            data = json.load(f)
+        return cls(data['alphabet'], data['markov_order'], data['transitions'])
+
+    def __getstate__(self):
+        return (self.alphabet, self.markov_order, self.probs)
+
+    def __setstate__(self, state):
+        self.alphabet, self.markov_order, self.probs = state
+        self._init_tables()
+
+    def _key(self):
+        return (self.alphabet, self.markov_order, tuple(self._probs))
+
+    def __eq__(self, other):
+        return isinstance(other, MarkovModel) and self._key() == other._key()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self._key())
+
+    def word_indexes(self, motif):
+        """Returns the transition indexes of the words of a motif."""
+        indexes = []
+        index = 0
+        nb_symbols = len(self.alphabet)
+        for i, nt in enumerate(motif):
+            index = (index * nb_symbols + self.codes[nt]) % self.nb_words
+            if i >= self.markov_order:
+                indexes.append(index)
+        return indexes
+
+    def prob(self, motif):
+        """Probability of a motif, as prob_motif."""
+        prob = 1.0
+        for index in self.word_indexes(motif):
+            prob *= self._probs[index]
+        return prob
+
+    def log_prob(self, motif):
+        """Log-probability of a motif."""
+        return float(self.log_probs[self.word_indexes(motif)].sum())
+
+    def log_probs_batch(self, motifs):
+        """Log-probabilities of many motifs, as an array."""
+        indexes = [self.word_indexes(motif) for motif in motifs]
+        lengths = np.array([len(i) for i in indexes])
+        log_probs = np.zeros(len(indexes))
+        if lengths.sum() > 0:
+            flat = self.log_probs[np.concatenate(
+                [i for i in indexes if len(i) > 0]).astype(np.int64)]
+            starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+            nonempty = lengths > 0
+            log_probs[nonempty] = np.add.reduceat(flat, starts[nonempty])
+        return log_probs
@@ -13,7 +13,9 @@ import functools
 import operator as op
 import math
 
-from mirmap import seed, prob, utils
+import numpy as np
+
+from mirmap import cache, exact, seed, sites, prob, utils
 
 try:
   #: Fix for Python 2
@@ -42,6 +44,148 @@ def binom_cdf(k, n, p):
   return cump
 
 
+_log_factorials = np.zeros(1)
+
+
+def log_factorials(n):
+  """Returns log(i!) for i = 0..n (at least), cumulated once."""
+  global _log_factorials
+  if len(_log_factorials) <= n:
+    size = max(n, 2 * len(_log_factorials))
+    _log_factorials = np.concatenate([
+      [0.], np.cumsum(np.log(np.arange(1, size + 1)))
+    ])
+  return _log_factorials
+
+
+def _betacf(a, b, x, max_iterations=10000, eps=1e-15):
+  """
+  Continued fraction of the regularized incomplete beta function (modified
+  Lentz's method), for arrays.
+  """
+  tiny = 1e-300
+  fix = lambda v: np.where(np.abs(v) < tiny, tiny, v)
+  qab = a + b
+  qap = a + 1.
+  qam = a - 1.
+  c = np.ones_like(x)
+  d = 1. / fix(1. - qab * x / qap)
+  h = d
+  for m in range(1, max_iterations + 1):
+    m2 = 2 * m
+    aa = m * (b - m) * x / ((qam + m2) * (a + m2))
+    d = 1. / fix(1. + aa * d)
+    c = fix(1. + aa / c)
+    h = h * d * c
+    aa = -(a + m) * (qab + m) * x / ((a + m2) * (qap + m2))
+    d = 1. / fix(1. + aa * d)
+    c = fix(1. + aa / c)
+    delta = d * c
+    h = h * delta
+    if np.all(np.abs(delta - 1.) < eps):
+      break
+  return h
+
+
+def binom_sf(k, n, p):
+  """
+  Upper tail P(X > k) of binomial distributions, i.e. 1 - binom_cdf(k, n, p),
+  computed for arrays as the regularized incomplete beta function
+  I_p(k + 1, n - k) in log-space. n must be positive.
+  """
+  k = np.asarray(k, dtype=np.int64)
+  n = np.asarray(n, dtype=np.int64)
+  p = np.asarray(p, dtype=np.float64)
+  k, n, p = np.broadcast_arrays(k, n, p)
+  sf = np.where(k < 0, 1., 0.)
+  todo = (k >= 0) & (k < n) & (p > 0)
+  sf[todo & (p >= 1)] = 1.
+  todo &= p < 1
+  if not np.any(todo):
+    return sf
+  a = (k[todo] + 1).astype(np.float64)
+  b = (n[todo] - k[todo]).astype(np.float64)
+  x = p[todo]
+  lf = log_factorials(int(n.max()))
+  # log(1 / (a * B(a, b))) = log(n! / (k! (n - k - 1)!)) - log(a)
+  log_front = (lf[n[todo]] - lf[k[todo]] - lf[n[todo] - k[todo] - 1] +
+               a * np.log(x) + b * np.log1p(-x))
+  # The continued fraction converges quickly below the mean, else the
+  # symmetry I_x(a, b) = 1 - I_(1-x)(b, a) is used
+  direct = x < (a + 1.) / (a + b + 2.)
+  result = np.empty(len(x))
+  result[direct] = (np.exp(log_front[direct] - np.log(a[direct])) *
+                    _betacf(a[direct], b[direct], x[direct]))
+  result[~direct] = 1. - (
+    np.exp(log_front[~direct] - np.log(b[~direct])) *
+    _betacf(b[~direct], a[~direct], 1. - x[~direct]))
+  sf[todo] = np.clip(result, 0., 1.)
+  return sf
+
+
+class MotifCounter(object):
+  """
+  Counts the occurrences of motifs in a sequence, non-overlapping as
+  str.count. The k-mers of the sequence are indexed on the first count of
+  a motif length, and counts are then lookups.
+  """
+
+  def __init__(self, seq):
+    self.seq = seq
+    self.counts = {}
+    self.tables = {}
+
+  def count(self, motif):
+    try:
+      return self.counts[motif]
+    except KeyError:
+      pass
+    if (len(motif) == 0 or len(motif) > len(self.seq) or
+        any(nt not in seed.NT_CODES for nt in motif)):
+      count = self.seq.count(motif)
+    else:
+      count = self._count_from_table(motif)
+    self.counts[motif] = count
+    return count
+
+  def _count_from_table(self, motif):
+    k = len(motif)
+    try:
+      order, sorted_codes = self.tables[k]
+    except KeyError:
+      codes = seed.kmer_codes(self.seq, k)
+      order = np.argsort(codes, kind='mergesort')
+      sorted_codes = codes[order]
+      self.tables[k] = order, sorted_codes
+    code = seed.kmer_code(motif)
+    positions = order[np.searchsorted(sorted_codes, code, 'left'):
+                      np.searchsorted(sorted_codes, code, 'right')]
+    if len(positions) < 2 or np.all(np.diff(positions) >= k):
+      return len(positions)
+    # Overlapping occurrences: counted from left to right as str.count
+    count = 0
+    next_start = 0
+    for position in positions.tolist():
+      if position >= next_start:
+        count += 1
+        next_start = position + k
+    return count
+
+
+#: Motif counters by target sequence, shared by all the miRNAs
+motif_counters = utils.LRUCache(32)
+
+
+def motif_counter(seq):
+  """Returns the MotifCounter of a sequence."""
+  try:
+    return motif_counters[seq]
+  except KeyError:
+    counter = MotifCounter(seq)
+    motif_counters[seq] = counter
+    return counter
+
+
 class mmProbBinomial(object):
   """
   Computes the *P.over binomial* score.
@@ -52,80 +196,230 @@ class mmProbBinomial(object):
     alphabet (list): List of nucleotides to consider in the sequences
       (others get filtered).
     transitions (list): Transition matrix of the Markov Chain model
+    background (prob.MarkovModel): Background model (i.e. fitted on all
+      the transcripts with prob.MarkovModel.fit), replacing markov_order,
+      alphabet and transitions. Nothing is then fitted on the target.
     motif_def (str): 'seed' or 'seed_extended' or 'site'.
     motif_upstream_extension (int): Upstream extension length.
     motif_downstream_extension (int): Downstream extension length.
+    engine (str): Binomial tail computation: 'python' (default, exact
+      integer arithmetic) or 'numpy' (incomplete beta function, all the
+      sites at once).
+    exact_engine (str): Exact probability computation: 'spatt' (default,
+      with the spatt argument) or 'python' (exact.ExactProb, in-process and
+      all the sites at once).
+    exact_cache (cache.ResultCache): Cache of the exact probabilities, to
+      share between instances (i.e. with an SQLite store).
   """
 
+  #: Per-site scores, columns of site_table (sites.module_table)
+  prob_binomials = sites.ColumnList('prob_binomial')
+  prob_exacts = sites.ColumnList('prob_exact')
+
   def __init__(self, seed, **kwargs):
     self.seed = seed
-    alph = list(set(self.seed.target_seq))
     self.__dict__.update({
       'markov_order': 1,
-      'alphabet': alph,
-      'transitions': prob.get_transitions(self.seed.target_seq, alph, 1),
+      'alphabet': None,
+      'background': None,
       'motif_def': None,
       'motif_upstream_extension': 0,
       'motif_downstream_extension': 0,
       'skip_exact': True,
+      'engine': 'python',
+      'exact_engine': 'spatt',
+      'exact_cache': None,
     })
+    self.transitions = kwargs.pop('transitions', None)
     self.__dict__.update(kwargs)
+    if self.background is not None:
+      self.markov_order = self.background.markov_order
+      self.alphabet = list(self.background.alphabet)
+      self.transitions = self.background.transitions
+      self._markov_model_key = self._markov_model_values()
+      self._compiled_markov_model = self.background
+    elif self.alphabet is None:
+      self.alphabet = list(set(self.seed.target_seq))
     self._routine_done = False
 
+  @property
+  def transitions(self):
+    return self._transitions
+
+  @transitions.setter
+  def transitions(self, transitions):
+    # The Markov model is compiled again from the new transitions
+    self._transitions = transitions
+    self._compiled_markov_model = None
+
+  def _get_transitions(self):
+    """
+    Returns the transitions, fitted on the target if they weren't given.
+    """
+    if self.transitions is None:
+      self.transitions = prob.get_transitions(
+        self.seed.target_seq, self.alphabet, self.markov_order)
+    return self.transitions
+
+  def _site_motif(self, site):
+    # start_motif and end_motif are sequence coordinates => 1-based
+    start_motif, end_motif = seed.get_motif_coordinates(
+      site.end_site, self.motif_def, site.pairing,
+      self.motif_upstream_extension, self.motif_downstream_extension,
+      self.seed.min_target_length
+    )
+    return self.seed.target_seq[start_motif - 1:end_motif]
+
+  def _markov_model_values(self):
+    """Key of the current Markov model, but for the transitions."""
+    return (tuple(self.alphabet), self.markov_order)
+
+  def _markov_model(self):
+    """
+    Returns the prob.MarkovModel of the current alphabet, order and
+    transitions, compiled once. It is compiled again when the transitions
+    are assigned (not when they are modified in place).
+    """
+    key = self._markov_model_values()
+    if (self._compiled_markov_model is None
+        or self._markov_model_key != key):
+      self._markov_model_key = key
+      self._compiled_markov_model = prob.MarkovModel(
+        self.alphabet, self.markov_order, self._get_transitions())
+    return self._compiled_markov_model
+
+  def _motif_binomial_args(self, motif):
+    """Returns the k, n and p parameters of the binomial tail."""
+    return (
+      motif_counter(self.seed.target_seq).count(motif),
+      self.seed.len_target_seq - len(motif) + 1,
+      self._markov_model().prob(motif)
+    )
+
+  def _motif_prob_binomial(self, motif):
+    if self.engine == 'numpy':
+      return self._batch_prob_binomial([motif])[0]
+    k, n, p = self._motif_binomial_args(motif)
+    return sum([
+      1.0,
+      -1 * binom_cdf(k, n, p)
+    ])
+
+  def _batch_prob_binomial(self, motifs):
+    """
+    Computes the *P.over binomial* scores of many motifs at once.
+    """
+    args = [self._motif_binomial_args(motif) for motif in motifs]
+    if len(args) == 0:
+      return []
+    k, n, p = [np.array(a) for a in zip(*args)]
+    probs = binom_sf(k, np.maximum(n, 1), p).tolist()
+    for i in np.nonzero(n < 1)[0]:
+      # No window: as computed by binom_cdf
+      probs[i] = sum([1.0, -1 * binom_cdf(*args[i])])
+    return probs
+
+  def _motif_prob_exact(self, motif):
+    if self.skip_exact:
+      return 0
+
+    if self.exact_engine == 'python':
+      return self._batch_prob_exact([motif])[0]
+    try:
+      return self._exact_backend(self.spatt).get_exact_prob(
+        seq=self.seed.mirna_seq,
+        motif=utils.clean_seq(motif, self.alphabet),
+        nobs=motif_counter(self.seed.target_seq).count(motif),
+        length_seq=self.seed.len_target_seq,
+        alphabet=self.alphabet,
+        transitions=self._get_transitions(),
+        markov_order=self.markov_order,
+        direction='o'
+      )
+    except AttributeError:
+      return 0
+
+  def _exact_backend(self, backend):
+    """
+    Returns the backend behind the exact_cache if any, built once (with the
+    engine version and the background key).
+    """
+    if self.exact_cache is None:
+      return backend
+    cached = self.__dict__.get('_cached_exact_backend')
+    if (cached is None or cached.backend is not backend
+        or cached.cache is not self.exact_cache):
+      cached = cache.CachedExactProb(backend, self.exact_cache)
+      self._cached_exact_backend = cached
+    return cached
+
+  def _exact_prob(self):
+    """Returns the exact.ExactProb of the 'python' exact_engine."""
+    if '_python_exact_prob' not in self.__dict__:
+      self._python_exact_prob = exact.ExactProb()
+    return self._python_exact_prob
+
+  def _batch_prob_exact(self, motifs):
+    """
+    Computes the exact probabilities of many motifs at once, in-process.
+    """
+    counter = motif_counter(self.seed.target_seq)
+    return self._exact_backend(self._exact_prob()).get_exact_probs(
+      [utils.clean_seq(motif, self.alphabet) for motif in motifs],
+      [counter.count(motif) for motif in motifs],
+      self.seed.len_target_seq,
+      self.alphabet,
+      self._get_transitions(),
+      self.markov_order
+    )
+
   def _eval_prob(self, worker):
     prob_ev = []
     # Compute
-    for its in range(len(self.seed.end_sites)):
-      end_site = self.seed.end_sites[its]
-
-      # start_motif and end_motif are sequence coordinates => 1-based
-      start_motif, end_motif = seed.get_motif_coordinates(
-        end_site, self.motif_def, self.seed.pairings[its],
-        self.motif_upstream_extension, self.motif_downstream_extension,
-        self.seed.min_target_length
-      )
-
-      motif = self.seed.target_seq[start_motif - 1:end_motif]
-      prob_ev.append(worker(motif))
+    for site in self.seed.found_sites():
+      prob_ev.append(worker(self._site_motif(site)))
 
     return prob_ev
 
   def _eval_prob_binomial(self):
-    def worker(motif):
-      return sum([
-        1.0,
-        -1 * binom_cdf(
-          self.seed.target_seq.count(motif),
-          self.seed.len_target_seq - len(motif) + 1,
-          prob.prob_motif(
-            motif, self.alphabet, self.markov_order, self.transitions
-          )
-        )
-      ])
-    self.prob_binomials = self._eval_prob(worker)
-    return self.prob_binomials
+    if self.engine == 'numpy':
+      prob_binomials = self._batch_prob_binomial(
+        [self._site_motif(site) for site in self.seed.found_sites()]
+      )
+    else:
+      prob_binomials = self._eval_prob(self._motif_prob_binomial)
+    self.prob_binomials = prob_binomials
+    return prob_binomials
 
   def _eval_prob_exact(self):
-    def worker(motif):
-      if self.skip_exact:
-        return 0
-
-      try:
-        return self.spatt.get_exact_prob(
-          seq=self.seed.mirna_seq,
-          motif=utils.clean_seq(motif, self.alphabet),
-          nobs=self.seed.target_seq.count(motif),
-          length_seq=self.seed.len_target_seq,
-          alphabet=self.alphabet,
-          transitions=self.transitions,
-          markov_order=self.markov_order,
-          direction='o'
-        )
-      except AttributeError:
-        return 0
-
-    self.prob_exacts = self._eval_prob(worker)
-    return self.prob_exacts
+    if not self.skip_exact and self.exact_engine == 'python':
+      prob_exacts = self._batch_prob_exact(
+        [self._site_motif(site) for site in self.seed.found_sites()]
+      )
+    else:
+      prob_exacts = self._eval_prob(self._motif_prob_exact)
+    self.prob_exacts = prob_exacts
+    return prob_exacts
+
+  def iter_features(self, sites=None):
+    """
+    Computes the probability features site by site.
+
+    Args:
+      sites (iterable): Sites (seed.Site) to evaluate. Defaults to the
+        sites streamed by the seed search.
+
+    Yields:
+      tuple: The site and a dict of its features.
+    """
+    if sites is None:
+      sites = self.seed.iter_sites()
+    for site in sites:
+      motif = self._site_motif(site)
+      yield site, {
+        'prob_binomial': self._motif_prob_binomial(motif),
+        'prob_exact': self._motif_prob_exact(motif),
+      }
 
   def routine(self):
     self._eval_prob_binomial()
@@ -9,7 +9,19 @@
 
 """Target site identification by seed search."""
 
-from mirmap import utils
+import collections
+import itertools
+
+import numpy as np
+
+from mirmap import sites, utils
+
+#: A target site found by the seed search (defined in sites)
+Site = sites.Site
+
+#: Per-site lists of the sites found by find_potential_targets_with_seed
+SITE_LISTS = ['end_sites', 'seed_lengths', 'nb_mismatches_except_gu_wobbles',
+              'nb_gu_wobbles', 'pairings']
 
 
 def is_gu_wobble(b1, b2):
@@ -45,6 +57,39 @@ def find_pairings(target_subseq, mirna_seq, mirna_skip_start, mismatch_end):
             pairing if mismatch_end else pairing[: last_pairing + 1])
 
 
+def seed_words(mirna_seed, max_mismatches, max_gu_wobbles, alphabet='ACGU'):
+    """
+    Enumerates the words of the reverse-complemented target pairing with
+    mirna_seed with at most max_mismatches mismatches (GU wobbles excluded)
+    and max_gu_wobbles GU wobbles, as (word, nb_mismatches_except_gu_wobbles,
+    nb_gu_wobbles) tuples.
+    """
+    options = []
+    for mb in mirna_seed:
+        nts = []
+        for tb in alphabet:
+            if tb == mb:
+                nts.append((tb, 0, 0))
+            elif is_gu_wobble(tb, mb):
+                nts.append((tb, 0, 1))
+            else:
+                nts.append((tb, 1, 0))
+        options.append(nts)
+
+    def extend(word, nb_mismatches, nb_gu_wobbles):
+        if len(word) == len(options):
+            yield word, nb_mismatches, nb_gu_wobbles
+            return
+        for tb, mm, gu in options[len(word)]:
+            if (nb_mismatches + mm <= max_mismatches and
+                    nb_gu_wobbles + gu <= max_gu_wobbles):
+                for w in extend(word + tb, nb_mismatches + mm,
+                                nb_gu_wobbles + gu):
+                    yield w
+
+    return extend('', 0, 0)
+
+
 def get_motif_coordinates(
         end_site, motif_def, pairing, motif_upstream_extension,
         motif_downstream_extension, min_target_length
@@ -70,6 +115,88 @@ def get_motif_coordinates(
         end_motif = end_site + motif_downstream_extension
     return start_motif, end_motif
 
+
+def encode_seq(seq):
+    """
+    Returns the sequence as an uint8 array, or None if it isn't pure ASCII.
+    """
+    try:
+        return np.frombuffer(seq.encode('ascii'), dtype=np.uint8)
+    except (UnicodeEncodeError, UnicodeDecodeError):
+        return None
+
+
+NT_CODES = {'A': 0, 'C': 1, 'G': 2, 'U': 3}
+
+#: Seed tables by miRNA and seed parameters
+_seed_tables = {}
+
+
+def kmer_code(word):
+    code = 0
+    for nt in word:
+        code = code * 4 + NT_CODES[nt]
+    return code
+
+
+def kmer_codes(seq_rc, k):
+    """
+    Returns the code of every k-mer of the sequence. k-mers with other
+    nucleotides than ACGU get the code 4**k.
+    """
+    nb_kmers = max(0, len(seq_rc) - k + 1)
+    encoded = encode_seq(seq_rc)
+    if encoded is None:
+        encoded = np.frombuffer(
+            seq_rc.encode('ascii', 'replace'), dtype=np.uint8
+        )
+    lookup = np.full(256, -1, dtype=np.int64)
+    for nt, code in NT_CODES.items():
+        lookup[ord(nt)] = code
+    nts = lookup[encoded]
+    codes = np.zeros(nb_kmers, dtype=np.int64)
+    ambiguous = np.zeros(nb_kmers, dtype=bool)
+    for j in range(k):
+        codes = codes * 4 + nts[j:j + nb_kmers]
+        ambiguous |= nts[j:j + nb_kmers] < 0
+    codes[ambiguous] = 4 ** k
+    return codes
+
+
+def get_seed_table(mirna_seq, mirna_start_pairing, allowed_lengths,
+                   allowed_gu_wobbles, allowed_mismatches):
+    """
+    Returns, for each seed length, the table of the words (ACGU only) of
+    the reverse-complemented target pairing with the miRNA seed, by 2-bit
+    code: {seed_length: {code: (seed_length, nb_mismatches_except_gu_wobbles,
+    nb_gu_wobbles, pairing)}}. Tables are cached by miRNA and parameters.
+    """
+    skip = mirna_start_pairing - 1
+    key = (
+        mirna_seq[skip:skip + max(allowed_lengths)], skip,
+        tuple((l, allowed_gu_wobbles[l], allowed_mismatches[l])
+              for l in allowed_lengths)
+    )
+    try:
+        return _seed_tables[key]
+    except KeyError:
+        pass
+    tables = {}
+    for seed_length in allowed_lengths:
+        table = {}
+        words = seed_words(mirna_seq[skip:skip + seed_length],
+                           allowed_mismatches[seed_length],
+                           allowed_gu_wobbles[seed_length])
+        for word, nb_mismatches, nb_gu_wobbles in words:
+            table[kmer_code(word)] = (
+                seed_length, nb_mismatches, nb_gu_wobbles,
+                find_pairings(word, mirna_seq, skip, True)[2]
+            )
+        tables[seed_length] = table
+    _seed_tables[key] = tables
+    return tables
+
+
 class mmSeed(object):
     """
     miRmap Model Seed.
@@ -88,9 +215,29 @@ class mmSeed(object):
             mismatches are allowed (value).
         take_best (bool): If seed matches are overlapping, taking or not
             the longest.
+        engine (str): Scanning engine, 'python' (default), 'numpy',
+            'table' (lookup of precomputed seed words) or 'bitparallel'
+            (shift-add matching, fastest with mismatches allowed). All
+            engines return the same sites.
     *: Required
+
+    The sites found by find_potential_targets_with_seed are stored in
+    site_table (sites.SiteTable); the per-site lists (end_sites,
+    seed_lengths, nb_mismatches_except_gu_wobbles, nb_gu_wobbles and
+    pairings) are read from it.
     """
 
+    end_sites = sites.ColumnList('end_sites', name='end_sites',
+                                 writable=False)
+    seed_lengths = sites.ColumnList('seed_lengths', name='seed_lengths',
+                                    writable=False)
+    nb_mismatches_except_gu_wobbles = sites.ColumnList(
+        'nb_mismatches_except_gu_wobbles',
+        name='nb_mismatches_except_gu_wobbles', writable=False)
+    nb_gu_wobbles = sites.ColumnList('nb_gu_wobbles', name='nb_gu_wobbles',
+                                     writable=False)
+    pairings = sites.ColumnList('pairings', name='pairings', writable=False)
+
     def __init__(self, **kwargs):
         defaults = {
             'mirna_start_pairing': 2,
@@ -106,6 +253,7 @@ class mmSeed(object):
                 8: 0
             },
             'take_best': False,
+            'engine': 'python',
         }
         self.__dict__.update(defaults)
         self.__dict__.update(kwargs)
@@ -125,16 +273,8 @@ class mmSeed(object):
         Args:
 
         """
-        # Reset
-        out = {
-            'end_sites': [],
-            'seed_lengths': [],
-            'nb_mismatches_except_gu_wobbles': [],
-            'nb_gu_wobbles': [],
-            'pairings': [],
-        }
         # Compute
-        target_seq_rc = utils.reverse_complement(self.target_seq)
+        target_seq_rc = utils.reverse_complement(self.target_seq, memo=True)
 
         # Sliding window (step size 1 of course) on the target sequence with all
         # possible target site. Nucleotide(s) before mirna_start_pairing has to
@@ -144,9 +284,140 @@ class mmSeed(object):
 
         upper = self.mirna_start_pairing - 1
         lower = self.len_target_seq - self.min_target_length + 1
-        for i in range(upper, lower):
+        self.site_table = sites.SiteTable.from_sites(
+            (self._hit_to_site(hit, self.len_target_seq)
+             for hit in self._scan(target_seq_rc, upper, lower)),
+            self.mirna_start_pairing
+        )
+        return dict((name, getattr(self, name)) for name in SITE_LISTS)
+
+    def iter_sites(self):
+        """
+        Searches for seed(s) in the target sequence, yielding each site
+        (seed.Site) as soon as it is found. Sites aren't stored.
+        """
+        target_seq_rc = utils.reverse_complement(self.target_seq, memo=True)
+        upper = self.mirna_start_pairing - 1
+        lower = self.len_target_seq - self.min_target_length + 1
+        for hit in self._scan(target_seq_rc, upper, lower):
+            yield self._hit_to_site(hit, self.len_target_seq)
+
+    def iter_sites_from_file(self, handle, chunk_size=1 << 20):
+        """
+        Searches for seed(s) in a target sequence (raw or FASTA, T being
+        read as U) read from a file handle or an mmap, by overlapping
+        chunks, so that memory doesn't depend on the sequence length.
+        target_seq is ignored.
+
+        Yields the same sites (seed.Site, with end_site on the whole
+        sequence) as iter_sites on the sequence, but by increasing end_site.
+        """
+        skip = self.mirna_start_pairing - 1
+        if skip < 0:
+            raise ValueError("Chunked scan needs mirna_start_pairing >= 1.")
+        max_length = max(self.allowed_lengths)
+        overlap = max_length + self.mirna_start_pairing
+        # The site at forward (0-based) position f is the one pairing the
+        # nucleotide f with the miRNA nucleotide mirna_start_pairing:
+        # end_site = f + mirna_start_pairing, and the last skip
+        # nucleotides aren't searched
+        buf = ''
+        buf_start = 0
+        lo = self.min_target_length - 1
+        for block in utils.read_seq_blocks(handle, chunk_size):
+            buf += block.upper().replace('T', 'U')
+            hi = buf_start + len(buf) - skip
+            if hi > lo:
+                for site in self._scan_forward(buf, buf_start, lo, hi):
+                    yield site
+                lo = hi
+            keep = min(max(buf_start, lo - overlap), buf_start + len(buf))
+            buf = buf[keep - buf_start:]
+            buf_start = keep
+
+    def _scan_forward(self, seq, seq_start, lo, hi, rna=True):
+        """
+        Searches for seed(s) at the forward (0-based) positions lo to hi
+        (excluded) of the target, seq being the part of the target starting
+        at seq_start (from lo - max(allowed_lengths) + 1 at least).
+        The position f is the one pairing with the miRNA nucleotide
+        mirna_start_pairing: end_site = f + mirna_start_pairing.
+
+        Args:
+            rna (bool): Complement A with U even if seq has no U.
+
+        Yields the sites (seed.Site) by increasing end_site.
+        """
+        chunk_start = max(0, lo - max(self.allowed_lengths) + 1)
+        chunk = seq[chunk_start - seq_start:hi - seq_start]
+        chunk_rc = utils.reverse_complement(chunk)
+        if rna and 'U' not in chunk:
+            chunk_rc = chunk_rc.replace('T', 'U')
+        hits = collections.OrderedDict()
+        for hit in self._scan(chunk_rc, 0, hi - lo):
+            hits.setdefault(hit[0], []).append(hit)
+        for i in reversed(hits):
+            for hit in hits[i]:
+                yield self._hit_to_site((0,) + hit[1:], hi - i)
+
+    def found_sites(self):
+        """
+        Iterates over the sites (seed.Site) found by
+        find_potential_targets_with_seed.
+        """
+        return iter(self.site_table)
+
+    def _hit_to_site(self, hit, len_target_seq):
+        i, seed_length, nb_mismatches_except_gu_wobbles, \
+            nb_gu_wobbles, pairing = hit
+        # end_site is 1-based and is the end of the target site on
+        # the real (=not the reverse-complemented) target sequence
+        end_site = len_target_seq - i + self.mirna_start_pairing - 1
+        return Site(end_site, seed_length, nb_mismatches_except_gu_wobbles,
+                    nb_gu_wobbles, pairing)
+
+    def _collect_sites(self, hits, len_target_seq):
+        """
+        Gathers the hits of a scan into the per-site lists (SITE_LISTS).
+        """
+        out = dict((name, []) for name in SITE_LISTS)
+        for hit in hits:
+            site = self._hit_to_site(hit, len_target_seq)
+            out['end_sites'].append(site.end_site)
+            out['seed_lengths'].append(site.seed_length)
+            out['nb_mismatches_except_gu_wobbles'].append(
+                site.nb_mismatches_except_gu_wobbles)
+            out['nb_gu_wobbles'].append(site.nb_gu_wobbles)
+            out['pairings'].append(site.pairing)
+        return out
+
+    def _scan(self, target_seq_rc, start, stop):
+        """
+        Returns an iterator over the seed matches found at the positions
+        start to stop (excluded) of the reverse-complemented target, as
+        (position, seed_length, nb_mismatches_except_gu_wobbles,
+        nb_gu_wobbles, pairing) tuples, ordered by position and by seed
+        length as given by allowed_lengths (reversed).
+        """
+        try:
+            scanner = getattr(self, '_scan_' + self.engine)
+        except AttributeError:
+            raise ValueError("Unknown seed engine: %s" % self.engine)
+        return scanner(target_seq_rc, start, stop)
+
+    def _scan_python(self, target_seq_rc, start, stop):
+        return self._scan_positions(target_seq_rc, range(start, stop))
+
+    def _scan_positions(self, target_seq_rc, positions, seed_lengths=None):
+        """
+        Checks the seed at each of the given (sorted) positions of the
+        reverse-complemented target.
+        """
+        if seed_lengths is None:
+            seed_lengths = self.allowed_lengths[::-1]
+        for i in positions:
             # We start with the longest seed and stop as soon as we find one
-            for seed_length in self.allowed_lengths[::-1]:
+            for seed_length in seed_lengths:
                 target_subseq = target_seq_rc[i: i + seed_length]
                 p = find_pairings(target_subseq, self.mirna_seq,
                                   self.mirna_start_pairing - 1, True)
@@ -159,21 +430,198 @@ class mmSeed(object):
                 t_t = nb_gu_wobbles <= self.allowed_gu_wobbles[seed_length]
 
                 if t_o and t_t:
-                    # end_site is 1-based and is the end of the target site on
-                    # the real (=not the reverse-complemented) target sequence
-                    end_site = (self.len_target_seq - i +
-                                self.mirna_start_pairing - 1)
-                    out['end_sites'].append(end_site)
-                    out['seed_lengths'].append(seed_length)
-                    out['nb_mismatches_except_gu_wobbles'].append(
-                        nb_mismatches_except_gu_wobbles)
-                    out['nb_gu_wobbles'].append(nb_gu_wobbles)
-                    out['pairings'].append(pairing)
+                    yield (i, seed_length, nb_mismatches_except_gu_wobbles,
+                           nb_gu_wobbles, pairing)
                     if self.take_best:
                         break
 
-        self.__dict__.update(out)
-        return out
+    def _scan_numpy(self, target_seq_rc, start, stop):
+        """
+        Evaluates the match, GU wobble and mismatch masks of all the windows
+        at once. Windows truncated by the end of the target (and the whole
+        scan if the seed isn't fully inside the miRNA) are left to the
+        Python engine which defines their behaviour.
+        """
+        skip = self.mirna_start_pairing - 1
+        max_length = max(self.allowed_lengths)
+        target = encode_seq(target_seq_rc)
+        mirna = encode_seq(self.mirna_seq[skip:skip + max_length])
+        if (skip < 0 or skip + max_length > self.len_mirna_seq or
+                target is None or mirna is None):
+            return self._scan_python(target_seq_rc, start, stop)
+
+        full_stop = max(start, min(stop, len(target_seq_rc) - max_length + 1))
+        nb_windows = full_stop - start
+        hits = []
+        if nb_windows > 0:
+            # Row j: pairing status of the j-th seed nucleotide of every window
+            paired = np.empty((max_length, nb_windows), dtype=bool)
+            gu_wobbles = np.zeros((max_length, nb_windows), dtype=bool)
+            for j in range(max_length):
+                window_nts = target[start + j:start + j + nb_windows]
+                paired[j] = window_nts == mirna[j]
+                if mirna[j] == ord('U'):
+                    gu_wobbles[j] = window_nts == ord('C')
+                elif mirna[j] == ord('G'):
+                    gu_wobbles[j] = window_nts == ord('A')
+            paired |= gu_wobbles
+            cum_paired = np.cumsum(paired, axis=0)
+            cum_gu_wobbles = np.cumsum(gu_wobbles, axis=0)
+
+            seed_lengths = self.allowed_lengths[::-1]
+            shape = (nb_windows, len(seed_lengths))
+            nb_mismatches = np.empty(shape, dtype=int)
+            nb_gu_wobbles = np.empty(shape, dtype=int)
+            for il, seed_length in enumerate(seed_lengths):
+                nb_mismatches[:, il] = (seed_length -
+                                        cum_paired[seed_length - 1])
+                nb_gu_wobbles[:, il] = cum_gu_wobbles[seed_length - 1]
+            found = (
+                (nb_mismatches <= np.array(
+                    [self.allowed_mismatches[l] for l in seed_lengths])) &
+                (nb_gu_wobbles <= np.array(
+                    [self.allowed_gu_wobbles[l] for l in seed_lengths]))
+            )
+            if self.take_best:
+                found &= np.cumsum(found, axis=1) == 1
+
+            for iw, il in zip(*np.nonzero(found)):
+                seed_length = seed_lengths[il]
+                pairing = [0] * skip + [
+                    j + skip + 1 if p else 0
+                    for j, p in enumerate(paired[:seed_length, iw])
+                ]
+                hits.append((start + int(iw), seed_length,
+                             int(nb_mismatches[iw, il]),
+                             int(nb_gu_wobbles[iw, il]), pairing))
+
+        return itertools.chain(
+            hits, self._scan_python(target_seq_rc, full_stop, stop))
+
+    def _scan_table(self, target_seq_rc, start, stop):
+        """
+        Classifies the windows by looking up their 2-bit code in the table of
+        the seed words of the miRNA. Windows with other nucleotides than
+        ACGU are checked with find_pairings.
+        """
+        skip = self.mirna_start_pairing - 1
+        max_length = max(self.allowed_lengths)
+        if skip < 0 or skip + max_length > self.len_mirna_seq:
+            return self._scan_python(target_seq_rc, start, stop)
+        tables = get_seed_table(
+            self.mirna_seq, self.mirna_start_pairing, self.allowed_lengths,
+            self.allowed_gu_wobbles, self.allowed_mismatches
+        )
+
+        full_stop = max(start, min(stop, len(target_seq_rc) - max_length + 1))
+        seed_lengths = self.allowed_lengths[::-1]
+        codes = {}
+        candidates = set()
+        for seed_length in seed_lengths:
+            codes[seed_length] = kmer_codes(target_seq_rc, seed_length)
+            window_codes = codes[seed_length][start:full_stop]
+            found = np.isin(
+                window_codes,
+                list(tables[seed_length].keys()) + [4 ** seed_length]
+            )
+            candidates.update((np.nonzero(found)[0] + start).tolist())
+
+        hits = []
+        for i in sorted(candidates):
+            for seed_length in seed_lengths:
+                code = codes[seed_length][i]
+                if code == 4 ** seed_length:
+                    hit = list(self._scan_positions(
+                        target_seq_rc, [i], [seed_length]))
+                    hit = hit[0][1:] if hit else None
+                else:
+                    hit = tables[seed_length].get(code)
+                if hit is not None:
+                    hits.append((i, hit[0], hit[1], hit[2], list(hit[3])))
+                    if self.take_best:
+                        break
+
+        return itertools.chain(
+            hits, self._scan_python(target_seq_rc, full_stop, stop))
+
+    def _scan_bitparallel(self, target_seq_rc, start, stop):
+        """
+        Shift-add matching: the numbers of mismatches and of GU wobbles of
+        the windows ending at each position, for all the seed lengths, are
+        packed in two integers updated with one shift and one addition per
+        nucleotide, and compared to the allowed numbers with one addition.
+        Only the windows passing are then checked with find_pairings.
+        Windows truncated by the end of the target are left to the Python
+        engine.
+        """
+        skip = self.mirna_start_pairing - 1
+        max_length = max(self.allowed_lengths)
+        if skip < 0 or skip + max_length > self.len_mirna_seq:
+            return self._scan_python(target_seq_rc, start, stop)
+        mirna = self.mirna_seq[skip:skip + max_length]
+
+        # One field of width bits per seed nucleotide: the field j holds the
+        # count over the j + 1 nucleotides of the window ending at the
+        # current position. Its high bit is the overflow flag.
+        width = max_length.bit_length() + 2
+        flag = 1 << (width - 1)
+        full = (1 << (width * max_length)) - 1
+        mismatch_masks = {}
+        gu_wobble_masks = {}
+        for nt in set(target_seq_rc):
+            mismatch_masks[nt] = 0
+            gu_wobble_masks[nt] = 0
+            for j, mb in enumerate(mirna):
+                if is_gu_wobble(nt, mb):
+                    gu_wobble_masks[nt] |= 1 << (width * j)
+                elif nt != mb:
+                    mismatch_masks[nt] |= 1 << (width * j)
+        # Adding the biases sets the flags of the counts over the allowed ones
+        mismatch_bias = 0
+        gu_wobble_bias = 0
+        flags = 0
+        for seed_length in self.allowed_lengths:
+            shift = width * (seed_length - 1)
+            mismatch_bias += (flag - 1 - min(
+                self.allowed_mismatches[seed_length], seed_length)) << shift
+            gu_wobble_bias += (flag - 1 - min(
+                self.allowed_gu_wobbles[seed_length], seed_length)) << shift
+            flags |= flag << shift
+
+        full_stop = max(start, min(stop, len(target_seq_rc) - max_length + 1))
+        seed_lengths = self.allowed_lengths[::-1]
+        candidates = []
+        mismatches = 0
+        gu_wobbles = 0
+        if full_stop > start:
+            for t in range(start, full_stop + max_length - 1):
+                nt = target_seq_rc[t]
+                mismatches = (((mismatches << width) & full) +
+                              mismatch_masks[nt])
+                gu_wobbles = (((gu_wobbles << width) & full) +
+                              gu_wobble_masks[nt])
+                failed = ((mismatches + mismatch_bias) |
+                          (gu_wobbles + gu_wobble_bias)) & flags
+                if failed != flags:
+                    for rank, seed_length in enumerate(seed_lengths):
+                        i = t - seed_length + 1
+                        if (start <= i < full_stop and not
+                                failed & (flag << width * (seed_length - 1))):
+                            candidates.append((i, rank, seed_length))
+        candidates.sort()
+
+        hits = []
+        previous = None
+        for i, _, seed_length in candidates:
+            if self.take_best and i == previous:
+                continue
+            p = find_pairings(target_seq_rc[i:i + seed_length],
+                              self.mirna_seq, skip, True)
+            hits.append((i, seed_length, p[0], p[1], p[2]))
+            previous = i
+
+        return itertools.chain(
+            hits, self._scan_python(target_seq_rc, full_stop, stop))
 
     def routine(self):
         self.find_potential_targets_with_seed()
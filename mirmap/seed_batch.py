@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+
+#
+# Copyright (C) 2011-2013 Charles E. Vejnar
+#
+# This is free software, licensed under the GNU General Public License v3.
+# See /LICENSE for more information.
+#
+
+"""
+Seed search of many miRNAs in a single pass over the target sequence.
+
+Every seed word allowed by the mmSeed rules, for every miRNA, is compiled
+into one Aho-Corasick automaton run once on the reverse-complemented target.
+"""
+
+import collections
+
+from mirmap import seed, utils
+
+#: Symbol standing for the nucleotides pairing with no miRNA nucleotide
+OTHER = '\x00'
+
+
+class mmSeedBatch(object):
+  """
+  Seed search for a panel of miRNAs.
+
+  Args:
+    mirna_seqs* (dict): miRNA sequences by miRNA id.
+    The other arguments are the mmSeed ones (but target_seq and mirna_seq)
+    and apply to every miRNA.
+  *: Required
+  """
+
+  def __init__(self, mirna_seqs, **kwargs):
+    self.seeds = collections.OrderedDict(
+      (mirna_id, seed.mmSeed(target_seq='', mirna_seq=mirna_seq, **kwargs))
+      for mirna_id, mirna_seq in mirna_seqs.items()
+    )
+    self._build_automaton()
+
+  def _compiled(self, mm_seed):
+    """Is the miRNA searched with the automaton?"""
+    skip = mm_seed.mirna_start_pairing - 1
+    return (skip >= 0 and
+            skip + max(mm_seed.allowed_lengths) <= mm_seed.len_mirna_seq)
+
+  def _build_automaton(self):
+    # Alphabet: every nucleotide which can pair with a miRNA nucleotide
+    alphabet = set('ACGU')
+    for mm_seed in self.seeds.values():
+      alphabet.update(mm_seed.mirna_seq)
+    alphabet.discard(OTHER)
+    self.symbols = dict((nt, i) for i, nt in enumerate(sorted(alphabet)))
+    self.symbols[OTHER] = len(self.symbols)
+    word_alphabet = sorted(alphabet) + [OTHER]
+
+    # Trie
+    goto = [{}]
+    outputs = [[]]
+    for mirna_id, mm_seed in self.seeds.items():
+      if not self._compiled(mm_seed):
+        continue
+      skip = mm_seed.mirna_start_pairing - 1
+      for seed_length in mm_seed.allowed_lengths:
+        words = seed.seed_words(
+          mm_seed.mirna_seq[skip:skip + seed_length],
+          mm_seed.allowed_mismatches[seed_length],
+          mm_seed.allowed_gu_wobbles[seed_length],
+          word_alphabet
+        )
+        for word, nb_mismatches, nb_gu_wobbles in words:
+          state = 0
+          for nt in word:
+            symbol = self.symbols[nt]
+            if symbol not in goto[state]:
+              goto[state][symbol] = len(goto)
+              goto.append({})
+              outputs.append([])
+            state = goto[state][symbol]
+          pairing = [0] * skip + [
+            j + skip + 1 if nt == mb or seed.is_gu_wobble(nt, mb) else 0
+            for j, (nt, mb) in enumerate(
+              zip(word, mm_seed.mirna_seq[skip:]))
+          ]
+          outputs[state].append((mirna_id, seed_length, nb_mismatches,
+                                 nb_gu_wobbles, pairing))
+
+    # Failure links (breadth-first) turning the trie into a complete DFA
+    nb_symbols = len(self.symbols)
+    delta = [[0] * nb_symbols for _ in goto]
+    queue = collections.deque()
+    for symbol, child in goto[0].items():
+      delta[0][symbol] = child
+      queue.append((child, 0))
+    while queue:
+      state, fail = queue.popleft()
+      outputs[state] = outputs[state] + outputs[fail]
+      for symbol in range(nb_symbols):
+        if symbol in goto[state]:
+          child = goto[state][symbol]
+          delta[state][symbol] = child
+          queue.append((child, delta[fail][symbol]))
+        else:
+          delta[state][symbol] = delta[fail][symbol]
+    self.delta = delta
+    self.outputs = outputs
+
+  def find_potential_targets_with_seed(self, target_seq):
+    """
+    Searches for the seed(s) of every miRNA in the target sequence.
+
+    Returns:
+      dict: For each miRNA id, the same per-site lists as
+        mmSeed.find_potential_targets_with_seed.
+    """
+    target_seq = target_seq.upper()
+    target_seq_rc = utils.reverse_complement(target_seq, memo=True)
+    len_target_seq = len(target_seq)
+
+    # Single pass: hits by miRNA and position
+    hits = dict((mirna_id, {}) for mirna_id in self.seeds)
+    other = self.symbols[OTHER]
+    delta = self.delta
+    outputs = self.outputs
+    state = 0
+    for t, nt in enumerate(target_seq_rc):
+      state = delta[state][self.symbols.get(nt, other)]
+      for hit in outputs[state]:
+        i = t - hit[1] + 1
+        hits[hit[0]].setdefault(i, []).append(
+          (i,) + hit[1:4] + (list(hit[4]),)
+        )
+
+    results = collections.OrderedDict()
+    for mirna_id, mm_seed in self.seeds.items():
+      start = mm_seed.mirna_start_pairing - 1
+      stop = len_target_seq - mm_seed.min_target_length + 1
+      if self._compiled(mm_seed):
+        # Windows truncated by the end of the target are checked apart
+        full_stop = max(
+          start,
+          min(stop, len_target_seq - max(mm_seed.allowed_lengths) + 1)
+        )
+        ranks = dict(
+          (l, r) for r, l in enumerate(mm_seed.allowed_lengths[::-1])
+        )
+        mirna_hits = []
+        for i in sorted(hits[mirna_id]):
+          if start <= i < full_stop:
+            site_hits = sorted(hits[mirna_id][i], key=lambda h: ranks[h[1]])
+            mirna_hits.extend(site_hits[:1] if mm_seed.take_best
+                              else site_hits)
+        mirna_hits.extend(
+          mm_seed._scan_python(target_seq_rc, full_stop, stop)
+        )
+      else:
+        mirna_hits = mm_seed._scan_python(target_seq_rc, start, stop)
+      results[mirna_id] = mm_seed._collect_sites(mirna_hits, len_target_seq)
+    return results
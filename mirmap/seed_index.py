@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+
+#
+# Copyright (C) 2011-2013 Charles E. Vejnar
+#
+# This is free software, licensed under the GNU General Public License v3.
+# See /LICENSE for more information.
+#
+
+"""
+Persistent k-mer index of transcripts for the seed search.
+
+The index stores, for every k-mer of the reverse-complemented transcripts,
+the (transcript, position) postings. A seed search then only verifies the
+windows starting with a k-mer compatible with the seed instead of scanning
+every transcript.
+"""
+
+import json
+import os
+
+import numpy as np
+
+from mirmap import seed, utils
+
+def build_seed_index(seqs, path, k=6):
+  """
+  Builds the index of the transcripts in path.
+
+  Args:
+    seqs (str or dict): FASTA filename or {transcript_id: sequence}.
+    path (str): Index directory.
+    k (int): k-mer length. Must not exceed the shortest seed searched.
+  """
+  if not isinstance(seqs, dict):
+    seqs = utils.load_fasta(seqs)
+  if not os.path.isdir(path):
+    os.makedirs(path)
+
+  transcript_ids = list(seqs.keys())
+  seq_offsets = [0]
+  seqs_rc = []
+  postings_transcripts = []
+  postings_positions = []
+  postings_codes = []
+  for it, transcript_id in enumerate(transcript_ids):
+    # As in mmSeed, the reverse-complemented target is searched
+    seq_rc = utils.reverse_complement(seqs[transcript_id].upper())
+    seqs_rc.append(seq_rc)
+    seq_offsets.append(seq_offsets[-1] + len(seq_rc))
+    codes = seed.kmer_codes(seq_rc, k)
+    postings_transcripts.append(np.full(len(codes), it, dtype=np.int32))
+    postings_positions.append(np.arange(len(codes), dtype=np.int32))
+    postings_codes.append(codes)
+
+  codes = np.concatenate(postings_codes + [np.zeros(0, np.int64)])
+  order = np.argsort(codes, kind='mergesort')
+  postings = np.empty((len(codes), 2), dtype=np.int32)
+  postings[:, 0] = np.concatenate(
+    postings_transcripts + [np.zeros(0, np.int32)])[order]
+  postings[:, 1] = np.concatenate(
+    postings_positions + [np.zeros(0, np.int32)])[order]
+  kmer_offsets = np.zeros(4 ** k + 2, dtype=np.int64)
+  kmer_offsets[1:] = np.cumsum(np.bincount(codes, minlength=4 ** k + 1))
+
+  np.save(os.path.join(path, 'postings.npy'), postings)
+  np.save(os.path.join(path, 'kmer_offsets.npy'), kmer_offsets)
+  np.save(os.path.join(path, 'seq_offsets.npy'),
+          np.array(seq_offsets, dtype=np.int64))
+  np.save(os.path.join(path, 'seqs_rc.npy'), np.frombuffer(
+    ''.join(seqs_rc).encode('ascii', 'replace'), dtype=np.uint8))
+  with open(os.path.join(path, 'index.json'), 'w') as f:
+    json.dump({'k': k, 'transcript_ids': transcript_ids}, f)
+
+
+class SeedIndex(object):
+  """
+  Memory-mapped k-mer index built with build_seed_index.
+
+  Args:
+    path (str): Index directory.
+  """
+
+  def __init__(self, path):
+    with open(os.path.join(path, 'index.json')) as f:
+      meta = json.load(f)
+    self.k = meta['k']
+    self.transcript_ids = meta['transcript_ids']
+    load = lambda n: np.load(os.path.join(path, n + '.npy'), mmap_mode='r')
+    self.postings = load('postings')
+    self.kmer_offsets = load('kmer_offsets')
+    self.seq_offsets = load('seq_offsets')
+    self.seqs_rc = load('seqs_rc')
+
+  def get_seq_rc(self, it):
+    """Reverse-complemented sequence of the it-th transcript."""
+    a, b = self.seq_offsets[it], self.seq_offsets[it + 1]
+    return self.seqs_rc[a:b].tobytes().decode('ascii')
+
+  def _candidates(self, mm_seed):
+    """
+    Returns the postings of the windows which can hold a seed: the ones
+    starting with a compatible k-mer and the ones with other nucleotides
+    than ACGU.
+    """
+    skip = mm_seed.mirna_start_pairing - 1
+    if self.k > min(mm_seed.allowed_lengths):
+      raise ValueError("k-mer length exceeds the shortest seed length.")
+    if skip < 0 or skip + self.k > mm_seed.len_mirna_seq:
+      return self.postings
+    words = seed.seed_words(
+      mm_seed.mirna_seq[skip:skip + self.k],
+      max(mm_seed.allowed_mismatches[l] for l in mm_seed.allowed_lengths),
+      max(mm_seed.allowed_gu_wobbles[l] for l in mm_seed.allowed_lengths)
+    )
+    codes = [seed.kmer_code(w[0]) for w in words] + [4 ** self.k]
+    return np.concatenate([
+      self.postings[self.kmer_offsets[c]:self.kmer_offsets[c + 1]]
+      for c in codes
+    ])
+
+  def find_potential_targets_with_seed(self, mirna_seq, **kwargs):
+    """
+    Searches for seed(s) in all the indexed transcripts. Takes the mmSeed
+    arguments (but target_seq).
+
+    Returns:
+      dict: For each transcript with site(s), the same per-site lists as
+        mmSeed.find_potential_targets_with_seed.
+    """
+    mm_seed = seed.mmSeed(target_seq='', mirna_seq=mirna_seq, **kwargs)
+    skip = mm_seed.mirna_start_pairing - 1
+    candidates = np.unique(self._candidates(mm_seed), axis=0)
+    bounds = np.searchsorted(
+      candidates[:, 0], np.arange(len(self.transcript_ids) + 1)
+    )
+    if skip < 0 or mm_seed.min_target_length < self.k:
+      # Some positions hold no k-mer (too close to the ends)
+      transcripts = range(len(self.transcript_ids))
+    else:
+      transcripts = np.unique(candidates[:, 0]).tolist()
+
+    results = {}
+    for it in transcripts:
+      len_target_seq = int(self.seq_offsets[it + 1] - self.seq_offsets[it])
+      stop = len_target_seq - mm_seed.min_target_length + 1
+      positions = set(
+        i for i in candidates[bounds[it]:bounds[it + 1], 1].tolist()
+        if skip <= i < stop
+      )
+      positions.update(range(skip, min(0, stop)))
+      positions.update(range(max(skip, len_target_seq - self.k + 1), stop))
+      if len(positions) == 0:
+        continue
+      out = mm_seed._collect_sites(
+        mm_seed._scan_positions(self.get_seq_rc(it), sorted(positions)),
+        len_target_seq
+      )
+      if len(out['end_sites']) > 0:
+        results[self.transcript_ids[it]] = out
+    return results
@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+
+#
+# Copyright (C) 2011-2013 Charles E. Vejnar
+#
+# This is free software, licensed under the GNU General Public License v3.
+# See /LICENSE for more information.
+#
+
+"""
+Columnar storage of target sites and of their features: the seed and the
+feature modules keep their sites and features in a SiteTable, and the
+per-site lists (i.e. mmSeed.end_sites, mmTargetScan.tgs_aus) are views of
+its columns (ColumnList).
+"""
+
+import array
+import collections
+
+import numpy as np
+
+#: A target site found by the seed search
+Site = collections.namedtuple('Site', [
+  'end_site',
+  'seed_length',
+  'nb_mismatches_except_gu_wobbles',
+  'nb_gu_wobbles',
+  'pairing',
+])
+
+
+def encode_pairing(pairing):
+  """Returns the pairing as a bit mask (bit j set if pairing[j] != 0)."""
+  mask = 0
+  for j, p in enumerate(pairing):
+    if p != 0:
+      mask |= 1 << j
+  return mask
+
+
+def decode_pairing(mask, length, shift=1):
+  """Returns the pairing list encoded with encode_pairing."""
+  return [j + shift if (mask >> j) & 1 else 0 for j in range(length)]
+
+
+class SiteTable(object):
+  """
+  Table of target sites, with one typed array (column) per site attribute
+  and per feature. Pairings are stored as bit masks.
+
+  Args:
+    mirna_start_pairing (int): As in seed.mmSeed, to decode the pairings.
+  """
+
+  __slots__ = ('columns', 'pairing_shift')
+
+  SITE_COLUMNS = (
+    ('end_sites', np.int32, 'l'),
+    ('seed_lengths', np.int8, 'l'),
+    ('nb_mismatches_except_gu_wobbles', np.int8, 'l'),
+    ('nb_gu_wobbles', np.int8, 'l'),
+    ('pairing_masks', np.uint64, 'L'),
+    ('pairing_lengths', np.int8, 'l'),
+  )
+
+  def __init__(self, mirna_start_pairing=2):
+    self.columns = collections.OrderedDict(
+      (name, np.zeros(0, dtype=dtype))
+      for name, dtype, _ in self.SITE_COLUMNS
+    )
+    # In mmSeed, the pairing value of the j-th nucleotide is j + 1, but
+    # without the leading unpaired nucleotides if mirna_start_pairing < 1
+    self.pairing_shift = 1 + min(0, mirna_start_pairing - 1)
+
+  @classmethod
+  def from_sites(cls, sites, mirna_start_pairing=2):
+    """
+    Builds the table from an iterable of Site.
+    """
+    table = cls(mirna_start_pairing)
+    buffers = [array.array(code) for _, _, code in cls.SITE_COLUMNS]
+    for site in sites:
+      buffers[0].append(site.end_site)
+      buffers[1].append(site.seed_length)
+      buffers[2].append(site.nb_mismatches_except_gu_wobbles)
+      buffers[3].append(site.nb_gu_wobbles)
+      buffers[4].append(encode_pairing(site.pairing))
+      buffers[5].append(len(site.pairing))
+    for (name, dtype, _), buf in zip(cls.SITE_COLUMNS, buffers):
+      table.columns[name] = np.array(buf, dtype=dtype)
+    return table
+
+  @classmethod
+  def from_seed(cls, mm_seed):
+    """
+    Builds the table from the sites found by a seed.mmSeed.
+    """
+    return cls.from_sites(mm_seed.found_sites(), mm_seed.mirna_start_pairing)
+
+  def copy(self):
+    """Returns a new table sharing the columns (no copy of the arrays)."""
+    table = SiteTable()
+    table.columns = collections.OrderedDict(self.columns)
+    table.pairing_shift = self.pairing_shift
+    return table
+
+  def __len__(self):
+    return len(self.columns['end_sites'])
+
+  def __contains__(self, name):
+    return name in self.columns
+
+  def __getitem__(self, name):
+    """Returns the column itself (no copy)."""
+    return self.columns[name]
+
+  @property
+  def names(self):
+    return list(self.columns.keys())
+
+  def add_column(self, name, values, dtype=np.float64):
+    """
+    Adds (or replaces) a column. None values are stored as NaN (but in
+    object columns).
+    """
+    if not isinstance(values, np.ndarray):
+      if dtype is not object:
+        values = [np.nan if v is None else v for v in values]
+      values = np.array(values, dtype=dtype)
+    if len(values) != len(self):
+      raise ValueError("Column %s has %i values for %i sites." % (
+        name, len(values), len(self)))
+    self.columns[name] = values
+
+  def tolist(self, name):
+    """
+    Returns a column as a list, NaN as None. 'pairings' are the decoded
+    pairings.
+    """
+    if name == 'pairings':
+      return [self.pairing(i) for i in range(len(self))]
+    column = self.columns[name]
+    values = column.tolist()
+    if column.dtype.kind == 'f':
+      values = [None if v != v else v for v in values]
+    return values
+
+  def pairing(self, i):
+    return decode_pairing(
+      int(self.columns['pairing_masks'][i]),
+      int(self.columns['pairing_lengths'][i]),
+      self.pairing_shift
+    )
+
+  def site(self, i):
+    """Returns the i-th site as a Site."""
+    return Site(
+      int(self.columns['end_sites'][i]),
+      int(self.columns['seed_lengths'][i]),
+      int(self.columns['nb_mismatches_except_gu_wobbles'][i]),
+      int(self.columns['nb_gu_wobbles'][i]),
+      self.pairing(i)
+    )
+
+  def __iter__(self):
+    for i in range(len(self)):
+      yield self.site(i)
+
+
+def module_table(module):
+  """
+  Returns the site_table of a feature module (with a seed attribute): the
+  site columns of the seed site_table, shared, and the feature columns of
+  the module. It is started again when the seed sites change.
+  """
+  table = module.__dict__.get('site_table')
+  seed_table = module.seed.site_table
+  if table is None or table['end_sites'] is not seed_table['end_sites']:
+    table = seed_table.copy()
+    module.site_table = table
+  return table
+
+
+class ColumnView(list):
+  """
+  List of the values of a SiteTable column, as returned by ColumnList.
+  Setting an item also sets it in the column; the number of sites is fixed
+  by the seed, so the list cannot grow or shrink.
+  """
+
+  def __init__(self, table, column, writable=True):
+    list.__init__(self, table.tolist(column))
+    self.table = table
+    self.column = column
+    self.writable = writable
+
+  def __setitem__(self, key, value):
+    if not self.writable:
+      raise TypeError("'%s' is read-only" % self.column)
+    array = self.table.columns[self.column]
+    stored = value
+    if isinstance(key, slice):
+      stored = value = list(value)
+      if len(value) != len(range(*key.indices(len(self)))):
+        self._resize()
+      if array.dtype.kind == 'f':
+        stored = [np.nan if v is None else v for v in value]
+    elif value is None and array.dtype.kind == 'f':
+      stored = np.nan
+    array[key] = stored
+    list.__setitem__(self, key, value)
+
+  def __reduce__(self):
+    return (ColumnView, (self.table, self.column, self.writable))
+
+  def _resize(self, *args, **kwargs):
+    raise TypeError("The number of sites of '%s' is fixed" % self.column)
+
+  append = extend = insert = pop = remove = clear = _resize
+  __delitem__ = __iadd__ = __imul__ = _resize
+
+
+class ColumnList(object):
+  """
+  Per-site list attribute (i.e. tgs_aus) stored as a column of the
+  site_table of its owner. Reading it returns a ColumnView (NaN as None),
+  the same one until the column is set again, and is an AttributeError
+  until the column is set.
+
+  Args:
+    column (str): Column name (i.e. tgs_au).
+    dtype: Column type (object for strings).
+    name (str): Attribute name, for the errors (defaults to column + 's').
+    writable (bool): Assigning a list sets the column in module_table.
+  """
+
+  def __init__(self, column, dtype=np.float64, name=None, writable=True):
+    self.column = column
+    self.dtype = dtype
+    self.name = column + 's' if name is None else name
+    self.writable = writable
+
+  def __get__(self, obj, objtype=None):
+    if obj is None:
+      return self
+    try:
+      table = obj.__dict__['site_table']
+      array = table.columns.get(self.column)
+      if array is None and self.column != 'pairings':
+        raise KeyError(self.column)
+    except KeyError:
+      raise AttributeError("'%s' object has no attribute '%s'" % (
+        type(obj).__name__, self.name))
+    key = '_' + self.column + '_view'
+    cached = obj.__dict__.get(key)
+    if cached is None or cached[0] is not table or cached[1] is not array:
+      cached = (table, array, ColumnView(table, self.column, self.writable))
+      obj.__dict__[key] = cached
+    return cached[2]
+
+  def __set__(self, obj, values):
+    if not self.writable:
+      raise AttributeError("can't set attribute")
+    module_table(obj).add_column(self.column, values, self.dtype)
@@ -17,6 +17,8 @@ import tempfile
 
 from mirmap.vienna import which
 
+_versions = {}
+
 
 class Spatt(object):
   """
@@ -27,6 +29,21 @@ class Spatt(object):
     if not which("sspatt"):
       raise EnvironmentError("SPATT is required for Exact Probabilities.")
 
+  def version(self):
+    """Returns the version line of sspatt ('' if unknown)."""
+    if 'sspatt' not in _versions:
+      try:
+        p = subprocess.Popen(
+          ['sspatt', '--version'],
+          stdout=subprocess.PIPE,
+          cwd=tempfile.gettempdir()
+        )
+        stdout, stderr = p.communicate()
+        _versions['sspatt'] = stdout.decode().strip()
+      except (IOError, OSError):
+        _versions['sspatt'] = ''
+    return _versions['sspatt']
+
   def get_exact_prob(self, **kwargs):
 
     cmd = [
@@ -66,7 +83,6 @@ class Spatt(object):
     stdout, stderr = p.communicate()
     markovf.close()
     seqf.close()
-    print(stdout)
 
     reg = r'P\(N>=Nobs\)=(?P<prob>\S+)'
     decoded = re.search(reg, stdout.decode())
@@ -10,10 +10,15 @@
 """TargetScan features."""
 
 from __future__ import division
+import collections
 import operator
 
 from collections import namedtuple
 
+import numpy as np
+
+from mirmap import seed, sites, utils
+
 try:
   operator.div = operator.truediv
 except AttributeError:
@@ -56,6 +61,91 @@ def align_helper(utr_3p_seq, mir_3p_seq, mir_offset, utr_offset, overhang):
   return score
 
 
+#: Scores computed by mmTargetScan for each site
+FEATURES = ['tgs_au', 'tgs_position', 'tgs_pairing3p', 'tgs_score']
+
+#: 3' pairing scores by (UTR 3' sequence, miRNA 3' sequence, overhang)
+pairing3p_cache = utils.LRUCache(100000)
+
+#: Watson-Crick complements of the miRNA nucleotides
+WC_COMPLEMENTS = {'A': 'U', 'U': 'A', 'G': 'C', 'C': 'G'}
+
+_mirna_3p_tables = {}
+
+
+def mirna_3p_table(mir_3p_seq, overhang):
+  """
+  Returns the complements, the weights and the cumulated weights of the
+  nucleotides of a miRNA 3' sequence, computed once by miRNA.
+  """
+  try:
+    return _mirna_3p_tables[mir_3p_seq, overhang]
+  except KeyError:
+    complements = [WC_COMPLEMENTS.get(nt) for nt in mir_3p_seq]
+    weights = [1 if 4 <= m - overhang <= 7 else 0.5
+               for m in range(len(mir_3p_seq))]
+    cum_weights = [0]
+    for weight in weights:
+      cum_weights.append(cum_weights[-1] + weight)
+    table = complements, weights, cum_weights
+    _mirna_3p_tables[mir_3p_seq, overhang] = table
+    return table
+
+
+def pairing3p_score(utr_3p_seq, mir_3p_seq, overhang):
+  """
+  Returns the best align_helper score over all the offsets of the UTR and
+  miRNA 3' sequences, i.e. the 3' pairing score before correction.
+
+  Each diagonal of the match matrix is swept once: its score is the best
+  weighted run of at least 2 matches, minus the offset penalty. The miRNA
+  complements and weights are precomputed once by miRNA, and the scores
+  are cached in pairing3p_cache.
+  """
+  key = (utr_3p_seq, mir_3p_seq, overhang)
+  try:
+    return pairing3p_cache[key]
+  except KeyError:
+    pass
+  complements, weights, cum_weights = mirna_3p_table(mir_3p_seq, overhang)
+
+  len_utr = len(utr_3p_seq)
+  len_mir = len(mir_3p_seq)
+  if max(len_utr, len_mir) == 0:
+    raise ValueError("No 3' sequence to align.")
+  best = None
+  for offset in range(max(len_utr, len_mir)):
+    penalty = max(0, (offset - 2) / 2.0)
+    for mir_offset, utr_offset in [(offset, 0), (0, offset)]:
+      length = max(0, min(len_mir - mir_offset, len_utr - utr_offset))
+      # Skip the diagonals which can't do better even if fully paired
+      start = min(mir_offset, len_mir)
+      if best is not None and (cum_weights[start + length] -
+                               cum_weights[start] - penalty <= best):
+        continue
+      score = 0
+      run = 0
+      run_score = 0
+      for i in range(length):
+        m = i + mir_offset
+        if utr_3p_seq[i + utr_offset] == complements[m]:
+          run += 1
+          run_score += weights[m]
+        else:
+          if run >= 2 and run_score > score:
+            score = run_score
+          run = 0
+          run_score = 0
+      if run >= 2 and run_score > score:
+        score = run_score
+      score -= penalty
+      if best is None or score > best:
+        best = score
+  best = float(best)
+  pairing3p_cache[key] = best
+  return best
+
+
 class mmTargetScan(object):
   """
   miRmap TargetScan.
@@ -64,18 +154,29 @@ class mmTargetScan(object):
      ts_types (object): Parameters by seed-type.
      ca_window_length (int): Sequence length to compute the score with.
      with_correction (bool): Apply the linear regression correction?
+     engine (str): 'python' (default) or 'numpy' (all the sites at once).
+     fused (bool): Compute all the scores in a single pass over the sites.
   """
 
+  #: Per-site scores, columns of site_table (sites.module_table)
+  tgs_aus = sites.ColumnList('tgs_au')
+  tgs_positions = sites.ColumnList('tgs_position')
+  tgs_pairing3ps = sites.ColumnList('tgs_pairing3p')
+  tgs_scores = sites.ColumnList('tgs_score')
+
   def __init__(self, seed, **kwargs):
     self.seed = seed
     self.__init_defaults()
     self.__init_args(**kwargs)
+    self._au_denominators = {}
     self._routine_done = False
 
   def __init_args(self, **kwargs):
     allowed_args = [
       'ca_window_length',
       'with_correction',
+      'engine',
+      'fused',
     ]
     arg = {k: v for k, v in kwargs.items() if k in allowed_args}
     self.__dict__.update(arg)
@@ -201,7 +302,9 @@ class mmTargetScan(object):
     self.__dict__.update({
       'with_correction': True,
       'ca_window_length': 30,
-      'ts_types': ts_types
+      'ts_types': ts_types,
+      'engine': 'python',
+      'fused': False,
     })
 
   def _targetscan_ts_type(self, seed_length, nt1):
@@ -215,142 +318,217 @@ class mmTargetScan(object):
 
     raise ValueError("seed_length should be >= 6.")
 
-  def _eval_tgs_au(self):
+  def _site_ts_type(self, end_site, seed_length):
     """
-    Computes the *AU content* score.
+    Returns the TargetScan parameters of the site type.
     """
+    ts_type = self._targetscan_ts_type(
+      seed_length,
+      self.seed.target_seq[end_site - 1]
+    )
+    return self.ts_types[ts_type]
 
-    # Reset
-    self.tgs_aus = []
+  def _au_denominator(self, tts, len_up, len_down):
+    """
+    Returns the sum of the inverse weights of the AU content windows,
+    cached by site type and window lengths.
+    """
+    key = (tts.name, len_up, len_down)
+    try:
+      return self._au_denominators[key]
+    except KeyError:
+      wup = tts.ca_weights_up[len(tts.ca_weights_up) - len_up:]
+      wdn = tts.ca_weights_down[:len_down]
+      denominator = sum([
+        sum(map(operator.div, [1.0] * len(wup), wup)),
+        sum(map(operator.div, [1.0] * len(wdn), wdn))
+      ])
+      self._au_denominators[key] = denominator
+      return denominator
+
+  def _au_correction(self, content, tts):
+    if self.with_correction:
+      return sum([
+        content * tts.ca_fc_slope,
+        tts.ca_fc_intercept - tts.fc_mean
+      ])
+    else:
+      return content
+
+  def _site_tgs_au(self, end_site, tts, target_seq=None):
     # Helper function
     binarize = lambda x: 1.0 if x in ['U', 'A'] else 0.0
+    if target_seq is None:
+      target_seq = self.seed.target_seq
+
+    sus = max(
+      0,
+      end_site + tts.up_shift - self.ca_window_length
+    )
+    sue = end_site + tts.up_shift
+    seq_up = target_seq[sus:sue]
+
+    sds = end_site - 1 + tts.down_shift
+    sde = min(
+      len(target_seq),
+      end_site + self.ca_window_length - 1 + tts.down_shift
+    )
+    seq_down = target_seq[sds:sde]
+
+    wup = tts.ca_weights_up[len(tts.ca_weights_up) - len(seq_up):]
+    wdn = tts.ca_weights_down[:len(seq_down)]
+
+    content = sum([
+      sum(map(operator.div, map(binarize, seq_up), wup)),
+      sum(map(operator.div, map(binarize, seq_down), wdn))
+    ])
 
-    # Compute
-    for its in range(len(self.seed.end_sites)):
-      end_site = self.seed.end_sites[its]
-      try:
-        ts_type = self._targetscan_ts_type(
-          self.seed.seed_lengths[its],
-          self.seed.target_seq[end_site - 1]
-        )
-        tts = self.ts_types[ts_type]
-
-        sus = max(
-          0,
-          end_site + tts.up_shift - self.ca_window_length
-        )
-        sue = end_site + tts.up_shift
-        seq_up = self.seed.target_seq[sus:sue]
-
-        sds = end_site - 1 + tts.down_shift
-        sde = min(
-          self.seed.len_target_seq,
-          end_site + self.ca_window_length - 1 + tts.down_shift
-        )
-        seq_down = self.seed.target_seq[sds:sde]
-
-        wup = tts.ca_weights_up[len(tts.ca_weights_up) - len(seq_up):]
-        wdn = tts.ca_weights_down[:len(seq_down)]
-
-        content = sum([
-          sum(map(operator.div, map(binarize, seq_up), wup)),
-          sum(map(operator.div, map(binarize, seq_down), wdn))
-        ])
+    content /= self._au_denominator(tts, len(wup), len(wdn))
 
-        content /= sum([
-          sum(map(operator.div, [1.0] * len(wup), wup)),
-          sum(map(operator.div, [1.0] * len(wdn), wdn))
-        ])
+    return self._au_correction(content, tts)
 
-        if self.with_correction:
-          self.tgs_aus.append(sum([
-            content * tts.ca_fc_slope,
-            tts.ca_fc_intercept - tts.fc_mean
-          ]))
-        else:
-          self.tgs_aus.append(content)
+  def _batch_tgs_au(self, sites):
+    """
+    Computes the *AU content* score of many sites at once: the weighted AU
+    counts are read from the convolutions of the binarized target with the
+    weights. Sites with windows going over the sequence start (or longer
+    than the weights) are computed with _site_tgs_au.
+    """
+    sites = list(sites)
+    tgs_aus = [None] * len(sites)
+    target = seed.encode_seq(self.seed.target_seq)
+    ca = self.ca_window_length
+    by_type = {}
+    for i, site in enumerate(sites):
+      try:
+        tts = self._site_ts_type(site.end_site, site.seed_length)
       except ValueError:
-        self.tgs_aus.append(None)
-    return self.tgs_aus
+        continue
+      if (target is None or site.end_site + tts.up_shift < 0 or
+          ca > len(tts.ca_weights_up) or ca > len(tts.ca_weights_down)):
+        tgs_aus[i] = self._site_tgs_au(site.end_site, tts)
+      else:
+        by_type.setdefault(tts.name, (tts, []))[1].append(i)
+    if len(by_type) == 0:
+      return tgs_aus
+
+    au = ((target == ord('A')) | (target == ord('U'))).astype(float)
+    len_target_seq = len(au)
+    for tts, indexes in by_type.values():
+      end_sites = np.array([sites[i].end_site for i in indexes])
+      # Upstream: sum of au[sue - d] / ca_weights_up[-d] for d = 1..len_up
+      conv_up = np.convolve(au, 1.0 / np.array(tts.ca_weights_up[::-1][:ca]))
+      sue = end_sites + tts.up_shift
+      len_up = np.minimum(sue, ca)
+      sum_up = np.where(sue > 0, conv_up[np.maximum(sue - 1, 0)], 0.0)
+      # Downstream: sum of au[sds + j] / ca_weights_down[j] for j < len_down
+      conv_down = np.convolve(
+        au, 1.0 / np.array(tts.ca_weights_down[:ca][::-1]))
+      sds = end_sites - 1 + tts.down_shift
+      len_down = np.minimum(len_target_seq - sds, ca)
+      sum_down = np.where(
+        len_down > 0,
+        conv_down[np.minimum(sds + ca - 1, len(conv_down) - 1)],
+        0.0
+      )
+      denominators = np.array([
+        self._au_denominator(tts, int(lu), int(ld))
+        for lu, ld in zip(len_up, len_down)
+      ])
+      contents = self._au_correction(
+        (sum_up + sum_down) / denominators, tts)
+      for i, content in zip(indexes, contents.tolist()):
+        tgs_aus[i] = content
+    return tgs_aus
+
+  def _site_tgs_position(self, end_site, tts):
+    closest_term = min(
+      end_site + tts.up_shift,
+      self.seed.len_target_seq - end_site + tts.down_shift,
+      1500
+    )
+
+    if self.with_correction:
+      return sum([
+        float(closest_term) * tts.po_fc_slope,
+        tts.po_fc_intercept - tts.fc_mean
+      ])
+    else:
+      return float(closest_term)
+
+  def _site_tgs_pairing3p(self, end_site, tts, target_seq=None,
+                          mirna_seq=None):
+    if target_seq is None:
+      target_seq = self.seed.target_seq
+    if mirna_seq is None:
+      mirna_seq = self.seed.mirna_seq
+    uts = max(0, end_site - tts.pa_mirna_seed_start - 15)
+    ute = end_site - tts.pa_mirna_seed_start
+    utr_3p_seq = target_seq[uts:ute][::-1]
+    mir_3p_seq = mirna_seq[tts.pa_mirna_seed_start:]
+    score = pairing3p_score(
+      utr_3p_seq, mir_3p_seq, tts.pa_mirna_seed_overhang)
+    if self.with_correction:
+      return sum([
+        score * tts.pa_fc_slope,
+        tts.pa_fc_intercept - tts.fc_mean
+      ])
+    else:
+      return score
+
+  def _site_tgs_score(self, tgs_au, tgs_position, tgs_pairing3p, tts):
+    if self.with_correction:
+      return sum([tgs_au, tgs_position, tgs_pairing3p, tts.fc_mean])
+    else:
+      return sum([tgs_au, tgs_position, tgs_pairing3p])
+
+  def _eval_tgs_au(self):
+    """
+    Computes the *AU content* score.
+    """
+
+    if self.engine == 'numpy':
+      tgs_aus = self._batch_tgs_au(self.seed.found_sites())
+    else:
+      tgs_aus = []
+      for site in self.seed.found_sites():
+        try:
+          tts = self._site_ts_type(site.end_site, site.seed_length)
+          tgs_aus.append(self._site_tgs_au(site.end_site, tts))
+        except ValueError:
+          tgs_aus.append(None)
+    self.tgs_aus = tgs_aus
+    return tgs_aus
 
   def _eval_tgs_position(self):
     """
     Computes the *UTR position* score.
     """
 
-    # Reset
-    self.tgs_positions = []
-    # Compute
-    for its in range(len(self.seed.end_sites)):
-      end_site = self.seed.end_sites[its]
+    tgs_positions = []
+    for site in self.seed.found_sites():
       try:
-        ts_type = self._targetscan_ts_type(
-          self.seed.seed_lengths[its],
-          self.seed.target_seq[end_site - 1]
-        )
-        tts = self.ts_types[ts_type]
-        closest_term = min(
-          end_site + tts.up_shift,
-          self.seed.len_target_seq - end_site + tts.down_shift,
-          1500
-        )
-
-        if self.with_correction:
-          self.tgs_positions.append(sum([
-            float(closest_term) * tts.po_fc_slope,
-            tts.po_fc_intercept - tts.fc_mean
-          ]))
-        else:
-          self.tgs_positions.append(float(closest_term))
+        tts = self._site_ts_type(site.end_site, site.seed_length)
+        tgs_positions.append(self._site_tgs_position(site.end_site, tts))
       except ValueError:
-        self.tgs_positions.append(None)
-    return self.tgs_positions
+        tgs_positions.append(None)
+    self.tgs_positions = tgs_positions
+    return tgs_positions
 
   def _eval_tgs_pairing3p(self):
     """
     Computes the *3' pairing* score.
     """
 
-    # Reset
-    self.tgs_pairing3ps = []
-    # Compute
-    for its in range(len(self.seed.end_sites)):
-      end_site = self.seed.end_sites[its]
+    tgs_pairing3ps = []
+    for site in self.seed.found_sites():
       try:
-        ts_type = self._targetscan_ts_type(
-          self.seed.seed_lengths[its],
-          self.seed.target_seq[end_site - 1]
-        )
-        tts = self.ts_types[ts_type]
-
-        uts = max(0, end_site - tts.pa_mirna_seed_start - 15)
-        ute = end_site - tts.pa_mirna_seed_start
-        utr_3p_seq = self.seed.target_seq[uts:ute][::-1]
-        mir_3p_seq = self.seed.mirna_seq[tts.pa_mirna_seed_start:]
-        maxscore = max(len(utr_3p_seq), len(mir_3p_seq))
-        scores_mir = []
-        scores_utr = []
-        for offset in range(maxscore):
-          scores_mir.append(align_helper(
-            utr_3p_seq, mir_3p_seq, offset, 0,
-            tts.pa_mirna_seed_overhang)
-          )
-          scores_utr.append(align_helper(
-            utr_3p_seq, mir_3p_seq, 0, offset,
-            tts.pa_mirna_seed_overhang)
-          )
-        if self.with_correction:
-          self.tgs_pairing3ps.append(sum([
-            float(max(scores_mir + scores_utr)) * tts.pa_fc_slope,
-            tts.pa_fc_intercept - tts.fc_mean
-          ]))
-        else:
-          self.tgs_pairing3ps.append(
-            float(max(scores_mir + scores_utr))
-          )
+        tts = self._site_ts_type(site.end_site, site.seed_length)
+        tgs_pairing3ps.append(self._site_tgs_pairing3p(site.end_site, tts))
       except ValueError:
-        self.tgs_pairing3ps.append(None)
-    return self.tgs_pairing3ps
+        tgs_pairing3ps.append(None)
+    self.tgs_pairing3ps = tgs_pairing3ps
+    return tgs_pairing3ps
 
   def _eval_tgs_score(self):
     """
@@ -358,41 +536,93 @@ class mmTargetScan(object):
     and *3' pairing* scores.
     """
 
-    # Reset
-    self.tgs_scores = []
-    # Compute
-    for its in range(len(self.seed.end_sites)):
-      end_site = self.seed.end_sites[its]
-      try:
-        ts_type = self._targetscan_ts_type(
-          self.seed.seed_lengths[its],
-          self.seed.target_seq[end_site - 1]
-        )
-        tts = self.ts_types[ts_type]
-        if self.with_correction:
-          self.tgs_scores.append(sum([
-            self.tgs_aus[its],
-            self.tgs_positions[its],
-            self.tgs_pairing3ps[its],
-            tts.fc_mean]
-          ))
-        else:
-          self.tgs_scores.append(sum([
-            self.tgs_aus[its],
-            self.tgs_positions[its],
-            self.tgs_pairing3ps[its]
-          ]))
-      except AttributeError as e:
-        if 'mmTargetScan' in str(e):
-          raise AttributeError("Routine Did not Run.")
-        self.tgs_scores.append(None)
-    return self.tgs_scores
+    try:
+      components = list(utils.izip(
+        self.tgs_aus, self.tgs_positions, self.tgs_pairing3ps))
+    except AttributeError:
+      raise AttributeError("Routine Did not Run.")
+    tgs_scores = []
+    for site, site_components in utils.izip(self.seed.found_sites(),
+                                            components):
+      if None in site_components:
+        tgs_scores.append(None)
+      else:
+        tts = self._site_ts_type(site.end_site, site.seed_length)
+        tgs_scores.append(self._site_tgs_score(*(site_components + (tts,))))
+    self.tgs_scores = tgs_scores
+    return tgs_scores
+
+  def _site_features(self, site, tgs_au=None):
+    """
+    Computes all the scores of a site, resolving its type once.
+
+    Args:
+      tgs_au (float): Precomputed *AU content* score.
+    """
+    try:
+      tts = self._site_ts_type(site.end_site, site.seed_length)
+    except ValueError:
+      return dict.fromkeys(FEATURES)
+    if tgs_au is None:
+      tgs_au = self._site_tgs_au(site.end_site, tts)
+    features = {
+      'tgs_au': tgs_au,
+      'tgs_position': self._site_tgs_position(site.end_site, tts),
+    }
+    try:
+      features['tgs_pairing3p'] = self._site_tgs_pairing3p(site.end_site, tts)
+    except ValueError:
+      features['tgs_pairing3p'] = None
+    if features['tgs_pairing3p'] is None:
+      features['tgs_score'] = None
+    else:
+      features['tgs_score'] = self._site_tgs_score(
+        features['tgs_au'], features['tgs_position'],
+        features['tgs_pairing3p'], tts
+      )
+    return features
+
+  def _eval_fused(self):
+    """
+    Computes all the scores in a single pass over the sites.
+    """
+    sites = list(self.seed.found_sites())
+    if self.engine == 'numpy':
+      tgs_aus = self._batch_tgs_au(sites)
+    else:
+      tgs_aus = [None] * len(sites)
+    records = [
+      self._site_features(site, tgs_au)
+      for site, tgs_au in zip(sites, tgs_aus)
+    ]
+    for feature in FEATURES:
+      setattr(self, feature + 's', [r[feature] for r in records])
+    return records
+
+  def iter_features(self, sites=None):
+    """
+    Computes the TargetScan features site by site.
+
+    Args:
+      sites (iterable): Sites (seed.Site) to evaluate. Defaults to the
+        sites streamed by the seed search.
+
+    Yields:
+      tuple: The site and a dict of its features.
+    """
+    if sites is None:
+      sites = self.seed.iter_sites()
+    for site in sites:
+      yield site, self._site_features(site)
 
   def routine(self):
-    self._eval_tgs_au()
-    self._eval_tgs_position()
-    self._eval_tgs_pairing3p()
-    self._eval_tgs_score()
+    if self.fused:
+      self._eval_fused()
+    else:
+      self._eval_tgs_au()
+      self._eval_tgs_position()
+      self._eval_tgs_pairing3p()
+      self._eval_tgs_score()
     self._routine_done = True
 
   @property
@@ -438,3 +668,216 @@ class mmTargetScan(object):
       tgs_scores = max(self.tgs_scores)
     finally:
       return tgs_scores
+
+
+class mmTargetScanBatch(object):
+  """
+  TargetScan features of one miRNA over many transcripts. The miRNA and
+  site type parameters are prepared once, the transcripts are passed to
+  evaluate (nothing shared is modified: an instance can be used from many
+  threads), and instances can be pickled to worker processes.
+
+  Args:
+    mirna_seq* (str): miRNA sequence.
+    The other arguments are the mmTargetScan ones (engine defaults to
+    'numpy').
+  *: Required
+  """
+
+  def __init__(self, mirna_seq, **kwargs):
+    self.mirna_seq = mirna_seq.upper()
+    self.kwargs = dict({'engine': 'numpy'}, **kwargs)
+    self.__init_target_scan()
+
+  def __init_target_scan(self):
+    # Never given a seed: only its site type parameters and helpers are used
+    self._target_scan = mmTargetScan(None, **self.kwargs)
+    self._ts_params = self.__ts_params()
+
+  def __ts_params(self):
+    """
+    Returns the parameters of the site types as arrays, by name: the inverse
+    AU weights of full windows and the AU denominators by window lengths
+    (None if the windows are longer than the weights).
+    """
+    target_scan = self._target_scan
+    ca = target_scan.ca_window_length
+    ts_params = {}
+    for name, tts in target_scan.ts_types.items():
+      mirna_3p_table(self.mirna_seq[tts.pa_mirna_seed_start:],
+                     tts.pa_mirna_seed_overhang)
+      params = {'tts': tts, 'inv_up': None}
+      if ca <= len(tts.ca_weights_up) and ca <= len(tts.ca_weights_down):
+        params['inv_up'] = 1.0 / np.array(tts.ca_weights_up[::-1][:ca])
+        params['inv_down'] = 1.0 / np.array(tts.ca_weights_down[:ca][::-1])
+        # No window at all (0): undefined
+        params['denominators'] = np.array([
+          [target_scan._au_denominator(tts, len_up, len_down) or np.nan
+           for len_down in range(ca + 1)]
+          for len_up in range(ca + 1)
+        ])
+      ts_params[name] = params
+    return ts_params
+
+  def __getstate__(self):
+    # The site type parameters are built again by each process
+    return {'mirna_seq': self.mirna_seq, 'kwargs': self.kwargs}
+
+  def __setstate__(self, state):
+    self.__dict__.update(state)
+    self.__init_target_scan()
+
+  def _ts_type_indexes(self, target_seq, end_sites, seed_lengths):
+    """
+    Returns the site indexes by site type name (as
+    mmTargetScan._targetscan_ts_type).
+    """
+    is_a = np.array([target_seq[e - 1] == 'A' for e in end_sites.tolist()],
+                    dtype=bool)
+    return [
+      ('8mer', np.nonzero((seed_lengths == 6) & is_a)[0]),
+      ('7mer-m8', np.nonzero((seed_lengths == 6) & ~is_a)[0]),
+      ('7mer-A1', np.nonzero((seed_lengths >= 7) & is_a)[0]),
+      ('6mer', np.nonzero((seed_lengths >= 7) & ~is_a)[0]),
+    ]
+
+  def _tgs_aus(self, target_seq, target, end_sites, params):
+    """
+    Computes the *AU content* scores of sites of the same type, from the
+    convolutions of the binarized target with the weights (as
+    mmTargetScan._batch_tgs_au).
+    """
+    target_scan = self._target_scan
+    tts = params['tts']
+    ca = target_scan.ca_window_length
+    sue = end_sites + tts.up_shift
+    if (target_scan.engine == 'numpy' and target is not None and
+        params['inv_up'] is not None):
+      direct = sue >= 0
+    else:
+      direct = np.zeros(len(end_sites), dtype=bool)
+    tgs_aus = np.empty(len(end_sites))
+    for i in np.nonzero(~direct)[0].tolist():
+      tgs_aus[i] = target_scan._site_tgs_au(int(end_sites[i]), tts,
+                                            target_seq)
+    if not direct.any():
+      return tgs_aus
+    au = ((target == ord('A')) | (target == ord('U'))).astype(float)
+    end_sites = end_sites[direct]
+    sue = sue[direct]
+    # Upstream: sum of au[sue - d] / ca_weights_up[-d] for d = 1..len_up
+    conv_up = np.convolve(au, params['inv_up'])
+    len_up = np.minimum(sue, ca)
+    sum_up = np.where(sue > 0, conv_up[np.maximum(sue - 1, 0)], 0.0)
+    # Downstream: sum of au[sds + j] / ca_weights_down[j] for j < len_down
+    conv_down = np.convolve(au, params['inv_down'])
+    sds = end_sites - 1 + tts.down_shift
+    len_down = np.clip(len(au) - sds, 0, ca)
+    sum_down = np.where(
+      len_down > 0,
+      conv_down[np.minimum(sds + ca - 1, len(conv_down) - 1)],
+      0.0
+    )
+    contents = (sum_up + sum_down) / params['denominators'][len_up, len_down]
+    tgs_aus[direct] = target_scan._au_correction(contents, tts)
+    return tgs_aus
+
+  def _tgs_positions(self, target_seq, end_sites, tts):
+    """Computes the *UTR position* scores of sites of the same type."""
+    closest_term = np.minimum(np.minimum(
+      end_sites + tts.up_shift,
+      len(target_seq) - end_sites + tts.down_shift
+    ), 1500).astype(float)
+    if self._target_scan.with_correction:
+      return closest_term * tts.po_fc_slope + (
+        tts.po_fc_intercept - tts.fc_mean)
+    return closest_term
+
+  def _tgs_pairing3ps(self, target_seq, end_sites, tts):
+    """Computes the *3' pairing* scores of sites of the same type."""
+    tgs_pairing3ps = np.empty(len(end_sites))
+    for i, end_site in enumerate(end_sites.tolist()):
+      try:
+        tgs_pairing3ps[i] = self._target_scan._site_tgs_pairing3p(
+          end_site, tts, target_seq, self.mirna_seq)
+      except ValueError:
+        tgs_pairing3ps[i] = np.nan
+    return tgs_pairing3ps
+
+  def evaluate_target(self, target_seq, target_sites):
+    """
+    Computes the features of the sites of one transcript.
+
+    Args:
+      target_seq (str): Target sequence.
+      target_sites: sites.SiteTable or iterable of seed.Site.
+
+    Returns:
+      tuple: The end_sites and a dict of the FEATURES columns (NaN if
+        undefined).
+    """
+    if isinstance(target_sites, sites.SiteTable):
+      end_sites = target_sites['end_sites'].astype(np.int64)
+      seed_lengths = target_sites['seed_lengths']
+    else:
+      target_sites = list(target_sites)
+      end_sites = np.array([s.end_site for s in target_sites],
+                           dtype=np.int64)
+      seed_lengths = np.array([s.seed_length for s in target_sites],
+                              dtype=np.int64)
+    target = seed.encode_seq(target_seq)
+    features = dict((feature, np.full(len(end_sites), np.nan))
+                    for feature in FEATURES)
+    for name, indexes in self._ts_type_indexes(target_seq, end_sites,
+                                               seed_lengths):
+      if len(indexes) == 0:
+        continue
+      params = self._ts_params[name]
+      tts = params['tts']
+      type_end_sites = end_sites[indexes]
+      tgs_aus = self._tgs_aus(target_seq, target, type_end_sites, params)
+      tgs_positions = self._tgs_positions(target_seq, type_end_sites, tts)
+      tgs_pairing3ps = self._tgs_pairing3ps(target_seq, type_end_sites, tts)
+      tgs_scores = tgs_aus + tgs_positions + tgs_pairing3ps
+      if self._target_scan.with_correction:
+        tgs_scores += tts.fc_mean
+      features['tgs_au'][indexes] = tgs_aus
+      features['tgs_position'][indexes] = tgs_positions
+      features['tgs_pairing3p'][indexes] = tgs_pairing3ps
+      features['tgs_score'][indexes] = tgs_scores
+    return end_sites, features
+
+  def evaluate(self, inputs):
+    """
+    Computes the features of the sites of many transcripts.
+
+    Args:
+      inputs (iterable): (target sequence, sites) pairs, sites being a
+        sites.SiteTable or an iterable of seed.Site.
+
+    Returns:
+      dict: NumPy columns over all the sites: transcripts (index of the
+        input), end_sites and the FEATURES (NaN if undefined).
+    """
+    transcripts = []
+    end_sites = []
+    features = dict((feature, []) for feature in FEATURES)
+    for it, (target_seq, target_sites) in enumerate(inputs):
+      target_end_sites, target_features = self.evaluate_target(
+        target_seq, target_sites)
+      transcripts.append(np.full(len(target_end_sites), it, dtype=np.int32))
+      end_sites.append(target_end_sites.astype(np.int32))
+      for feature in FEATURES:
+        features[feature].append(target_features[feature])
+
+    columns = collections.OrderedDict([
+      ('transcripts', np.concatenate(transcripts or [[]]).astype(np.int32)),
+      ('end_sites', np.concatenate(end_sites or [[]]).astype(np.int32)),
+    ])
+    for feature in FEATURES:
+      columns[feature] = np.concatenate(
+        features[feature] or [[]]).astype(np.float64)
+    return columns
+
+  #: For worker pools (i.e. pool.map(batch, chunks_of_inputs))
+  __call__ = evaluate
@@ -7,8 +7,16 @@
 # See /LICENSE for more information.
 #
 
+from mirmap.cache import CachedRNAvienna
+from mirmap.sites import ColumnList
+from mirmap.seed import seed_words
 from mirmap.vienna import RNAvienna
-from mirmap.utils import gen_dot_bracket_notation
+from mirmap.utils import LRUCache, gen_dot_bracket_notation
+from mirmap.utils import reverse_complement
+
+#: Seed duplex energy tables by miRNA seeds and folding parameters, for
+#: the last miRNAs
+_seed_duplex_tables = LRUCache(16)
 
 
 class mmThermo(object):
@@ -22,8 +30,28 @@ class mmThermo(object):
     dg_binding_area (int): Supplementary sequence length to fold
       (applied twice: upstream and downstream).
     temperature (float): Folding temperature.
+    vienna_pool_size (int): Number of persistent Vienna processes per
+      program (vienna.ViennaPool, shared by the instances with the same
+      size). By default, a process is run per call.
+    fold_cache (cache.ResultCache): Cache of the folding results
+      (cache.CachedRNAvienna), i.e. with an SQLite store shared between
+      processes.
+    fold (vienna.RNAvienna): Vienna interface, to share between instances.
+    seed_duplex_table (bool): Co-fold every target seed word allowed by
+      the seed parameters once per miRNA (get_seed_duplex_table), and look
+      up the seed energies of the sites.
   """
 
+  #: Per-site energies (and duplex structures), columns of site_table
+  #: (sites.module_table)
+  dg_duplex_seeds = ColumnList('dg_duplex_seed')
+  dg_binding_seeds = ColumnList('dg_binding_seed')
+  dg_duplexs = ColumnList('dg_duplex')
+  dg_duplex_foldings = ColumnList('dg_duplex_folding', dtype=object)
+  dg_bindings = ColumnList('dg_binding')
+  dg_opens = ColumnList('dg_open')
+  dg_totals = ColumnList('dg_total')
+
   def __init__(self, seed, **kwargs):
     self.seed = seed
     defaults = {
@@ -32,159 +60,313 @@ class mmThermo(object):
       'upstream_rest': 10,
       'downstream_rest': 15,
       'dg_binding_area': 70,
+      'vienna_pool_size': None,
+      'fold_cache': None,
+      'seed_duplex_table': False,
     }
-    self.fold = RNAvienna()
     self.__dict__.update(defaults)
     self.__dict__.update(kwargs)
+    if 'fold' not in kwargs:
+      if self.fold_cache is None:
+        self.fold = RNAvienna(pool_size=self.vienna_pool_size)
+      else:
+        self.fold = CachedRNAvienna(self.fold_cache,
+                                    pool_size=self.vienna_pool_size)
     self._routine_done = False
 
-  def _eval_dg_duplex(self):
-    self.dg_duplex_seeds = []
-    self.dg_binding_seeds = []
-    self.dg_duplexs = []
-    self.dg_duplex_foldings = []
-    self.dg_bindings = []
-    # Compute
-    for its in range(len(self.seed.end_sites)):
-      # Target site and seed binding sequences
-      a1 = self.seed.end_sites[its] - self.seed.min_target_length
-      b1 = self.seed.end_sites[its]
-      target_site_seq = self.seed.target_seq[a1:b1]
-
-      a2 = (
-        self.seed.end_sites[its] -
-        (self.mirna_start_pairing - 1) -
-        self.seed.seed_lengths[its]
-      )
-      b2 = (self.seed.end_sites[its] - (self.mirna_start_pairing - 1))
-      target_seed_seq = self.seed.target_seq[a2:b2]
-
-      a3 = self.mirna_start_pairing - 1
-      b3 = self.mirna_start_pairing + self.seed.seed_lengths[its] - 1
-      mirna_seed_seq = self.seed.mirna_seq[a3:b3]
-
-      # Constraint sequence
-      len_no_constraints = (
-        self.seed.min_target_length -
-        self.seed.seed_lengths[its] -
-        (self.mirna_start_pairing - 1)
-      )
-      constraints_seq = (
-        '.' * len_no_constraints +
-        gen_dot_bracket_notation(self.seed.pairings[its]) +
-        '.' * len_no_constraints
-      )
-      # Co-folding of seed
-      result = self.fold.cofold(
-        target_seed_seq,
-        mirna_seed_seq,
+  def _site_dg_duplex_inputs(self, end_site, seed_length, pairing):
+    """
+    Returns the co-folding inputs of a site: the seed pair of sequences,
+    and the target site pair of sequences with its constraints.
+    """
+    # Target site and seed binding sequences
+    a1 = end_site - self.seed.min_target_length
+    b1 = end_site
+    target_site_seq = self.seed.target_seq[a1:b1]
+
+    a2 = (
+      end_site -
+      (self.mirna_start_pairing - 1) -
+      seed_length
+    )
+    b2 = (end_site - (self.mirna_start_pairing - 1))
+    target_seed_seq = self.seed.target_seq[a2:b2]
+
+    a3 = self.mirna_start_pairing - 1
+    b3 = self.mirna_start_pairing + seed_length - 1
+    mirna_seed_seq = self.seed.mirna_seq[a3:b3]
+
+    # Constraint sequence
+    len_no_constraints = (
+      self.seed.min_target_length -
+      seed_length -
+      (self.mirna_start_pairing - 1)
+    )
+    constraints_seq = (
+      '.' * len_no_constraints +
+      gen_dot_bracket_notation(pairing) +
+      '.' * len_no_constraints
+    )
+    return (
+      (target_seed_seq, mirna_seed_seq),
+      (target_site_seq, self.seed.mirna_seq),
+      constraints_seq
+    )
+
+  def get_seed_duplex_table(self):
+    """
+    Returns the co-folding results of the miRNA seeds with all the target
+    seed words allowed by the seed parameters, by (target seed word with U,
+    miRNA seed). Tables are cached by miRNA seeds and folding parameters.
+    """
+    skip = self.mirna_start_pairing - 1
+    mirna_seeds = [
+      (self.seed.mirna_seq[skip:skip + l], self.seed.allowed_mismatches[l],
+       self.seed.allowed_gu_wobbles[l])
+      for l in self.seed.allowed_lengths
+    ]
+    key = (tuple(mirna_seeds), self.temperature,
+           self.fold.version('RNAcofold'))
+    try:
+      return _seed_duplex_tables[key]
+    except KeyError:
+      pass
+    pairs = []
+    for mirna_seed, max_mismatches, max_gu_wobbles in mirna_seeds:
+      for word, _, _ in seed_words(
+          mirna_seed.upper(), max_mismatches, max_gu_wobbles):
+        # Words are on the reverse-complemented target
+        pairs.append((reverse_complement(word).replace('T', 'U'), mirna_seed))
+    results = self.fold.cofold_many(
+      pairs,
+      partfunc=True,
+      temperature=self.temperature
+    )
+    table = dict(zip(pairs, results))
+    _seed_duplex_tables[key] = table
+    return table
+
+  def _seed_duplex_results(self, seed_pairs):
+    """
+    Returns the co-folding results of the seed pairs, from the seed duplex
+    table if enabled (pairs missing in the table are co-folded). The table
+    is only built once there are pairs.
+    """
+    if len(seed_pairs) == 0:
+      return []
+    if not self.seed_duplex_table:
+      return self.fold.cofold_many(
+        seed_pairs,
         partfunc=True,
         temperature=self.temperature
       )
+    table = self.get_seed_duplex_table()
+    keys = [(pair[0].upper().replace('T', 'U'), pair[1])
+            for pair in seed_pairs]
+    missing = [i for i, key in enumerate(keys) if key not in table]
+    computed = dict(zip(missing, self.fold.cofold_many(
+      [seed_pairs[i] for i in missing],
+      partfunc=True,
+      temperature=self.temperature
+    )))
+    return [computed[i] if i in computed else table[key]
+            for i, key in enumerate(keys)]
 
-      self.dg_duplex_seeds.append(result['mfe'])
-      self.dg_binding_seeds.append(result['efe_binding'])
-      # Co-folding of target site
+  @staticmethod
+  def _dg_duplex_result(result_seed, result):
+    return {
+      'dg_duplex_seed': result_seed['mfe'],
+      'dg_binding_seed': result_seed['efe_binding'],
+      'dg_duplex': result['mfe'],
+      'dg_duplex_folding': result['mfe_structure'],
+      'dg_binding': result['efe_binding'],
+    }
 
-      result = self.fold.cofold(
-        target_site_seq,
-        self.seed.mirna_seq,
-        constraints=constraints_seq,
+  def _site_dg_duplex(self, end_site, seed_length, pairing):
+    seed_pair, site_pair, constraints_seq = self._site_dg_duplex_inputs(
+      end_site, seed_length, pairing)
+    # Co-folding of seed
+    if self.seed_duplex_table:
+      result_seed = self._seed_duplex_results([seed_pair])[0]
+    else:
+      result_seed = self.fold.cofold(
+        seed_pair[0],
+        seed_pair[1],
         partfunc=True,
         temperature=self.temperature
       )
-      self.dg_duplexs.append(result['mfe'])
-      self.dg_duplex_foldings.append(result['mfe_structure'])
-      self.dg_bindings.append(result['efe_binding'])
+    # Co-folding of target site
+    result = self.fold.cofold(
+      site_pair[0],
+      site_pair[1],
+      constraints=constraints_seq,
+      partfunc=True,
+      temperature=self.temperature
+    )
+    return self._dg_duplex_result(result_seed, result)
 
-    return {
-      'dg_duplex_seeds': self.dg_duplex_seeds,
-      'dg_binding_seeds': self.dg_binding_seeds,
-      'dg_duplexs': self.dg_duplexs,
-      'dg_duplex_foldings': self.dg_duplex_foldings,
-      'dg_bindings': self.dg_bindings,
-    }
+  def _batch_dg_duplex(self, sites):
+    """
+    Computes the *ΔG duplex* features of many sites, with one RNAcofold
+    run for the seeds and one for the target sites.
+    """
+    inputs = [
+      self._site_dg_duplex_inputs(
+        site.end_site, site.seed_length, site.pairing)
+      for site in sites
+    ]
+    results_seed = self._seed_duplex_results([i[0] for i in inputs])
+    results = self.fold.cofold_many(
+      [i[1] for i in inputs],
+      constraints=[i[2] for i in inputs],
+      partfunc=True,
+      temperature=self.temperature
+    )
+    return [self._dg_duplex_result(result_seed, result)
+            for result_seed, result in zip(results_seed, results)]
 
-  def _eval_dg_open(self):
+  def _eval_dg_duplex(self):
+    results = self._batch_dg_duplex(list(self.seed.found_sites()))
+    out = {}
+    for name in ['dg_duplex_seed', 'dg_binding_seed', 'dg_duplex',
+                 'dg_duplex_folding', 'dg_binding']:
+      out[name + 's'] = [result[name] for result in results]
+      setattr(self, name + 's', out[name + 's'])
+    return out
+
+  def _site_dg_open_inputs(self, end_site):
     """
-    Computes the *ΔG open* score.
+    Returns the folding inputs of the *ΔG open* score of a site: the
+    sequence and the constraints of the site.
     """
-    self.dg_opens = []
-    # Compute
-    for its in range(len(self.seed.end_sites)):
+    len_polya_upstream = 0
+    len_polya_downstream = 0
+    start_dg_open_targetseq = 0
+    end_dg_open_targetseq = 0
+    start_theoretic = (
+      end_site -
+      self.seed.min_target_length -
+      self.upstream_rest -
+      self.dg_binding_area + 1
+    )
+
+    end_theoretic = (
+      end_site +
+      self.downstream_rest +
+      self.dg_binding_area
+    )
+
+    if start_theoretic < 1:
+      start_dg_open_targetseq = 1
+      len_polya_upstream = abs(start_theoretic) + 1
+    else:
+      start_dg_open_targetseq = start_theoretic
       len_polya_upstream = 0
+
+    if end_theoretic > self.seed.len_target_seq:
+      end_dg_open_targetseq = self.seed.len_target_seq
+      len_polya_downstream = end_theoretic - self.seed.len_target_seq
+    else:
+      end_dg_open_targetseq = end_theoretic
       len_polya_downstream = 0
-      start_dg_open_targetseq = 0
-      end_dg_open_targetseq = 0
-      start_theoretic = (
-        self.seed.end_sites[its] -
-        self.seed.min_target_length -
-        self.upstream_rest -
-        self.dg_binding_area + 1
-      )
 
-      end_theoretic = (
-        self.seed.end_sites[its] +
-        self.downstream_rest +
-        self.dg_binding_area
-      )
+    a4 = start_dg_open_targetseq - 1
+    b4 = end_dg_open_targetseq
+    seq_for_dg_open = (
+      len_polya_upstream * 'A' +
+      self.seed.target_seq[a4:b4] +
+      len_polya_downstream * 'A'
+    )
 
-      if start_theoretic < 1:
-        start_dg_open_targetseq = 1
-        len_polya_upstream = abs(start_theoretic) + 1
-      else:
-        start_dg_open_targetseq = start_theoretic
-        len_polya_upstream = 0
+    # Constraint sequences
+    c1 = (self.upstream_rest + self.seed.min_target_length +
+          self.downstream_rest)
+    constraints_seq = (
+      '.' * self.dg_binding_area +
+      'x' * c1 +
+      '.' * self.dg_binding_area
+    )
+    return seq_for_dg_open, constraints_seq
 
-      if end_theoretic > self.seed.len_target_seq:
-        end_dg_open_targetseq = self.seed.len_target_seq
-        len_polya_downstream = end_theoretic - self.seed.len_target_seq
-      else:
-        end_dg_open_targetseq = end_theoretic
-        len_polya_downstream = 0
-
-      a4 = start_dg_open_targetseq - 1
-      b4 = end_dg_open_targetseq
-      seq_for_dg_open = (
-        len_polya_upstream * 'A' +
-        self.seed.target_seq[a4:b4] +
-        len_polya_downstream * 'A'
-      )
+  def _site_dg_open(self, end_site):
+    """
+    Computes the *ΔG open* score of a site.
+    """
+    seq_for_dg_open, constraints_seq = self._site_dg_open_inputs(end_site)
+    # Folding
+    # dg0
+    result_dg0 = self.fold.fold(
+      seq_for_dg_open,
+      partfunc=True,
+      temperature=self.temperature
+    )
+    # dg1
+    result_dg1 = self.fold.fold(
+      seq_for_dg_open,
+      constraints=constraints_seq,
+      partfunc=True,
+      temperature=self.temperature,
+    )
+    # dg_open
+    return result_dg1['efe'] - result_dg0['efe']
 
-      # Constraint sequences
-      c1 = (self.upstream_rest + self.seed.min_target_length +
-            self.downstream_rest)
-      constraints_seq = (
-        '.' * self.dg_binding_area +
-        'x' * c1 +
-        '.' * self.dg_binding_area
-      )
-      # Folding
-      # dg0
-      result_dg0 = self.fold.fold(
-        seq_for_dg_open,
-        partfunc=True,
-        temperature=self.temperature
-      )
-      # dg1
-      result_dg1 = self.fold.fold(
-        seq_for_dg_open,
-        constraints=constraints_seq,
-        partfunc=True,
-        temperature=self.temperature,
-      )
-      # dg_open
-      self.dg_opens.append(result_dg1['efe'] - result_dg0['efe'])
-    return self.dg_opens
+  def _batch_dg_open(self, sites):
+    """
+    Computes the *ΔG open* scores of many sites, with one RNAfold run
+    without constraints and one with.
+    """
+    inputs = [self._site_dg_open_inputs(site.end_site) for site in sites]
+    results_dg0 = self.fold.fold_many(
+      [i[0] for i in inputs],
+      partfunc=True,
+      temperature=self.temperature
+    )
+    results_dg1 = self.fold.fold_many(
+      [i[0] for i in inputs],
+      constraints=[i[1] for i in inputs],
+      partfunc=True,
+      temperature=self.temperature
+    )
+    return [result_dg1['efe'] - result_dg0['efe']
+            for result_dg0, result_dg1 in zip(results_dg0, results_dg1)]
+
+  def _eval_dg_open(self):
+    """
+    Computes the *ΔG open* score.
+    """
+    dg_opens = self._batch_dg_open(list(self.seed.found_sites()))
+    self.dg_opens = dg_opens
+    return dg_opens
 
   def _eval_dg_total(self):
     """
     Computes the *ΔG total* score combining *ΔG duplex* and *ΔG open* scores.
     """
-    self.dg_totals = []
-    # Compute
-    for its in range(len(self.seed.end_sites)):
-      self.dg_totals.append(self.dg_duplexs[its] + self.dg_opens[its])
+    self.dg_totals = [
+      dg_duplex + dg_open
+      for dg_duplex, dg_open in zip(self.dg_duplexs, self.dg_opens)
+    ]
+
+  def iter_features(self, sites=None):
+    """
+    Computes the thermodynamic features site by site.
+
+    Args:
+      sites (iterable): Sites (seed.Site) to evaluate. Defaults to the
+        sites streamed by the seed search.
+
+    Yields:
+      tuple: The site and a dict of its features.
+    """
+    if sites is None:
+      sites = self.seed.iter_sites()
+    for site in sites:
+      features = self._site_dg_duplex(
+        site.end_site, site.seed_length, site.pairing
+      )
+      features['dg_open'] = self._site_dg_open(site.end_site)
+      features['dg_total'] = features['dg_duplex'] + features['dg_open']
+      yield site, features
 
   def routine(self):
     self._eval_dg_duplex()
@@ -10,11 +10,11 @@
 """Common functions."""
 
 import collections
+import hashlib
 import itertools
 import functools
 
-from Bio import SeqIO, Seq
-from Bio.Alphabet import generic_rna, generic_dna
+from Bio import SeqIO
 
 
 try:
@@ -24,8 +24,15 @@ try:
 except (AttributeError, ImportError):
   # fallback for Python 2
   from itertools import izip_longest
+  from string import maketrans
   zip_longest = izip_longest
 
+try:
+  # Lazy zip for Python 2
+  from itertools import izip
+except ImportError:
+  izip = zip
+
 
 def grouper(n, iterable, fillvalue=None):
   """http://docs.python.org/library/itertools.html#recipes"""
@@ -64,10 +71,145 @@ def load_fasta(fasta, as_string=False):
       return out
 
 
-def reverse_complement(seq):
-  alphabet = generic_rna if 'U' in seq or 'u' in seq else generic_dna
-  s = Seq.Seq(seq, alphabet).reverse_complement()
-  return str(s)
+def read_seq_blocks(handle, block_size=1 << 20):
+  """
+  Reads a sequence (raw or first FASTA record) from a file handle or an mmap
+  by blocks of at most block_size characters, without header lines and
+  whitespaces.
+  """
+  in_header = False
+  at_line_start = True
+  nb_records = 0
+  while True:
+    block = handle.read(block_size)
+    if not block:
+      break
+    if isinstance(block, bytes):
+      block = block.decode('ascii')
+    parts = []
+    for il, line in enumerate(block.split('\n')):
+      if il > 0:
+        at_line_start = True
+        in_header = False
+      if at_line_start and line.startswith('>'):
+        nb_records += 1
+        if nb_records > 1:
+          return
+        in_header = True
+      if not in_header:
+        parts.append(line)
+      if line:
+        at_line_start = False
+    block = ''.join(''.join(parts).split())
+    if block:
+      yield block
+
+
+#: IUPAC complements (as in Biopython)
+DNA_COMPLEMENTS = 'ACGTMRWSYKVHDBXN', 'TGCAKYWSRMBDHVXN'
+RNA_COMPLEMENTS = 'ACGUMRWSYKVHDBXN', 'UGCAKYWSRMBDHVXN'
+
+
+def _complement_tables(complements):
+  before = complements[0] + complements[0].lower()
+  after = complements[1] + complements[1].lower()
+  try:
+    return maketrans(before, after), bytes.maketrans(
+      before.encode('ascii'), after.encode('ascii'))
+  except AttributeError:
+    # Python 2: bytes is str
+    table = maketrans(before, after)
+    return table, table
+
+
+_dna_complement_tables = _complement_tables(DNA_COMPLEMENTS)
+_rna_complement_tables = _complement_tables(RNA_COMPLEMENTS)
+
+class LRUCache(object):
+  """
+  Mapping keeping the maxsize last used items, with hit and miss counts.
+  """
+
+  def __init__(self, maxsize=100000):
+    self.maxsize = maxsize
+    self.hits = 0
+    self.misses = 0
+    self._items = collections.OrderedDict()
+
+  def __getitem__(self, key):
+    try:
+      value = self._items.pop(key)
+    except KeyError:
+      self.misses += 1
+      raise
+    self.hits += 1
+    self._items[key] = value
+    return value
+
+  def __setitem__(self, key, value):
+    self._items.pop(key, None)
+    while len(self._items) >= self.maxsize > 0:
+      self._items.popitem(last=False)
+    if self.maxsize > 0:
+      self._items[key] = value
+
+  def __contains__(self, key):
+    return key in self._items
+
+  def __len__(self):
+    return len(self._items)
+
+  def get(self, key, default=None):
+    try:
+      return self[key]
+    except KeyError:
+      return default
+
+  def clear(self):
+    self._items.clear()
+    self.hits = 0
+    self.misses = 0
+
+  @property
+  def stats(self):
+    return {'hits': self.hits, 'misses': self.misses, 'size': len(self)}
+
+
+#: Memo of the last reverse complements (sequence: reverse complement)
+RC_MEMO_SIZE = 16
+_rc_memo = LRUCache(RC_MEMO_SIZE)
+
+
+def seq_hash(seq):
+  """Digest of a sequence, to use as a cache key."""
+  if not isinstance(seq, bytes):
+    seq = seq.encode('utf-8')
+  return hashlib.sha1(seq).hexdigest()
+
+
+def reverse_complement(seq, memo=False):
+  """
+  Returns the reverse complement of a str or bytes sequence, RNA if it has
+  any U (else DNA).
+
+  Args:
+    memo (bool): Remember the last RC_MEMO_SIZE reverse complements, for
+      sequences searched many times (i.e. a transcript by many miRNAs).
+  """
+  if memo:
+    try:
+      return _rc_memo[seq]
+    except KeyError:
+      seq_rc = reverse_complement(seq)
+      _rc_memo[seq] = seq_rc
+      return seq_rc
+  if isinstance(seq, bytes) and not isinstance(seq, str):
+    rna = b'U' in seq or b'u' in seq
+    table = (_rna_complement_tables if rna else _dna_complement_tables)[1]
+  else:
+    rna = 'U' in seq or 'u' in seq
+    table = (_rna_complement_tables if rna else _dna_complement_tables)[0]
+  return seq.translate(table)[::-1]
 
 
 def rgetattr(obj, attr, default=None):
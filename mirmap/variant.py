@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+
+#
+# Copyright (C) 2011-2013 Charles E. Vejnar
+#
+# This is free software, licensed under the GNU General Public License v3.
+# See /LICENSE for more information.
+#
+
+"""
+Rescoring of the sites of a miRmap result for variants (SNPs, indels) of
+the target sequence.
+
+Only the seed windows overlapping the edits are searched again, and only the
+features with a sequence context overlapping the edits are computed again:
+the others are taken from the reference result.
+"""
+
+import collections
+import copy
+
+from mirmap import prob, sites, targetscan
+
+#: A sequence edit: 1-based position, reference and alternative alleles
+Edit = collections.namedtuple('Edit', ['position', 'ref', 'alt'])
+
+DG_FEATURES = ['dg_duplex', 'dg_binding', 'dg_duplex_seed', 'dg_binding_seed',
+               'dg_open', 'dg_total']
+EVOLUTION_FEATURES = ['cons_bls', 'selec_phylop']
+
+
+def apply_edits(seq, edits):
+  """
+  Applies non-overlapping edits to a sequence.
+
+  Returns:
+    tuple: The edited sequence, the start and end (0-based, end excluded)
+      of the edited region in the sequence, and its end in the edited
+      sequence.
+  """
+  edits = sorted(edits, key=lambda e: e.position)
+  if len(edits) == 0:
+    raise ValueError("No edit to apply.")
+  parts = []
+  previous = 0
+  for edit in edits:
+    start = edit.position - 1
+    end = start + len(edit.ref)
+    if start < previous or end > len(seq):
+      raise ValueError("Overlapping or out of range edit: %s" % (edit,))
+    if seq[start:end] != edit.ref.upper():
+      raise ValueError("Reference allele mismatch: %s" % (edit,))
+    parts.append(seq[previous:start])
+    parts.append(edit.alt.upper())
+    previous = end
+  parts.append(seq[previous:])
+  edited_seq = ''.join(parts)
+  return (edited_seq, edits[0].position - 1, previous,
+          previous + len(edited_seq) - len(seq))
+
+
+class mmVariant(object):
+  """
+  Rescores a miRmap result for variants of its target sequence.
+
+  Args:
+    mirmap (model.miRmap)*: Reference result.
+    update_transitions (bool): Update the Markov transitions of the
+      probability features to the edited sequence (disable if the
+      transitions were given; ignored with a background model).
+  *: Required
+  """
+
+  def __init__(self, mirmap, **kwargs):
+    self.__dict__.update({
+      'update_transitions': True,
+    })
+    self.__dict__.update(kwargs)
+    if not mirmap._routine_done:
+      mirmap.routine()
+    self.mirmap = mirmap
+    self.seed = mirmap._seed
+    if self.seed.mirna_start_pairing < 1:
+      raise ValueError("Variant rescoring needs mirna_start_pairing >= 1.")
+    self.sites = list(self.seed.found_sites())
+    self.table = mirmap.site_table
+    prob_binomial = mirmap._prob_binomial
+    if prob_binomial.background is not None:
+      # The background model doesn't depend on the target
+      self.update_transitions = False
+    if self.update_transitions:
+      self.counts = prob.count_words(
+        self.seed.target_seq, prob_binomial.alphabet,
+        prob_binomial.markov_order
+      )
+
+  def _tgs_context(self, end_site):
+    """Target region (0-based, end excluded) used by TargetScan features."""
+    target_scan = self.mirmap._target_scan
+    ts_types = target_scan.ts_types.values()
+    start = min(
+      end_site + min(t.up_shift for t in ts_types) -
+      target_scan.ca_window_length,
+      end_site - max(t.pa_mirna_seed_start for t in ts_types) - 15
+    )
+    end = (end_site + target_scan.ca_window_length +
+           max(t.down_shift for t in ts_types))
+    return start - 1, end
+
+  def _dg_context(self, end_site):
+    """Target region (0-based, end excluded) used by ΔG features."""
+    thermo = self.mirmap._thermodynamic
+    return (
+      end_site - self.seed.min_target_length - thermo.upstream_rest -
+      thermo.dg_binding_area,
+      end_site + thermo.downstream_rest + thermo.dg_binding_area
+    )
+
+  def _edited_seed(self, target_seq, start, end, edited_end):
+    """
+    Returns the seed of the edited sequence, with its sites as (site,
+    index of the reference site or None if searched again).
+    """
+    ref_seed = self.seed
+    skip = ref_seed.mirna_start_pairing - 1
+    max_length = max(ref_seed.allowed_lengths)
+    shift = edited_end - end
+    # Searched positions (as in mmSeed._scan_forward)
+    first = ref_seed.min_target_length - 1
+    last = len(target_seq) - skip
+
+    edited_seed = copy.copy(ref_seed)
+    edited_seed.target_seq = target_seq
+    edited_seed.len_target_seq = len(target_seq)
+
+    rows = []
+    for index, site in enumerate(self.sites):
+      f = site.end_site - 1 - skip
+      if f < start and f < last:
+        rows.append((site, index))
+      elif f - max_length + 1 >= end and f + shift >= first:
+        rows.append((site._replace(end_site=site.end_site + shift), index))
+    for lo, hi in [
+      # Windows overlapping the edits
+      (start, edited_end + max_length - 1),
+      # Positions not searched in the reference sequence
+      (ref_seed.len_target_seq - skip, start),
+      (edited_end + max_length - 1, first + shift),
+    ]:
+      lo = max(lo, first)
+      hi = min(hi, last)
+      if hi > lo:
+        rows.extend(
+          (site, None) for site in edited_seed._scan_forward(
+            target_seq, 0, lo, hi, 'U' in target_seq)
+        )
+    rows.sort(key=lambda r: -r[0].end_site)
+
+    edited_seed.site_table = sites.SiteTable.from_sites(
+      (r[0] for r in rows), ref_seed.mirna_start_pairing)
+    return edited_seed, rows
+
+  def _edited_prob_binomial(self, edited_seed, start, end, edited_end):
+    prob_binomial = copy.copy(self.mirmap._prob_binomial)
+    prob_binomial.seed = edited_seed
+    if not self.update_transitions:
+      return prob_binomial
+    target_seq = edited_seed.target_seq
+    order = prob_binomial.markov_order
+    if set(target_seq) != set(self.seed.target_seq):
+      alphabet = list(set(target_seq))
+      prob_binomial.alphabet = alphabet
+      prob_binomial.transitions = prob.get_transitions(
+        target_seq, alphabet, order)
+    else:
+      # Only the words overlapping the edits are counted again
+      counts = dict(self.counts)
+      a = max(0, start - order)
+      removed = prob.count_words(
+        self.seed.target_seq[a:end + order], prob_binomial.alphabet, order)
+      added = prob.count_words(
+        target_seq[a:edited_end + order], prob_binomial.alphabet, order)
+      for word in counts:
+        counts[word] += added[word] - removed[word]
+      prob_binomial.transitions = prob.transitions_from_counts(
+        counts, prob_binomial.alphabet, order)
+    return prob_binomial
+
+  def rescore(self, edits):
+    """
+    Scores the sites of the target sequence with edits.
+
+    Args:
+      edits (list): Edits (variant.Edit) of the target sequence.
+
+    Returns:
+      sites.SiteTable: Sites of the edited sequence with their features
+        and score. Evolutionary features are taken from the reference
+        sites, and are NaN for the sites searched again.
+    """
+    target_seq, start, end, edited_end = apply_edits(
+      self.seed.target_seq, edits)
+    edited_seed, rows = self._edited_seed(target_seq, start, end, edited_end)
+    table = edited_seed.site_table.copy()
+    overlaps = lambda context: context[0] <= end and start <= context[1]
+
+    def reused(index, context):
+      return index is not None and not overlaps(context(
+        self.sites[index].end_site))
+
+    features = collections.defaultdict(list)
+
+    # TargetScan
+    target_scan = copy.copy(self.mirmap._target_scan)
+    target_scan.seed = edited_seed
+    for site, index in rows:
+      if not reused(index, self._tgs_context):
+        for name, value in next(target_scan.iter_features([site]))[1].items():
+          features[name].append(value)
+        continue
+      au = self.table['tgs_au'][index]
+      pairing3p = self.table['tgs_pairing3p'][index]
+      try:
+        tts = target_scan._site_ts_type(site.end_site, site.seed_length)
+      except ValueError:
+        values = dict.fromkeys(targetscan.FEATURES)
+      else:
+        position = target_scan._site_tgs_position(site.end_site, tts)
+        values = {
+          'tgs_au': au,
+          'tgs_position': position,
+          'tgs_pairing3p': pairing3p,
+          'tgs_score': target_scan._site_tgs_score(
+            au, position, pairing3p, tts),
+        }
+      for name, value in values.items():
+        features[name].append(value)
+
+    # Probabilities: the counts and transitions are sequence-wide
+    prob_binomial = self._edited_prob_binomial(
+      edited_seed, start, end, edited_end)
+    for site, values in prob_binomial.iter_features([r[0] for r in rows]):
+      for name, value in values.items():
+        features[name].append(value)
+
+    # Thermodynamics
+    if 'dg_duplex' in self.table:
+      thermo = copy.copy(self.mirmap._thermodynamic)
+      thermo.seed = edited_seed
+      for site, index in rows:
+        if reused(index, self._dg_context):
+          for name in DG_FEATURES:
+            features[name].append(self.table[name][index])
+        else:
+          values = next(thermo.iter_features([site]))[1]
+          for name in DG_FEATURES:
+            features[name].append(values[name])
+
+    # Evolution isn't computed again
+    for name in EVOLUTION_FEATURES:
+      if name in self.table:
+        features[name] = [
+          None if index is None else self.table[name][index]
+          for _, index in rows
+        ]
+
+    for name in self.table.names:
+      if name in features:
+        table.add_column(name, features[name])
+      elif len(table) == 0 and name not in table:
+        # No site left: the same (empty) columns as the reference table
+        table.add_column(name, [])
+    table.add_column('score', self.mirmap._score_table(table))
+    return table
@@ -12,6 +12,9 @@ Interface classes with the `Vienna RNA <http://www.tbi.univie.ac.at/RNA>`
 executable programs.
 """
 
+import atexit
+import collections
+import os
 import re
 import subprocess
 import tempfile
@@ -21,7 +24,6 @@ try:
 except ImportError:
   #: Workaround for Python2.
   #: http://stackoverflow.com/a/9877856
-  import os
 
   def which(pgm):
     path = os.getenv('PATH')
@@ -31,12 +33,254 @@ except ImportError:
         return p
 
 
+#: Version lines of the Vienna programs
+_versions = {}
+
+#: Persistent process pools by (process id, size, max_pending), shared by
+#: the RNAvienna instances of a process
+_pools = {}
+
+
+def _decode(match):
+  """Returns the result dict of a folding result regex match."""
+  result = {}
+  for k, v in match.groupdict().items():
+    if 'structure' in k:
+      result[k] = v
+    else:
+      result[k] = float(v)
+  return result
+
+
+class ViennaProcess(object):
+  """
+  Long-lived Vienna program reading records on its standard input. The
+  output is parsed as a stream, record by record. If the program exits, it
+  is restarted and the records waiting for a result are sent again.
+
+  Args:
+    cmd (list): Command line.
+    regex (str): Regex parsing the result of one record.
+  """
+
+  def __init__(self, cmd, regex):
+    self.cmd = cmd
+    self.regex = re.compile(regex)
+    self.pending = collections.deque()
+    self.nb_restarts = 0
+    self._start()
+
+  def _start(self):
+    self.process = subprocess.Popen(
+      self.cmd,
+      stdin=subprocess.PIPE,
+      stdout=subprocess.PIPE,
+      cwd=tempfile.gettempdir(),
+      universal_newlines=True
+    )
+
+  def _write(self, text):
+    try:
+      self.process.stdin.write(text)
+      self.process.stdin.flush()
+    except (IOError, OSError):
+      # Handled when reading
+      pass
+
+  def _restart(self):
+    self.close()
+    self.nb_restarts += 1
+    self._start()
+    for text in self.pending:
+      self._write(text)
+
+  def send(self, text):
+    """Sends the input text of one record."""
+    self.pending.append(text)
+    self._write(text)
+
+  def receive(self):
+    """Returns the result of the oldest record sent."""
+    restarted = False
+    buf = ''
+    while True:
+      line = self.process.stdout.readline()
+      if line == '':
+        if restarted:
+          raise EnvironmentError("%s exited without result." % self.cmd[0])
+        restarted = True
+        buf = ''
+        self._restart()
+        continue
+      buf += line
+      match = self.regex.match(buf)
+      if match is not None:
+        self.pending.popleft()
+        return _decode(match)
+
+  def close(self):
+    for f in [self.process.stdin, self.process.stdout]:
+      try:
+        f.close()
+      except (IOError, OSError):
+        pass
+    self.process.wait()
+
+
+class ViennaPool(object):
+  """
+  Pool of ViennaProcess, with size processes per command line (program,
+  temperature, constraints and partition function flags).
+
+  Args:
+    size (int): Number of processes per command line.
+    max_pending (int): Maximum number of records sent to a process and
+      waiting for their result, to bound the data buffered in the pipes.
+  """
+
+  def __init__(self, size=1, max_pending=32):
+    self.size = size
+    self.max_pending = max_pending
+    self.processes = {}
+    #: Process owning the pipes, and number of handles (get_pool)
+    self.pid = os.getpid()
+    self.refs = 0
+
+  def _processes(self, cmd, regex):
+    key = tuple(cmd)
+    if key not in self.processes:
+      self.processes[key] = [ViennaProcess(cmd, regex)
+                             for _ in range(self.size)]
+    return self.processes[key]
+
+  def run(self, cmd, regex, inputs):
+    """
+    Returns the results of the input texts of records, spread over the
+    processes and pipelined.
+    """
+    processes = self._processes(cmd, regex)
+    to_send = [collections.deque(range(i, len(inputs), len(processes)))
+               for i in range(len(processes))]
+    sent = [collections.deque() for _ in processes]
+    results = [None] * len(inputs)
+    nb_received = 0
+    while nb_received < len(inputs):
+      for i, process in enumerate(processes):
+        while len(to_send[i]) > 0 and len(sent[i]) < self.max_pending:
+          index = to_send[i].popleft()
+          process.send(inputs[index])
+          sent[i].append(index)
+      for i, process in enumerate(processes):
+        if len(sent[i]) > 0:
+          results[sent[i].popleft()] = process.receive()
+          nb_received += 1
+    return results
+
+  def close(self):
+    for processes in self.processes.values():
+      for process in processes:
+        process.close()
+    self.processes = {}
+
+
+def get_pool(size, max_pending=32):
+  """
+  Returns a handle on the ViennaPool shared by all the RNAvienna instances
+  of the current process with the same size and max_pending, created once
+  (a forked child gets its own). Each handle is given back with
+  release_pool.
+  """
+  key = (os.getpid(), size, max_pending)
+  if key not in _pools:
+    _pools[key] = ViennaPool(size, max_pending)
+  pool = _pools[key]
+  pool.refs += 1
+  return pool
+
+
+def release_pool(pool):
+  """
+  Gives back a handle of get_pool: the persistent processes are stopped
+  with the last one.
+  """
+  pool.refs -= 1
+  if pool.refs <= 0:
+    pool.close()
+    key = (pool.pid, pool.size, pool.max_pending)
+    if _pools.get(key) is pool:
+      del _pools[key]
+
+
+@atexit.register
+def close_pools():
+  """Stops the persistent processes of the shared pools of this process."""
+  pid = os.getpid()
+  for key, pool in list(_pools.items()):
+    if key[0] == pid:
+      pool.close()
+      del _pools[key]
+
+
 class RNAvienna(object):
-  """Interface class for RNA programs from Vienna."""
+  """
+  Interface class for RNA programs from Vienna.
 
-  def __init__(self):
+  Args:
+    pool_size (int): If set, the programs are run as persistent processes
+      (ViennaPool shared with get_pool), pool_size per command line.
+    max_pending (int): Maximum number of records waiting for their result
+      per persistent process.
+
+  Used as a context manager, or with close, the handle on the shared pool
+  is given back: its processes are stopped once no other instance uses
+  them (they are started again if needed).
+  """
+
+  def __init__(self, pool_size=None, max_pending=32):
     if not which("RNAfold"):
       raise EnvironmentError("RNAfold Vienna is required for Thermodynamics.")
+    self.pool_size = pool_size or None
+    self.max_pending = max_pending
+    self.pool = None
+    self._get_pool()
+
+  def _get_pool(self):
+    """
+    Returns the shared pool (None without pool_size), taken again after
+    close or in a forked child.
+    """
+    if self.pool_size is not None and (self.pool is None or
+                                       self.pool.pid != os.getpid()):
+      self.pool = get_pool(self.pool_size, self.max_pending)
+    return self.pool
+
+  def version(self, prog):
+    """Returns the version line of a Vienna program ('' if unknown)."""
+    if prog not in _versions:
+      try:
+        p = subprocess.Popen(
+          [prog, '--version'],
+          stdin=subprocess.PIPE,
+          stdout=subprocess.PIPE,
+          cwd=tempfile.gettempdir()
+        )
+        stdout, stderr = p.communicate(b'')
+        _versions[prog] = stdout.decode().strip()
+      except (IOError, OSError):
+        _versions[prog] = ''
+    return _versions[prog]
+
+  def close(self):
+    """Gives back the handle on the shared pool (once)."""
+    if self.pool is not None and self.pool.pid == os.getpid():
+      release_pool(self.pool)
+    self.pool = None
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.close()
 
   def fold(self, seq, **kwargs):
     return self._fold([seq], 'RNAfold', **kwargs)
@@ -44,14 +288,52 @@ class RNAvienna(object):
   def cofold(self, seq1, seq2, **kwargs):
     return self._fold([seq1, seq2], 'RNAcofold', **kwargs)
 
+  def fold_many(self, seqs, constraints=None, **kwargs):
+    """
+    Folds many sequences with a single RNAfold process.
+
+    Args:
+      seqs (list): Sequences.
+      constraints (list): Constraints of every sequence (optional).
+      The other arguments are the fold ones.
+
+    Returns:
+      list: The fold result of every sequence.
+    """
+    return self._fold_many([[seq] for seq in seqs], 'RNAfold', constraints,
+                           **kwargs)
+
+  def cofold_many(self, seq_pairs, constraints=None, **kwargs):
+    """
+    Co-folds many pairs of sequences with a single RNAcofold process.
+
+    Args:
+      seq_pairs (list): Pairs of sequences.
+      constraints (list): Constraints of every pair (optional).
+      The other arguments are the cofold ones.
+
+    Returns:
+      list: The cofold result of every pair.
+    """
+    return self._fold_many([list(pair) for pair in seq_pairs], 'RNAcofold',
+                           constraints, **kwargs)
+
   def _fold(self, seqs, prog, **kwargs):
+    constraints = kwargs.pop('constraints', None)
+    return self._fold_many(
+      [seqs], prog, None if constraints is None else [constraints], **kwargs
+    )[0]
+
+  @staticmethod
+  def _command(prog, constraints=False, partfunc=False, temperature=None):
+    """Returns the command line and the regex parsing one result."""
     cmd = [format(prog), "--noPS"]
     regex = r'.+\n(?P<mfe_structure>\S+) \((?P<mfe>.+)\)'
 
-    if 'constraints' in kwargs:
+    if constraints:
       cmd.append('--constraint')
 
-    if kwargs.get('partfunc', False):
+    if partfunc:
       cmd.append('--partfunc')
       if prog == 'RNAfold':
         regex += (
@@ -69,8 +351,45 @@ class RNAvienna(object):
           r'*(?P<efe_binding>\S+)'
         )
 
-    if 'temperature' in kwargs:
-      cmd.append('--temp=' + str(kwargs.get('temperature')))
+    if temperature is not None:
+      cmd.append('--temp=' + str(temperature))
+
+    return cmd, regex
+
+  @staticmethod
+  def _parse(stdout, regex, nb_results):
+    """Parses the concatenated results of a (multi-record) run."""
+    results = [_decode(match) for match in re.finditer(regex, stdout)]
+    if len(results) != nb_results:
+      raise ValueError("Expected %i folding results, parsed %i." % (
+        nb_results, len(results)))
+    return results
+
+  @staticmethod
+  def _input(records, constraints=None):
+    """Returns the standard input of records (lists of sequences)."""
+    lines = []
+    for i, seqs in enumerate(records):
+      lines.append('&'.join(seqs))
+      if constraints is not None:
+        lines.append(constraints[i])
+    lines.append('')
+    return '\n'.join(lines)
+
+  def _fold_many(self, records, prog, constraints=None, **kwargs):
+    if len(records) == 0:
+      return []
+    cmd, regex = self._command(
+      prog, constraints is not None, kwargs.get('partfunc', False),
+      kwargs.get('temperature')
+    )
+
+    pool = self._get_pool()
+    if pool is not None:
+      return pool.run(cmd, regex, [
+        self._input([seqs], None if constraints is None else [constraints[i]])
+        for i, seqs in enumerate(records)
+      ])
 
     p = subprocess.Popen(
       cmd,
@@ -80,15 +399,7 @@ class RNAvienna(object):
     )
 
     stdout, stderr = p.communicate(
-      '\n'.join(['&'.join(seqs), kwargs.get('constraints', '')]).encode()
+      self._input(records, constraints).encode()
     )
 
-    decoded = re.match(regex, stdout.decode())
-    result = {}
-    for k, v in decoded.groupdict().items():
-      if 'structure' in k:
-        result[k] = v
-      else:
-        result[k] = float(v)
-
-    return result
+    return self._parse(stdout.decode(), regex, len(records))
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from mirmap import cache, exact, prob
+
+
+class CountingExactProb(exact.ExactProb):
+  def __init__(self):
+    self.nb_computed = 0
+
+  def get_exact_probs(self, motifs, *args):
+    self.nb_computed += len(motifs)
+    return exact.ExactProb.get_exact_probs(self, motifs, *args)
+
+
+class TestCache(unittest.TestCase):
+  def setUp(self):
+    self.tmp_dir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.tmp_dir)
+
+  def test_make_key(self):
+    self.assertEqual(cache.make_key('a', (1, 2)), cache.make_key('a', [1, 2]))
+    self.assertNotEqual(cache.make_key('a', 1), cache.make_key('a', 2))
+    seq = 'AUGCAUGGAUUAGCCGAUUUACAG'
+    t1 = prob.get_transitions(seq, ['U', 'A', 'C', 'G'], 1)
+    t2 = prob.get_transitions(seq, ['G', 'C', 'A', 'U'], 1)
+    self.assertEqual(cache.background_key(['U', 'A', 'C', 'G'], 1, t1),
+                     cache.background_key(['G', 'C', 'A', 'U'], 1, t2))
+
+  def test_result_cache(self):
+    path = os.path.join(self.tmp_dir, 'cache.sqlite')
+    ob = cache.ResultCache(path, maxsize=2)
+    ob['a'] = [1, 'x']
+    ob.set_many([('b', 0.5), ('c', None)])
+    self.assertEqual(ob['b'], 0.5)
+    self.assertEqual(ob['a'], [1, 'x'])
+    self.assertIsNone(ob.get('d'))
+    with self.assertRaises(KeyError):
+      ob['d']
+    self.assertEqual(ob.stats['memory_hits'], 1)
+    self.assertEqual(ob.stats['disk_hits'], 1)
+    self.assertEqual(ob.stats['misses'], 2)
+    ob.close()
+    ob = cache.ResultCache(path)
+    self.assertEqual(ob['a'], [1, 'x'])
+    self.assertEqual(ob.stats['disk_hits'], 1)
+    ob.close()
+
+  def test_cached_exact_prob(self):
+    seq = 'AUGCAUGGAUUAGCCGAUUUACAG'
+    alphabet = ['U', 'A', 'C', 'G']
+    transitions = prob.get_transitions(seq, alphabet, 1)
+    path = os.path.join(self.tmp_dir, 'cache.sqlite')
+    backend = CountingExactProb()
+    ob = cache.CachedExactProb(backend, cache.ResultCache(path))
+    args = (['GCA', 'AUA', 'GCA'], [1, 2, 1], 300, alphabet, transitions, 1)
+    probs = ob.get_exact_probs(*args)
+    self.assertEqual(probs, exact.ExactProb().get_exact_probs(*args))
+    self.assertEqual(backend.nb_computed, 2)
+    self.assertEqual(ob.get_exact_probs(*args), probs)
+    self.assertEqual(ob.get_exact_prob(
+      motif='AUA', nobs=2, length_seq=300, alphabet=alphabet,
+      transitions=transitions, markov_order=1), probs[1])
+    self.assertEqual(backend.nb_computed, 2)
+    self.assertEqual(ob.cache.stats['hits'], 4)
+    ob.cache.close()
+    ob = cache.CachedExactProb(backend, cache.ResultCache(path))
+    self.assertEqual(ob.get_exact_probs(*args), probs)
+    self.assertEqual(backend.nb_computed, 2)
+    # Another engine version doesn't share the results
+    backend.version = lambda: 'other'
+    ob = cache.CachedExactProb(backend, ob.cache)
+    self.assertEqual(ob.get_exact_probs(*args), probs)
+    self.assertEqual(backend.nb_computed, 4)
+    ob.cache.close()
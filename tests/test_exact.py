@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+
+import itertools
+import unittest
+
+import numpy as np
+
+from mirmap import exact, prob, utils
+
+
+def brute_force(motif, length_seq, alphabet, transitions, markov_order,
+                start_word=None):
+  """Counts distribution by enumeration of every sequence."""
+  start = exact.stationary_distribution(alphabet, markov_order, transitions)
+  words = list(prob.permutations(alphabet, markov_order + 1))
+  probs = dict(zip(words, utils.flatten(transitions)))
+  starts = dict(zip(prob.permutations(alphabet, markov_order), start))
+  if start_word is not None:
+    starts = dict((word, float(word == start_word)) for word in starts)
+  dist = {}
+  for letters in itertools.product(alphabet, repeat=length_seq):
+    seq = ''.join(letters)
+    p = starts[seq[:markov_order]]
+    for i in range(len(seq) - markov_order):
+      p *= probs[seq[i:i + markov_order + 1]]
+    count = sum(1 for i in range(len(seq)) if seq.startswith(motif, i))
+    dist[count] = dist.get(count, 0.) + p
+  return dist
+
+
+class TestExact(unittest.TestCase):
+  def setUp(self):
+    seq = 'AUGCAUGGAUUAGCCGAUUUACAGAAUGGCAAAUGGCUUAG'
+    self.alphabet = ['U', 'A', 'C', 'G']
+    self.transitions = dict(
+      (order, prob.get_transitions(seq, self.alphabet, order))
+      for order in [0, 1, 2])
+
+  def test_count_distribution(self):
+    for order, motif, start_word in itertools.product(
+        [0, 1, 2], ['A', 'AA', 'GCA', 'AUAU', 'UAG'], [None, 'first']):
+      if start_word is not None:
+        start_word = exact.start_word(motif, order)
+      ref = brute_force(motif, 7, self.alphabet, self.transitions[order],
+                        order, start_word)
+      for max_count in [0, 1, 2, 4]:
+        dist = exact.count_distribution(
+          motif, 7, max_count, self.alphabet, self.transitions[order],
+          order, start_word)
+        self.assertAlmostEqual(dist.sum(), 1.)
+        for c in range(max_count):
+          self.assertAlmostEqual(dist[c], ref.get(c, 0.))
+        self.assertAlmostEqual(dist[max_count], sum(
+          p for c, p in ref.items() if c >= max_count))
+
+  def test_step_by_step(self):
+    args = ('AUA', 300, 6, self.alphabet, self.transitions[1], 1)
+    dist = exact.count_distribution(*args)
+    max_power_states = exact.MAX_POWER_STATES
+    try:
+      exact.MAX_POWER_STATES = 0
+      np.testing.assert_allclose(exact.count_distribution(*args), dist,
+                                 rtol=1e-9)
+    finally:
+      exact.MAX_POWER_STATES = max_power_states
+
+  def test_get_exact_probs(self):
+    ob = exact.ExactProb()
+    motifs = ['GCA', 'AUA', 'GCA', 'ANA', '']
+    nobs = [1, 3, 2, 1, 0]
+    probs = ob.get_exact_probs(motifs, nobs, 500, self.alphabet,
+                               self.transitions[1], 1)
+    self.assertEqual(probs[3], 0.)
+    self.assertEqual(probs[4], 1.)
+    self.assertGreater(probs[0], probs[2])
+    self.assertAlmostEqual(probs[1], ob.get_exact_prob(
+      motif='AUA', nobs=3, length_seq=500, alphabet=self.alphabet,
+      transitions=self.transitions[1], markov_order=1, direction='o'))
@@ -169,6 +169,41 @@ class TestRealModel(BaseTestModel):
       #: Validate if python-only model is used.
       self.assertEqual(obj.model, 'python_only_seed')
 
+  def test_iter_features(self):
+    _mirs = utils.load_fasta('tests/input/hsa-miR-30a-3p.fa')
+    _mrnas = utils.load_fasta('tests/input/NM_024573.fa')
+    obj = miRmap(seq_mrn=_mrnas['NM_024573'],
+                 seq_mir=_mirs['hsa-miR-30a-3p'])
+    features = list(obj.iter_features())
+    self.assertEqual([s.end_site for s, _ in features], [931, 931])
+    self.assertAlmostEqualList([f['tgs_au'] for _, f in features],
+                               [-0.05019, -0.11319], places=4)
+    self.assertAlmostEqualList([f['prob_binomial'] for _, f in features],
+                               [0.07013, 0.83698], places=4)
+
+  def test_site_table(self):
+    _mirs = utils.load_fasta('tests/input/hsa-miR-30a-3p.fa')
+    _mrnas = utils.load_fasta('tests/input/NM_024573.fa')
+    obj = miRmap(seq_mrn=_mrnas['NM_024573'],
+                 seq_mir=_mirs['hsa-miR-30a-3p'])
+    obj.routine()
+    self.assertEqual(obj.site_table['end_sites'].tolist(), [931, 931])
+    self.assertAlmostEqualList(obj.site_table['tgs_au'].tolist(),
+                               obj._target_scan.tgs_aus)
+    self.assertEqual(obj.site_table['score'].tolist(), obj.scores)
+    # The columns are shared with the seed and the modules
+    self.assertIs(obj.site_table['end_sites'],
+                  obj._seed.site_table['end_sites'])
+    self.assertIs(obj.site_table['tgs_au'],
+                  obj._target_scan.site_table['tgs_au'])
+    # A missing feature counts as 0
+    table = obj._build_site_table()
+    del table.columns['tgs_au']
+    model = obj.model_select(obj.site_table['seed_lengths'][0])
+    tgs_au = obj.site_table['tgs_au'][0] * model['_target_scan.tgs_au']
+    self.assertAlmostEqual(obj._score_table(table)[0],
+                           obj.scores[0] - tgs_au)
+
 
 class TestKnownScore(BaseTestModel):
   def setUp(self):
@@ -289,6 +324,14 @@ class TestPropertyAccess(BaseTestModel):
     except ValueError:
       pass
 
+  def test_probability_exact_engine(self):
+    # Recorded with sspatt
+    args = dict(self.init_args,
+                prob_args={'exact_engine': 'python', 'skip_exact': False})
+    obj = miRmap(**args)
+    self.assertAlmostEqual(obj.probability_features['prob_exact'], 0.06799,
+                           places=5)
+
   def test_evolutionary_features(self):
     obj = miRmap(**self.init_args)
     try:
@@ -1,5 +1,11 @@
 # -*- coding: utf-8 -*-
 
+import math
+import os
+import pickle
+import random
+import shutil
+import tempfile
 import unittest
 
 from mirmap import prob
@@ -32,3 +38,66 @@ class TestProb(unittest.TestCase):
     alp = ["A", "U", "G", "C"]
     t = prob.get_transitions(seq, alp, 1)
     self.assertEqual(prob.prob_motif("AU", alp, 2, t), 1.0)
+
+  def test_markov_model(self):
+    random.seed(8)
+    seq = ''.join(random.choice('ACGU') for _ in range(500))
+    alp = ['U', 'A', 'C', 'G']
+    for order in [0, 1, 2]:
+      t = prob.get_transitions(seq, alp, order)
+      model = prob.MarkovModel(alp, order, t)
+      motifs = [seq[i:i + random.randint(0, 9)] for i in range(0, 400, 7)]
+      for motif in motifs:
+        self.assertEqual(model.prob(motif),
+                         prob.prob_motif(motif, alp, order, t))
+      log_probs = model.log_probs_batch(motifs)
+      for motif, log_prob in zip(motifs, log_probs):
+        self.assertAlmostEqual(log_prob, model.log_prob(motif))
+        self.assertAlmostEqual(math.exp(log_prob), model.prob(motif))
+      copy = pickle.loads(pickle.dumps(model))
+      self.assertEqual(copy, model)
+      self.assertEqual(hash(copy), hash(model))
+      self.assertEqual(model, prob.MarkovModel.from_seq(seq, alp, order))
+
+  def test_count_words(self):
+    random.seed(9)
+    seq = ''.join(random.choice('ACGUN') for _ in range(300))
+    alp = ['U', 'A', 'C', 'G']
+    for order in [0, 1, 2, 3, 5]:
+      counts = prob.count_words(seq, alp, order)
+      self.assertEqual(counts, prob._count_words_python(seq, alp, order))
+      ref = prob.transitions_from_counts(counts, alp, order)
+      self.assertEqual(prob.get_transitions(seq, alp, order, cache=False), ref)
+    self.assertEqual(prob.count_words('AC', alp, 2),
+                     prob._count_words_python('AC', alp, 2))
+    self.assertEqual(prob.count_words('AUé', ['A', 'U', 'é'], 1),
+                     prob._count_words_python('AUé', ['A', 'U', 'é'], 1))
+
+  def test_transitions_cache(self):
+    prob.transitions_cache.clear()
+    t1 = prob.get_transitions("AUGCAUGGA", ["U", "A", "C", "G"], 1)
+    t2 = prob.get_transitions("AUGCAUGGA", ["U", "A", "C", "G"], 1)
+    self.assertEqual(t1, t2)
+    self.assertEqual(prob.transitions_cache.stats['hits'], 1)
+    # Modifying a returned matrix doesn't change the cached one
+    t2[0][0] = 99.
+    t2[1] = []
+    self.assertEqual(prob.get_transitions(
+      "AUGCAUGGA", ["U", "A", "C", "G"], 1), t1)
+    t3 = prob.get_transitions("AUGCAUGGA", ["U", "A", "C", "G"], 2)
+    self.assertIsNot(t1, t3)
+
+  def test_markov_model_fit(self):
+    seqs = ["AUGCAUGGA", "NGGCAUUUAC", "A"]
+    alp = ["U", "A", "C", "G"]
+    model = prob.MarkovModel.fit(seqs, alp, 1)
+    self.assertEqual(
+      model.transitions,
+      prob.get_transitions("AUGCAUGGAXNGGCAUUUACXA", alp, 1, cache=False))
+    tmp_dir = tempfile.mkdtemp()
+    try:
+      filename = os.path.join(tmp_dir, 'background.json')
+      model.save(filename)
+      self.assertEqual(prob.MarkovModel.load(filename), model)
+    finally:
+      shutil.rmtree(tmp_dir)
@@ -1,8 +1,9 @@
 # -*- coding: utf-8 -*-
 
+import random
 import unittest
 
-from mirmap import prob_binomial, seed, utils
+from mirmap import cache, exact, prob, prob_binomial, seed, utils
 
 
 class TestProbBinomial(unittest.TestCase):
@@ -20,10 +21,36 @@ class TestProbBinomial(unittest.TestCase):
     ])
     self.assertAlmostEqual(prob_binomial.binom_cdf(2, 4, 0.8), out)
 
+  def test_binom_sf(self):
+    for n in [1, 4, 30, 300]:
+      for k in range(n + 1):
+        for p in [0., 1e-5, 0.01, 0.2, 0.8, 1.]:
+          self.assertAlmostEqual(
+            float(prob_binomial.binom_sf(k, n, p)),
+            1. - prob_binomial.binom_cdf(k, n, p),
+            places=10
+          )
+    self.assertEqual(
+      prob_binomial.binom_sf([0, 2], [4, 4], [0.8, 0.8]).shape, (2,))
+
   def test_binomial_pdf(self):
     self.assertAlmostEqual(prob_binomial.binom_pmf(2, 4, 0.8), 0.15359, 4)
 
 
+class TestMotifCounter(unittest.TestCase):
+  def test_count(self):
+    random.seed(7)
+    seq = ''.join(random.choice('AACGU') for _ in range(2000)) + 'AAAAAAAA'
+    counter = prob_binomial.MotifCounter(seq)
+    motifs = ['AAAA', 'AAA', 'ACAC', 'GUAC', 'ANA', 'C', '', seq + 'A']
+    motifs += [seq[i:i + 7] for i in range(0, 1990, 97)]
+    for motif in motifs:
+      self.assertEqual(counter.count(motif), seq.count(motif))
+    self.assertEqual(sorted(counter.tables), [1, 3, 4, 7])
+    self.assertIs(prob_binomial.motif_counter(seq),
+                  prob_binomial.motif_counter(seq))
+
+
 class TestMmProbBinomial(unittest.TestCase):
   def setUp(self):
     _mirs = utils.load_fasta('tests/input/hsa-miR-30a-3p.fa')
@@ -59,6 +86,72 @@ class TestMmProbBinomial(unittest.TestCase):
     self.assertEqual(r, t)
     self.assertEqual(ob.prob_binomial, min(r))
 
+  def test_engines(self):
+    ob = prob_binomial.mmProbBinomial(self.seed, engine='numpy')
+    r = [0.07012894456680518, 0.8369842777406993]
+    for v1, v2 in zip(ob._eval_prob_binomial(), r):
+      self.assertAlmostEqual(v1, v2, places=12)
+    for (_, features), v in zip(ob.iter_features(), r):
+      self.assertAlmostEqual(features['prob_binomial'], v, places=12)
+
+  def test_background(self):
+    alp = list(set(self.seed.target_seq))
+    background = prob.MarkovModel.fit(
+      [self.seed.target_seq, self.seed.mirna_seq], alp, 2)
+    ob = prob_binomial.mmProbBinomial(self.seed, background=background)
+    self.assertEqual(ob.markov_order, 2)
+    self.assertIs(ob._markov_model(), background)
+    ref = prob_binomial.mmProbBinomial(
+      self.seed, alphabet=alp, markov_order=2,
+      transitions=background.transitions)
+    self.assertEqual(ob._eval_prob_binomial(), ref._eval_prob_binomial())
+
+  def test_markov_model_cache(self):
+    alp = list(set(self.seed.target_seq))
+    transitions = [list(t) for t in prob.get_transitions(
+      self.seed.target_seq, alp, 1, cache=False)]
+    ob = prob_binomial.mmProbBinomial(
+      self.seed, alphabet=alp, transitions=transitions)
+    model = ob._markov_model()
+    self.assertIs(ob._markov_model(), model)
+    # Compiled again when the transitions are assigned
+    transitions[0] = [0.25] * len(transitions[0])
+    self.assertIs(ob._markov_model(), model)
+    ob.transitions = transitions
+    self.assertIsNot(ob._markov_model(), model)
+    self.assertEqual(ob._markov_model().transitions[0], transitions[0])
+
+  def test_exact_engine(self):
+    ob = prob_binomial.mmProbBinomial(
+      self.seed, skip_exact=False, exact_engine='python')
+    probs = ob._eval_prob_exact()
+    self.assertEqual(len(probs), 2)
+    for (_, features), p in zip(ob.iter_features(), probs):
+      self.assertEqual(features['prob_exact'], p)
+      self.assertTrue(0. <= p <= 1.)
+    self.assertEqual(ob.prob_exact, min(probs))
+
+    exact_cache = cache.ResultCache()
+    for _ in range(2):
+      ob = prob_binomial.mmProbBinomial(
+        self.seed, skip_exact=False, exact_engine='python',
+        exact_cache=exact_cache)
+      self.assertEqual(ob._eval_prob_exact(), probs)
+    self.assertEqual(exact_cache.stats['misses'], 2)
+    self.assertEqual(exact_cache.stats['hits'], 2)
+
+    # Per site (spatt path): the cached backend is built once
+    ob = prob_binomial.mmProbBinomial(
+      self.seed, skip_exact=False, spatt=exact.ExactProb(),
+      exact_cache=cache.ResultCache())
+    self.assertEqual(ob._eval_prob_exact(), probs)
+    backend = ob._exact_backend(ob.spatt)
+    self.assertIs(backend.backend, ob.spatt)
+    background = backend._background
+    self.assertEqual(ob._eval_prob_exact(), probs)
+    self.assertIs(ob._exact_backend(ob.spatt), backend)
+    self.assertIs(backend._background, background)
+
   @unittest.expectedFailure
   def test_eval_prob_exact(self):
     ob = prob_binomial.mmProbBinomial(self.seed, skip_exact=False)
@@ -72,3 +165,12 @@ class TestMmProbBinomial(unittest.TestCase):
     ob = prob_binomial.mmProbBinomial(self.seed)
     r = [0.07012894456680518, 0.8369842777406993]
     self.assertEqual(ob.prob_binomial, min(r))
+
+  def test_iter_features(self):
+    ob = prob_binomial.mmProbBinomial(self.seed)
+    features = list(ob.iter_features())
+    self.assertEqual([s for s, _ in features],
+                     list(self.seed.found_sites()))
+    self.assertEqual([f['prob_binomial'] for _, f in features],
+                     ob._eval_prob_binomial())
+    self.assertEqual([f['prob_exact'] for _, f in features], [0, 0])
@@ -1,5 +1,7 @@
 # -*- coding: utf-8 -*-
 
+import io
+import random
 import unittest
 
 import mirmap
@@ -154,3 +156,96 @@ class TestSeed(unittest.TestCase):
     self.assertEqual(obj.nb_mismatches_except_gu_wobbles,
                      tr4['nb_mismatches_except_gu_wobbles'])
     self.assertEqual(obj.nb_gu_wobbles, tr4['nb_gu_wobbles'])
+
+  def test_engines(self):
+    configs = [
+      {},
+      {'allowed_gu_wobbles': {6: 0, 7: 1, 8: 2}},
+      {'allowed_gu_wobbles': {6: 0, 7: 1, 8: 2}, 'take_best': True},
+      {'allowed_gu_wobbles': {6: 1, 7: 1, 8: 2},
+       'allowed_mismatches': {6: 0, 7: 1, 8: 1}},
+      {'allowed_gu_wobbles': {6: 1, 7: 2, 8: 2},
+       'allowed_mismatches': {6: 1, 7: 2, 8: 2}},
+      {'allowed_gu_wobbles': {6: 2, 7: 3, 8: 8},
+       'allowed_mismatches': {6: 2, 7: 3, 8: 9}, 'take_best': True},
+      {'mirna_start_pairing': 0},
+      {'min_target_length': 3},
+    ]
+    random.seed(0)
+    targets = [self._mrnas['NM_024573']] + [
+      ''.join(random.choice('ACGUN') for _ in range(300)) for _ in range(5)
+    ]
+    for target_seq in targets:
+      for config in configs:
+        args = {
+          'target_seq': target_seq,
+          'mirna_seq': self._mirs['hsa-miR-30a-3p'],
+        }
+        args.update(config)
+        ref = seed.mmSeed(**args).find_potential_targets_with_seed()
+        for engine in ['numpy', 'table', 'bitparallel']:
+          obj = seed.mmSeed(engine=engine, **args)
+          self.assertEqual(obj.find_potential_targets_with_seed(), ref)
+
+    with self.assertRaises(ValueError):
+      seed.mmSeed(target_seq="AUGC", mirna_seq="AUGC",
+                  engine='unknown').find_potential_targets_with_seed()
+
+  def test_kmer_codes(self):
+    self.assertEqual(
+      seed.kmer_codes('ACGUNA', 2).tolist(),
+      [1, 6, 11, 16, 16]
+    )
+    self.assertEqual(seed.kmer_code('UA'), 12)
+
+  def test_seed_table(self):
+    tables = seed.get_seed_table('CUUUCAGUCGG', 2, [6, 7, 8],
+                                 {6: 0, 7: 0, 8: 2}, {6: 0, 7: 0, 8: 0})
+    self.assertEqual(sorted(tables.keys()), [6, 7, 8])
+    self.assertEqual(list(tables[6].values()),
+                     [(6, 0, 0, [0, 2, 3, 4, 5, 6, 7])])
+    # UUUCAG + 2 GU wobbles among the 5 U/G
+    self.assertEqual(len(tables[8]), 1 + 5 + 10)
+    self.assertIs(
+      seed.get_seed_table('CUUUCAGUCGG', 2, [6, 7, 8],
+                          {6: 0, 7: 0, 8: 2}, {6: 0, 7: 0, 8: 0}),
+      tables
+    )
+
+  def test_iter_sites(self):
+    obj = seed.mmSeed(
+      target_seq=self._mrnas['NM_024573'],
+      mirna_seq=self._mirs['hsa-miR-30a-3p'],
+      allowed_mismatches={6: 0, 7: 0, 8: 1}
+    )
+    sites = list(obj.iter_sites())
+    with self.assertRaises(AttributeError):
+      obj.end_sites
+    self.assertIsInstance(sites[0], seed.Site)
+
+    obj.find_potential_targets_with_seed()
+    self.assertEqual(list(obj.found_sites()), sites)
+    self.assertEqual([s.end_site for s in sites], obj.end_sites)
+    self.assertEqual([s.pairing for s in sites], obj.pairings)
+
+  def test_iter_sites_from_file(self):
+    random.seed(3)
+    target_seq = self._mrnas['NM_024573']
+    random_seq = ''.join(random.choice('ACGUN') for _ in range(400))
+    fasta = '>NM_024573 test\n%s\n' % '\n'.join(
+      target_seq[i:i + 60] for i in range(0, len(target_seq), 60))
+    for config in [
+      {},
+      {'allowed_gu_wobbles': {6: 1, 7: 2, 8: 2},
+       'allowed_mismatches': {6: 1, 7: 1, 8: 2}, 'take_best': True},
+      {'min_target_length': 3, 'engine': 'numpy'},
+    ]:
+      for seq, text in [(target_seq, fasta),
+                        (random_seq, random_seq.replace('U', 't'))]:
+        obj = seed.mmSeed(target_seq=seq,
+                          mirna_seq=self._mirs['hsa-miR-30a-3p'], **config)
+        ref = sorted(obj.iter_sites(), key=lambda s: s.end_site)
+        for chunk_size in [7, 100, 100000]:
+          sites = list(obj.iter_sites_from_file(io.StringIO(text),
+                                                chunk_size))
+          self.assertEqual(sites, ref)
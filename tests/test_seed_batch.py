@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+
+import random
+import unittest
+
+from mirmap import seed, seed_batch, utils
+
+
+class TestSeedBatch(unittest.TestCase):
+  def setUp(self):
+    random.seed(2)
+    self.mirna_seqs = utils.load_fasta('tests/input/hsa-miR-30a-3p.fa')
+    for i in range(20):
+      self.mirna_seqs['random%i' % i] = ''.join(
+        random.choice('ACGU') for _ in range(22)
+      )
+    self.target_seqs = [
+      utils.load_fasta('tests/input/NM_024573.fa')['NM_024573'],
+      ''.join(random.choice('ACGUN') for _ in range(500)),
+    ]
+
+  def test_find_potential_targets_with_seed(self):
+    configs = [
+      {},
+      {'allowed_gu_wobbles': {6: 0, 7: 1, 8: 2}, 'take_best': True},
+      {'allowed_gu_wobbles': {6: 1, 7: 2, 8: 2},
+       'allowed_mismatches': {6: 1, 7: 1, 8: 2}},
+      {'mirna_start_pairing': 0},
+      {'min_target_length': 3},
+    ]
+    for config in configs:
+      batch = seed_batch.mmSeedBatch(self.mirna_seqs, **config)
+      for target_seq in self.target_seqs:
+        found = batch.find_potential_targets_with_seed(target_seq)
+        self.assertEqual(list(found.keys()), list(self.mirna_seqs.keys()))
+        for mirna_id, mirna_seq in self.mirna_seqs.items():
+          ref = seed.mmSeed(
+            target_seq=target_seq, mirna_seq=mirna_seq, **config
+          ).find_potential_targets_with_seed()
+          self.assertEqual(found[mirna_id], ref)
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+
+import random
+import shutil
+import tempfile
+import unittest
+
+from mirmap import seed, seed_index, utils
+
+
+class TestSeedIndex(unittest.TestCase):
+  def setUp(self):
+    random.seed(1)
+    self.mirna_seq = utils.load_fasta(
+      'tests/input/hsa-miR-30a-3p.fa')['hsa-miR-30a-3p']
+    self.seqs = utils.load_fasta('tests/input/NM_024573.fa')
+    for i in range(10):
+      self.seqs['random%i' % i] = ''.join(
+        random.choice('ACGUN') for _ in range(random.randint(5, 400))
+      )
+    self.path = tempfile.mkdtemp()
+    seed_index.build_seed_index(self.seqs, self.path, k=6)
+
+  def tearDown(self):
+    shutil.rmtree(self.path)
+
+  def test_find_potential_targets_with_seed(self):
+    index = seed_index.SeedIndex(self.path)
+    configs = [
+      {},
+      {'allowed_gu_wobbles': {6: 0, 7: 1, 8: 2}, 'take_best': True},
+      {'allowed_gu_wobbles': {6: 1, 7: 2, 8: 2},
+       'allowed_mismatches': {6: 1, 7: 1, 8: 2}},
+      {'mirna_start_pairing': 0},
+      {'min_target_length': 3},
+    ]
+    for config in configs:
+      found = index.find_potential_targets_with_seed(self.mirna_seq, **config)
+      for transcript_id, target_seq in self.seqs.items():
+        ref = seed.mmSeed(
+          target_seq=target_seq, mirna_seq=self.mirna_seq, **config
+        ).find_potential_targets_with_seed()
+        if len(ref['end_sites']) > 0:
+          self.assertEqual(found.pop(transcript_id), ref)
+      self.assertEqual(found, {})
+
+    with self.assertRaises(ValueError):
+      index.find_potential_targets_with_seed(
+        self.mirna_seq, allowed_lengths=[5, 6]
+      )
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+import numpy as np
+
+from mirmap import seed, sites, targetscan, utils
+
+
+class TestSiteTable(unittest.TestCase):
+  def setUp(self):
+    self.mirna_seq = utils.load_fasta(
+      'tests/input/hsa-miR-30a-3p.fa')['hsa-miR-30a-3p']
+    self.target_seq = utils.load_fasta('tests/input/NM_024573.fa')['NM_024573']
+
+  def test_from_seed(self):
+    for config in [
+      {},
+      {'allowed_gu_wobbles': {6: 1, 7: 2, 8: 2},
+       'allowed_mismatches': {6: 1, 7: 1, 8: 2}},
+      {'mirna_start_pairing': 0},
+    ]:
+      mm_seed = seed.mmSeed(target_seq=self.target_seq,
+                            mirna_seq=self.mirna_seq, **config)
+      mm_seed.routine()
+      table = sites.SiteTable.from_seed(mm_seed)
+      self.assertEqual(len(table), len(mm_seed.end_sites))
+      self.assertEqual(list(table), list(mm_seed.found_sites()))
+      self.assertEqual(table['end_sites'].dtype, np.int32)
+
+  def test_add_column(self):
+    table = sites.SiteTable.from_sites([
+      seed.Site(10, 7, 0, 0, [0, 2, 3, 4, 5, 6, 7, 8]),
+      seed.Site(20, 6, 1, 0, [0, 2, 0, 4, 5, 6, 7]),
+    ])
+    self.assertEqual(table['pairing_masks'].tolist(), [254, 122])
+    table.add_column('tgs_au', [0.5, None])
+    self.assertEqual(table['tgs_au'][0], 0.5)
+    self.assertTrue(np.isnan(table['tgs_au'][1]))
+    self.assertIs(table['tgs_au'], table.columns['tgs_au'])
+    self.assertRaises(ValueError, table.add_column, 'dg_open', [1.])
+
+  def test_column_lists(self):
+    mm_seed = seed.mmSeed(target_seq=self.target_seq,
+                          mirna_seq=self.mirna_seq,
+                          allowed_mismatches={6: 1, 7: 1, 8: 1})
+    with self.assertRaises(AttributeError):
+      mm_seed.end_sites
+    out = mm_seed.find_potential_targets_with_seed()
+    table = mm_seed.site_table
+    self.assertEqual(mm_seed.end_sites, table['end_sites'].tolist())
+    self.assertEqual(mm_seed.pairings, [s.pairing for s in table])
+    self.assertEqual(out['seed_lengths'], mm_seed.seed_lengths)
+    with self.assertRaises(AttributeError):
+      mm_seed.end_sites = []
+
+    ob = targetscan.mmTargetScan(mm_seed)
+    other = targetscan.mmTargetScan(mm_seed, with_correction=False)
+    with self.assertRaises(AttributeError):
+      ob.tgs_aus
+    ob.routine()
+    other.routine()
+    self.assertIs(ob.site_table['end_sites'], table['end_sites'])
+    self.assertNotIn('tgs_au', table)
+    self.assertNotEqual(ob.tgs_scores, other.tgs_scores)
+    ob.tgs_aus = [None] * len(table)
+    self.assertEqual(ob.tgs_aus, [None] * len(table))
+    self.assertTrue(np.isnan(ob.site_table['tgs_au']).all())
+
+    # The same list until the column is set again; writes go to the column
+    tgs_aus = ob.tgs_aus
+    self.assertIs(ob.tgs_aus, tgs_aus)
+    self.assertIs(mm_seed.end_sites, mm_seed.end_sites)
+    tgs_aus[0] = 0.5
+    self.assertEqual(ob.site_table['tgs_au'][0], 0.5)
+    tgs_aus[1:] = [0.25] * (len(table) - 1)
+    self.assertEqual(ob.tgs_aus, [0.5] + [0.25] * (len(table) - 1))
+    with self.assertRaises(TypeError):
+      tgs_aus.append(0.5)
+    with self.assertRaises(TypeError):
+      tgs_aus[:] = []
+    with self.assertRaises(TypeError):
+      mm_seed.end_sites[0] = 1
+    ob._eval_tgs_au()
+    self.assertIsNot(ob.tgs_aus, tgs_aus)
+    self.assertNotEqual(ob.tgs_aus[0], 0.5)
+
+    # New sites: the features are computed again
+    mm_seed.find_potential_targets_with_seed()
+    ob._eval_tgs_position()
+    self.assertEqual(ob.site_table.names,
+                     list(mm_seed.site_table.names) + ['tgs_position'])
+
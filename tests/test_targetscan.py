@@ -1,10 +1,13 @@
 # -*- coding: utf-8 -*-
 
+import pickle
+import random
+
 from collections import namedtuple
 
 import mirmap
 
-from mirmap import targetscan, seed
+from mirmap import targetscan, seed, sites
 from tests.test_model import BaseTestModel
 
 
@@ -214,3 +217,134 @@ class TestTargetScan(BaseTestModel):
       -0.07732527755219891,
       places=5
     )
+
+  def test_iter_features(self):
+    obj = targetscan.mmTargetScan(seed=self.seed)
+    obj.routine()
+    features = list(obj.iter_features())
+    self.assertEqual([s for s, _ in features],
+                     list(self.seed.found_sites()))
+    for key in ['tgs_au', 'tgs_position', 'tgs_pairing3p', 'tgs_score']:
+      self.assertAlmostEqualList(
+        [f[key] for _, f in features], getattr(obj, key + 's'))
+
+  def test_edge_site(self):
+    # 7mer-A1 site at the 5' end of the target, with no miRNA 3' sequence
+    mm_seed = seed.mmSeed(target_seq='GUUUACA' + 'C' * 30,
+                          mirna_seq='UGUAAAC')
+    site = seed.Site(7, 7, 0, 0, [0, 2, 3, 4, 5, 6, 7])
+    mm_seed.site_table = sites.SiteTable.from_sites([site])
+    ref = targetscan.mmTargetScan(mm_seed)
+    ref.routine()
+    self.assertEqual(ref.tgs_pairing3ps, [None])
+    self.assertEqual(ref.tgs_scores, [None])
+    for options in [{}, {'fused': True}, {'engine': 'numpy', 'fused': True}]:
+      obj = targetscan.mmTargetScan(mm_seed, **options)
+      _, features = next(obj.iter_features([site]))
+      self.assertIsNone(features['tgs_pairing3p'])
+      self.assertIsNone(features['tgs_score'])
+      for key in ['tgs_au', 'tgs_position']:
+        self.assertAlmostEqual(features[key], getattr(ref, key + 's')[0])
+      obj.routine()
+      for key in targetscan.FEATURES:
+        self.assertEqual(getattr(obj, key + 's'), getattr(ref, key + 's'))
+
+  def test_pairing3p_score(self):
+    random.seed(5)
+    for _ in range(300):
+      utr_3p_seq = ''.join(random.choice('ACGU')
+                           for _ in range(random.randint(0, 15)))
+      mir_3p_seq = ''.join(random.choice('ACGUN')
+                           for _ in range(random.randint(0, 16)))
+      overhang = random.choice([0, 1])
+      if max(len(utr_3p_seq), len(mir_3p_seq)) == 0:
+        with self.assertRaises(ValueError):
+          targetscan.pairing3p_score(utr_3p_seq, mir_3p_seq, overhang)
+        continue
+      ref = max(
+        [targetscan.align_helper(utr_3p_seq, mir_3p_seq, o, 0, overhang)
+         for o in range(max(len(utr_3p_seq), len(mir_3p_seq)))] +
+        [targetscan.align_helper(utr_3p_seq, mir_3p_seq, 0, o, overhang)
+         for o in range(max(len(utr_3p_seq), len(mir_3p_seq)))]
+      )
+      self.assertEqual(
+        targetscan.pairing3p_score(utr_3p_seq, mir_3p_seq, overhang), ref)
+    hits = targetscan.pairing3p_cache.hits
+    targetscan.pairing3p_score(utr_3p_seq, mir_3p_seq, overhang)
+    self.assertEqual(targetscan.pairing3p_cache.hits, hits + 1)
+
+  def test_engines(self):
+    random.seed(4)
+    mirna_seq = self.seed.mirna_seq
+    targets = [self.seed.target_seq] + [
+      ''.join(random.choice('ACGUN') for _ in range(300)) for _ in range(3)
+    ]
+    for target_seq in targets:
+      mm_seed = seed.mmSeed(target_seq=target_seq, mirna_seq=mirna_seq,
+                            allowed_mismatches={6: 2, 7: 2, 8: 2},
+                            min_target_length=3)
+      mm_seed.find_potential_targets_with_seed()
+      for args in [{}, {'with_correction': False},
+                   {'ca_window_length': 12}, {'ca_window_length': 40}]:
+        ref = targetscan.mmTargetScan(mm_seed, **args)
+        ref.routine()
+        for options in [{'engine': 'numpy'}, {'fused': True},
+                        {'engine': 'numpy', 'fused': True}]:
+          options.update(args)
+          obj = targetscan.mmTargetScan(mm_seed, **options)
+          obj.routine()
+          for key in ['tgs_aus', 'tgs_positions', 'tgs_pairing3ps',
+                      'tgs_scores']:
+            self.assertEqual([v is None for v in getattr(obj, key)],
+                             [v is None for v in getattr(ref, key)])
+            self.assertAlmostEqualList(getattr(obj, key),
+                                       getattr(ref, key), places=10)
+
+  def test_batch(self):
+    random.seed(6)
+    mirna_seq = self.seed.mirna_seq
+    target_seqs = [self.seed.target_seq] + [
+      ''.join(random.choice('ACGU') for _ in range(400)) for _ in range(3)
+    ]
+    inputs = []
+    refs = []
+    for target_seq in target_seqs:
+      mm_seed = seed.mmSeed(target_seq=target_seq, mirna_seq=mirna_seq,
+                            allowed_mismatches={6: 1, 7: 1, 8: 1})
+      mm_seed.find_potential_targets_with_seed()
+      inputs.append((target_seq, sites.SiteTable.from_seed(mm_seed)))
+      ref = targetscan.mmTargetScan(mm_seed, with_correction=False)
+      ref.routine()
+      refs.append(ref)
+    batch = pickle.loads(pickle.dumps(
+      targetscan.mmTargetScanBatch(mirna_seq, with_correction=False)))
+    columns = batch(inputs)
+    self.assertEqual(
+      columns['transcripts'].tolist(),
+      [i for i, ref in enumerate(refs) for _ in ref.seed.end_sites])
+    self.assertEqual(columns['end_sites'].tolist(),
+                     [e for ref in refs for e in ref.seed.end_sites])
+    for feature in targetscan.FEATURES:
+      self.assertAlmostEqualList(
+        columns[feature].tolist(),
+        [v for ref in refs for v in getattr(ref, feature + 's')],
+        places=10
+      )
+    # The shared mmTargetScan is never given a seed
+    self.assertIsNone(batch._target_scan.seed)
+
+    # With the correction, from seed.Site lists and with the python engine
+    for engine in ['numpy', 'python']:
+      batch = targetscan.mmTargetScanBatch(mirna_seq, engine=engine)
+      columns = batch([(t, list(s)) for t, s in inputs])
+      for i, (target_seq, target_sites) in enumerate(inputs):
+        ref = targetscan.mmTargetScan(refs[i].seed)
+        ref.routine()
+        end_sites, features = batch.evaluate_target(target_seq, target_sites)
+        self.assertEqual(end_sites.tolist(), ref.seed.end_sites)
+        for feature in targetscan.FEATURES:
+          self.assertAlmostEqualList(features[feature].tolist(),
+                                     getattr(ref, feature + 's'), places=10)
+      self.assertEqual(len(columns['end_sites']),
+                       sum(len(s) for _, s in inputs))
+    self.assertEqual(len(batch([])['tgs_score']), 0)
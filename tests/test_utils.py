@@ -69,6 +69,24 @@ class TestUtils(unittest.TestCase):
       utils.reverse_complement("ATGGCCATTGTAA"),
       "TACCGGTAACATT"[::-1]
     )
+    self.assertEqual(utils.reverse_complement("acgNRyu-"), "-arYNcgu")
+    self.assertEqual(utils.reverse_complement("ACGT"), "ACGT")
+    self.assertEqual(utils.reverse_complement(b"AACGU"), b"ACGUU")
+    seq = "AUGGCCAUUGUAA" * 10
+    self.assertEqual(utils.reverse_complement(seq, memo=True),
+                     utils.reverse_complement(seq))
+    self.assertIs(utils.reverse_complement(seq, memo=True),
+                  utils.reverse_complement(seq, memo=True))
+
+  def test_lru_cache(self):
+    cache = utils.LRUCache(2)
+    cache['a'] = 1
+    cache['b'] = 2
+    self.assertEqual(cache['a'], 1)
+    cache['c'] = 3
+    self.assertNotIn('b', cache)
+    self.assertEqual(cache.get('b'), None)
+    self.assertEqual(cache.stats, {'hits': 1, 'misses': 1, 'size': 2})
 
   def test_rgetattr(self):
     self.assertEqual(self.maxDiff, utils.rgetattr(self, 'maxDiff'))
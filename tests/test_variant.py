@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+import warnings
+
+from mirmap import utils, variant
+from mirmap.model import miRmap
+
+
+class TestVariant(unittest.TestCase):
+  def setUp(self):
+    warnings.simplefilter('ignore')
+    self.mirna_seq = utils.load_fasta(
+      'tests/input/hsa-miR-30a-3p.fa')['hsa-miR-30a-3p']
+    self.target_seq = utils.load_fasta('tests/input/NM_024573.fa')['NM_024573']
+    self.seed_args = {'allowed_mismatches': {6: 1, 7: 1, 8: 1}}
+
+  def assertSameTable(self, table, ref):
+    self.assertEqual(table.names, ref.names)
+    for name in ref.names:
+      self.assertEqual(table[name].tolist(), ref[name].tolist(), name)
+
+  def test_apply_edits(self):
+    self.assertEqual(
+      variant.apply_edits('ACGUACGU', [variant.Edit(5, 'AC', 'G'),
+                                       variant.Edit(1, 'A', 'AUU')]),
+      ('AUUCGUGGU', 0, 6, 7)
+    )
+    self.assertRaises(ValueError, variant.apply_edits, 'ACGU',
+                      [variant.Edit(2, 'G', 'A')])
+    self.assertRaises(ValueError, variant.apply_edits, 'ACGU',
+                      [variant.Edit(2, 'CG', 'A'), variant.Edit(3, 'G', '')])
+
+  def test_rescore(self):
+    ref = miRmap(seq_mrn=self.target_seq, seq_mir=self.mirna_seq,
+                 seed_args=self.seed_args)
+    mm_variant = variant.mmVariant(ref)
+    sites = ref._seed.end_sites
+    seq = ref._seed.target_seq
+    for edits in [
+      # SNPs in and around a site
+      [variant.Edit(sites[0] - 3, seq[sites[0] - 4], 'G')],
+      [variant.Edit(sites[0] - 45, seq[sites[0] - 46], 'A')],
+      # Indels
+      [variant.Edit(sites[-1] + 2, seq[sites[-1] + 1:sites[-1] + 6], '')],
+      [variant.Edit(300, seq[299], seq[299] + 'UUUGAAAU')],
+      # Ends of the sequence
+      [variant.Edit(1, seq[:30], 'A')],
+      [variant.Edit(len(seq) - 2, seq[-3:], 'CCCCAAAACUGAAAGAAA')],
+      # New nucleotide
+      [variant.Edit(500, seq[499], 'N'), variant.Edit(10, seq[9], 'C')],
+      # No site left
+      [variant.Edit(1, seq, 'A' * 100)],
+    ]:
+      edited_seq = variant.apply_edits(seq, edits)[0]
+      full = miRmap(seq_mrn=edited_seq, seq_mir=self.mirna_seq,
+                    seed_args=self.seed_args)
+      full.routine()
+      self.assertSameTable(mm_variant.rescore(edits), full.site_table)
+
+
+if __name__ == '__main__':
+  unittest.main()
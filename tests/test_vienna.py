@@ -1,8 +1,52 @@
 # -*- coding: utf-8 -*-
 
-from mirmap import vienna
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import unittest
+
+from mirmap import cache, seed, thermodynamics, utils, vienna
 from tests.test_model import BaseTestModel
 
+#: Stand-in for RNAfold and RNAcofold: energies from the sequence lengths,
+#: exiting after FAKE_VIENNA_CRASH records if set
+FAKE_VIENNA = """#!%s
+import os
+import sys
+
+crash = int(os.environ.get('FAKE_VIENNA_CRASH', 0))
+constraint = '--constraint' in sys.argv
+partfunc = '--partfunc' in sys.argv
+cofold = sys.argv[0].endswith('RNAcofold')
+nb_records = 0
+while True:
+  seq = sys.stdin.readline().strip()
+  if seq == '':
+    break
+  if constraint:
+    sys.stdin.readline()
+  if crash and nb_records == crash:
+    sys.exit(1)
+  length = len(seq.replace('&', ''))
+  structure = '.' * length if not cofold else '&'.join(
+    '.' * len(s) for s in seq.split('&'))
+  print(seq)
+  print('%%s (%%6.2f)' %% (structure, -length / 10.))
+  if partfunc and cofold:
+    print('%%s [%%6.2f]' %% (structure, -length / 5.))
+    print(' frequency of mfe structure in ensemble 0.5 , '
+          'delta G binding=%%6.2f' %% (-length / 20.))
+  elif partfunc:
+    print('%%s [%%6.2f]' %% (structure, -length / 5.))
+    print('%%s {%%6.2f d=1.00}' %% (structure, -length / 10.))
+    print(' frequency of mfe structure in ensemble 0.5; '
+          'ensemble diversity 2.00  ')
+  sys.stdout.flush()
+  nb_records += 1
+""" % sys.executable
+
 #: ONLY tests for Initialization. Properties are tested in Model test.
 
 
@@ -37,3 +81,203 @@ class TestVienna(BaseTestModel):
       self.assertEqual(folded['mfe_frequency'], 0.467001)
     except EnvironmentError:
       pass
+
+  def test_parse_many(self):
+    cmd, regex = vienna.RNAvienna._command('RNAfold', True, True, 37.0)
+    self.assertEqual(cmd, ['RNAfold', '--noPS', '--constraint', '--partfunc',
+                           '--temp=37.0'])
+    self.assertEqual(
+      vienna.RNAvienna._input([['ACGU'], ['GGCC']], ['x...', '....']),
+      'ACGU\nx...\nGGCC\n....\n')
+    record = (
+      "CCGCACAGCGGGCAGUGCCC\n"
+      "((((.((....)).)))).. ( -5.00)\n"
+      "((((.{{....}}.)))).. [ -5.73]\n"
+      "((((.((....)).)))).. { -5.00 d=4.39}\n"
+      " frequency of mfe structure in ensemble 0.308;"
+      " ensemble diversity 6.38  \n"
+    )
+    results = vienna.RNAvienna._parse(record * 3, regex, 3)
+    self.assertEqual(len(results), 3)
+    self.assertEqual(results[2]['mfe'], -5.0)
+    self.assertEqual(results[2]['dist'], 4.39)
+    self.assertEqual(results[2]['cfe_structure'], '((((.((....)).))))..')
+    with self.assertRaises(ValueError):
+      vienna.RNAvienna._parse(record * 2, regex, 3)
+
+    cmd, regex = vienna.RNAvienna._command('RNAcofold', partfunc=True)
+    record = (
+      "CCGCACAGCGGGCAGUGCCC&CCGCACAGCGGGCAGUGCCC\n"
+      "((((.((....)).))))..&((((.((....)).)))).. (-21.40)\n"
+      "((((.{{....}}.))))..&((((.{{....}}.)))).. [-22.18]\n"
+      " frequency of mfe structure in ensemble 0.467001 ,"
+      " delta G binding= -5.90\n"
+    )
+    results = vienna.RNAvienna._parse(record * 2, regex, 2)
+    self.assertEqual(results[1]['mfe'], -21.4)
+    self.assertEqual(results[1]['efe_binding'], -5.9)
+    self.assertEqual(results[0]['mfe_frequency'], 0.467001)
+
+
+class TestViennaPool(unittest.TestCase):
+  def setUp(self):
+    self.tmp_dir = tempfile.mkdtemp()
+    for prog in ['RNAfold', 'RNAcofold']:
+      filename = os.path.join(self.tmp_dir, prog)
+      with open(filename, 'w') as f:
+        f.write(FAKE_VIENNA)
+      os.chmod(filename, os.stat(filename).st_mode | stat.S_IEXEC)
+    self.path = os.environ['PATH']
+    os.environ['PATH'] = self.tmp_dir + os.pathsep + self.path
+    self.seqs = ['ACGU' * (1 + i % 7) for i in range(50)]
+
+  def tearDown(self):
+    os.environ['PATH'] = self.path
+    os.environ.pop('FAKE_VIENNA_CRASH', None)
+    shutil.rmtree(self.tmp_dir)
+
+  def test_pool(self):
+    ref = vienna.RNAvienna()
+    ob = vienna.RNAvienna(pool_size=3, max_pending=4)
+    try:
+      for kwargs in [{}, {'partfunc': True, 'temperature': 30.}]:
+        results = ob.fold_many(self.seqs, **kwargs)
+        self.assertEqual(results, ref.fold_many(self.seqs, **kwargs))
+        self.assertEqual(results[6]['mfe'], -2.8)
+        pairs = [(seq, 'UUU') for seq in self.seqs]
+        constraints = ['.' * (len(seq) + 3) for seq in self.seqs]
+        results = ob.cofold_many(pairs, constraints, **kwargs)
+        self.assertEqual(
+          results, ref.cofold_many(pairs, constraints, **kwargs))
+        self.assertEqual(ob.cofold(*pairs[1], **kwargs), results[1])
+      self.assertEqual(len(ob.pool.processes), 6)
+      # Shared by the instances of a process, by handle
+      other = vienna.RNAvienna(pool_size=3, max_pending=4)
+      self.assertIs(other.pool, ob.pool)
+      self.assertEqual(ob.pool.refs, 2)
+      self.assertIs(vienna._pools[os.getpid(), 3, 4], ob.pool)
+      other.close()
+      self.assertEqual(ob.pool.refs, 1)
+      self.assertEqual(len(ob.pool.processes), 6)
+      # Taken again after close
+      other.fold(self.seqs[0])
+      self.assertEqual(ob.pool.refs, 2)
+      other.close()
+    finally:
+      ob.close()
+
+  @unittest.skipUnless(hasattr(os, 'fork'), 'No fork')
+  def test_pool_fork(self):
+    ref = vienna.RNAvienna().fold(self.seqs[6])
+    ob = vienna.RNAvienna(pool_size=1)
+    try:
+      pool = ob.pool
+      ob.fold(self.seqs[6])
+      pid = os.fork()
+      if pid == 0:
+        # The child doesn't use nor stop the processes of its parent
+        ok = ob.fold(self.seqs[6]) == ref and ob.pool is not pool
+        ob.close()
+        os._exit(0 if ok and pool.refs == 1 and pool.processes else 1)
+      self.assertEqual(os.waitpid(pid, 0)[1], 0)
+      self.assertEqual(pool.refs, 1)
+      self.assertEqual(ob.fold(self.seqs[6]), ref)
+    finally:
+      ob.close()
+
+  def test_restart(self):
+    ref = vienna.RNAvienna().fold_many(self.seqs, partfunc=True)
+    os.environ['FAKE_VIENNA_CRASH'] = '7'
+    ob = vienna.RNAvienna(pool_size=2, max_pending=3)
+    try:
+      self.assertEqual(ob.fold_many(self.seqs, partfunc=True), ref)
+      processes = list(ob.pool.processes.values())[0]
+      self.assertTrue(all(p.nb_restarts > 0 for p in processes))
+    finally:
+      ob.close()
+
+  def test_thermo(self):
+    mirs = utils.load_fasta('tests/input/hsa-miR-30a-3p.fa')
+    mrnas = utils.load_fasta('tests/input/NM_024573.fa')
+    mm_seed = seed.mmSeed(target_seq=mrnas['NM_024573'],
+                          mirna_seq=mirs['hsa-miR-30a-3p'])
+    mm_seed.find_potential_targets_with_seed()
+    ref = thermodynamics.mmThermo(mm_seed)
+    ob = thermodynamics.mmThermo(mm_seed, vienna_pool_size=2)
+    with ob.fold:
+      ob.routine()
+      features = [f for _, f in ref.iter_features(mm_seed.found_sites())]
+      self.assertEqual(ob.dg_duplexs, [f['dg_duplex'] for f in features])
+      self.assertEqual(ob.dg_opens, [f['dg_open'] for f in features])
+      self.assertEqual(ob.dg_totals, [f['dg_total'] for f in features])
+      # The processes are shared
+      other = thermodynamics.mmThermo(mm_seed, vienna_pool_size=2)
+      self.assertIs(other.fold.pool, ob.fold.pool)
+      pool = ob.fold.pool
+      processes = dict(pool.processes)
+      other.routine()
+      self.assertEqual(other.dg_totals, ob.dg_totals)
+      self.assertEqual(pool.processes, processes)
+    # Only the handle of ob is given back
+    self.assertIsNone(ob.fold.pool)
+    self.assertEqual(pool.processes, processes)
+    other.fold.close()
+    other.fold.close()
+    self.assertEqual(len(pool.processes), 0)
+    self.assertEqual(pool.refs, 0)
+    self.assertNotIn(pool, vienna._pools.values())
+
+  def test_cached(self):
+    ref = vienna.RNAvienna().fold_many(self.seqs, partfunc=True)
+    path = os.path.join(self.tmp_dir, 'folds.sqlite')
+    ob = cache.CachedRNAvienna(cache.ResultCache(path, maxsize=4))
+    self.assertEqual(ob.fold_many(self.seqs, partfunc=True), ref)
+    self.assertEqual(ob.cache.stats['misses'], 50)
+    self.assertEqual(ob.fold(self.seqs[8], partfunc=True), ref[8])
+    self.assertEqual(ob.cache.stats['hits'], 1)
+    self.assertNotEqual(ob.fold(self.seqs[8]), ref[8])
+    ob.cache.close()
+    ob = cache.CachedRNAvienna(cache.ResultCache(path), pool_size=1)
+    try:
+      self.assertEqual(ob.fold_many(self.seqs, partfunc=True), ref)
+      # 7 distinct sequences
+      self.assertEqual(ob.cache.stats['disk_hits'], 7)
+      self.assertEqual(ob.cache.stats['hits'], 50)
+      self.assertEqual(len(ob.pool.processes), 0)
+    finally:
+      ob.close()
+      ob.cache.close()
+
+  def test_seed_duplex_table(self):
+    mirs = utils.load_fasta('tests/input/hsa-miR-30a-3p.fa')
+    mrnas = utils.load_fasta('tests/input/NM_024573.fa')
+    mm_seed = seed.mmSeed(target_seq=mrnas['NM_024573'],
+                          mirna_seq=mirs['hsa-miR-30a-3p'])
+    mm_seed.find_potential_targets_with_seed()
+    ref = thermodynamics.mmThermo(mm_seed)
+    ob = thermodynamics.mmThermo(mm_seed, seed_duplex_table=True)
+    table = ob.get_seed_duplex_table()
+    self.assertIs(ob.get_seed_duplex_table(), table)
+    for site in mm_seed.found_sites():
+      seed_pair = ob._site_dg_duplex_inputs(
+        site.end_site, site.seed_length, site.pairing)[0]
+      self.assertIn((seed_pair[0].replace('T', 'U'), seed_pair[1]), table)
+    ob.routine()
+    ref.routine()
+    self.assertEqual(ob.dg_duplex_seeds, ref.dg_duplex_seeds)
+    self.assertEqual(ob.dg_binding_seeds, ref.dg_binding_seeds)
+    # Not in the table: co-folded
+    self.assertEqual(ob._seed_duplex_results([('NNNNNN', 'GGGGGG')]),
+                     ref.fold.cofold_many([('NNNNNN', 'GGGGGG')],
+                                          partfunc=True, temperature=37.0))
+
+    # No site: the table isn't built
+    thermodynamics._seed_duplex_tables.clear()
+    mm_seed = seed.mmSeed(target_seq='A' * 80,
+                          mirna_seq=mirs['hsa-miR-30a-3p'])
+    mm_seed.find_potential_targets_with_seed()
+    self.assertEqual(len(mm_seed.end_sites), 0)
+    ob = thermodynamics.mmThermo(mm_seed, seed_duplex_table=True)
+    ob.routine()
+    self.assertEqual(ob.dg_duplexs, [])
+    self.assertEqual(len(thermodynamics._seed_duplex_tables), 0)